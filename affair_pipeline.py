@@ -0,0 +1,227 @@
+"""
+Staged producer/consumer pipeline that streams affairs through the processing phases.
+
+`main.py` used to run Document Intelligence for every affair before the first
+GPT call, so nothing could be extracted until the last PDF of the last affair
+was digitized. Here each phase is a `Stage` (a function applied to one affair
+item by one or more worker threads), and consecutive stages are connected by
+bounded queues: an affair moves on to GPT as soon as its own documents are
+ingested, while the next affair is still in DI.
+
+    affairs -> [list blobs] -> [DI + ingest] -> [fetch docs] -> [classify]
+            -> [GPT extraction] -> [post-process] -> [persist] -> results
+
+The queue bound (`queue_size`) is the back-pressure: a fast stage blocks once
+that many affairs wait for the next one, which caps the affairs (and their
+document contents) held in memory. Finished items are kept until the run
+ends, so the last stage should persist the results and return only a small
+summary of the affair (as `main.py` does).
+Inputs are pulled only when the first stage can start one, and
+`max_in_flight` optionally caps the affairs anywhere in the pipeline.
+
+Errors
+------
+An exception in a stage is printed with the affair and stage name and the
+affair is dropped; the other affairs keep flowing. Once the pipeline has
+drained, the first error is re-raised, so a failing affair still fails the run.
+
+Reporting
+---------
+`run_staged_pipeline` prints the time to the first finished affair, the total
+wall-clock and, per stage, the items processed and the busy time (the stage
+with the highest busy share is the bottleneck to scale).
+
+Usage (minimal)
+---------------
+    stages = [Stage("di", run_di), Stage("gpt", run_gpt, workers=2), Stage("persist", persist)]
+    results = run_staged_pipeline(({"affair": a} for a in affairs), stages, queue_size=2)
+"""
+
+from __future__ import annotations
+import queue
+import threading
+import time
+import traceback
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+_DONE = object()
+
+
+class Stage:
+    """One pipeline step: `fn(item) -> item` run by `workers` threads."""
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1) -> None:
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.items = 0
+        self.busy_s = 0.0
+        self._lock = threading.Lock()
+        self._running = 0
+
+    def _worker(
+        self,
+        inbox: "queue.Queue[Any]",
+        outbox: "queue.Queue[Any]",
+        errors: List[Tuple[str, Any, BaseException]],
+        on_error: Optional[Callable[[Any, BaseException], None]] = None,
+        on_idle: Optional[Callable[[], None]] = None,
+        on_drop: Optional[Callable[[], None]] = None,
+    ) -> None:
+        while True:
+            if on_idle is not None:
+                on_idle()
+            item = inbox.get()
+            if item is _DONE:
+                with self._lock:
+                    self._running -= 1
+                    last = self._running == 0
+                # wake up the sibling workers, then close the next stage once all are done
+                (outbox if last else inbox).put(_DONE)
+                return
+            t0 = time.perf_counter()
+            try:
+                result = self.fn(item)
+            except Exception as exc:
+                print(f"ERROR pipeline stage '{self.name}' failed for {item_label(item)}: {exc}")
+                traceback.print_exc()
+                errors.append((self.name, item, exc))
+                if on_error is not None:
+                    on_error(item, exc)
+                result = None
+            with self._lock:
+                self.items += 1
+                self.busy_s += time.perf_counter() - t0
+            if result is not None:
+                outbox.put(result)
+            elif on_drop is not None:
+                on_drop()
+
+
+def item_label(item: Any) -> str:
+    """The affair name of a pipeline item (dicts carrying an "affair" key), else its repr."""
+    return str(item.get("affair")) if isinstance(item, dict) else repr(item)
+
+
+def run_staged_pipeline(
+    items: Iterable[Any],
+    stages: List[Stage],
+    queue_size: int = 2,
+    on_result: Optional[Callable[[Any], None]] = None,
+    on_error: Optional[Callable[[Any, BaseException], None]] = None,
+    max_in_flight: Optional[int] = None,
+) -> List[Any]:
+    """
+    Stream `items` through `stages` and return the items leaving the last stage.
+
+    Parameters
+    ----------
+    items : iterable
+        Pipeline inputs, consumed lazily by a feeder thread.
+    stages : list[Stage]
+        Steps in order. A stage returning None drops the item.
+    queue_size : int, default 2
+        Bound of every queue between two stages (back-pressure).
+    on_result : callable or None
+        Called in the calling thread with each finished item, as it finishes.
+    on_error : callable or None
+        Called in the failing worker thread with `(item, exception)` when a
+        stage raises (the item is dropped).
+    max_in_flight : int or None
+        Maximum items between input and output (None: only bounded by the
+        queues). The next input is pulled once an item finished or was
+        dropped.
+
+    Inputs are pulled from `items` only when a worker of the first stage is
+    ready to start one, so a lazy iterable with side effects (e.g. claiming a
+    lease, see `leases.claim_affairs`) runs just before its item is processed.
+
+    Returns
+    -------
+    list
+        Finished items, in completion order. They are all held until the
+        pipeline drains: have the last stage return a per-affair summary
+        rather than the extracted tables.
+    """
+    t0 = time.perf_counter()
+    queues: List["queue.Queue[Any]"] = [
+        queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages))
+    ]
+    queues.append(queue.Queue())  # finished items, drained by this thread
+    errors: List[Tuple[str, Any, BaseException]] = []
+    ready = threading.Semaphore(0)  # one release per first-stage worker waiting for an item
+    slots = threading.Semaphore(max_in_flight) if max_in_flight else None
+    release_slot = slots.release if slots is not None else None
+
+    def _feed() -> None:
+        try:
+            inputs = iter(items)
+            while True:
+                ready.acquire()
+                if slots is not None:
+                    slots.acquire()
+                item = next(inputs, _DONE)
+                if item is _DONE:
+                    break
+                queues[0].put(item)
+        except Exception as exc:
+            print(f"ERROR pipeline input failed: {exc}")
+            errors.append(("input", None, exc))
+        finally:
+            queues[0].put(_DONE)
+
+    threads = [threading.Thread(target=_feed, name="pipeline-input", daemon=True)]
+    for i, stage in enumerate(stages):
+        stage._running = stage.workers
+        threads += [
+            threading.Thread(
+                target=stage._worker,
+                args=(
+                    queues[i], queues[i + 1], errors, on_error,
+                    ready.release if i == 0 else None, release_slot,
+                ),
+                name=f"pipeline-{stage.name}-{w}",
+                daemon=True,
+            )
+            for w in range(stage.workers)
+        ]
+    for thread in threads:
+        thread.start()
+
+    results: List[Any] = []
+    first_s: Optional[float] = None
+    while True:
+        item = queues[-1].get()
+        if item is _DONE:
+            break
+        if first_s is None:
+            first_s = time.perf_counter() - t0
+        results.append(item)
+        if on_result is not None:
+            on_result(item)
+        if release_slot is not None:
+            release_slot()
+    for thread in threads:
+        thread.join()
+
+    print_pipeline_summary(stages, len(results), first_s, time.perf_counter() - t0)
+    if errors:
+        failed = ", ".join(f"{item_label(item)} ({stage})" for stage, item, _ in errors)
+        print(f"pipeline: {len(errors)} failed: {failed}")
+        raise errors[0][2]
+    return results
+
+
+def print_pipeline_summary(
+    stages: List[Stage], n_results: int, first_s: Optional[float], elapsed_s: float
+) -> None:
+    """Print time to first result, total wall-clock and per-stage busy time."""
+    print("\n========== Pipeline ==========")
+    first = f", first result after {first_s:.1f}s" if first_s is not None else ""
+    print(f"{n_results} affairs in {elapsed_s:.1f}s wall-clock{first}")
+    for stage in stages:
+        share = stage.busy_s / (elapsed_s * stage.workers) if elapsed_s > 0 else 0.0
+        print(
+            f"{stage.name}: {stage.items} items, {stage.busy_s:.1f}s busy "
+            f"({stage.workers} workers, {share:.0%} utilized)"
+        )
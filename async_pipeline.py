@@ -0,0 +1,611 @@
+"""
+Asyncio end-to-end pipeline on the `aio` Azure clients and `AsyncAzureOpenAI`.
+
+The synchronous pipeline blocks a thread on every network call (Blob download,
+DI polling, Cosmos reads and upserts, OpenAI completions). This module runs the
+same flow on one event loop, so hundreds of calls are in flight at once on a
+single core:
+
+1) Document Intelligence (optional): the PDFs of every affair are selected
+   from the blob inventory (`blob_inventory.affair_fingerprints`, as in
+   `main.py`), then processed like `process_affair_document_intelligence`
+   (fingerprint check, download -> analyze -> upsert per PDF).
+2) GPT extraction: every affair's documents are read like `get_docs`,
+   classified with `get_cpcgav`, optionally resolved against the CG registry,
+   then extracted like `run_cgcp_pipeline` / `run_avenants_pipeline` (all
+   calls of all affairs gathered), merged with `build_affair_df`, saved locally
+   and upserted to the results container.
+
+Outputs are identical to the synchronous path: prompts, cache keys, payloads
+and result items are built by the same helpers of `di_module` and
+`gpt_module`, and the cache / continuation / parse flow of an extraction is
+the network-free `gpt_module.response_df_steps`, driven here by `arun_steps`;
+only the service calls are awaited. As in `main.py`, the DI phase of all affairs completes
+before any affair's documents are read.
+
+Concurrency
+-----------
+Each service gets its own `asyncio.Semaphore` (`DEFAULT_CONCURRENCY`, keys
+"openai", "di", "blob", "cosmos", plus "affairs" for the affairs in flight),
+and every call goes through `resilience.acall_with_retry` (throttling and
+transient errors retried, counted in `print_resilience_summary`). The RPM/TPM
+limiters of `rate_limiter` are still honored, acquired in a worker thread.
+Blocking local work (DI and LLM disk caches, token counting and section
+filtering, PDF page counts, Markdown and Excel writes) also runs in worker
+threads (`asyncio.to_thread`), so it never stalls the calls in flight.
+
+Scope
+-----
+Whole-document DI analyses with a plain model (`prebuilt-layout` or
+`prebuilt-read`); page-range splitting, tiered DI and the DI journal, row-level
+storage, the batched document query and the Batch API stay on the synchronous
+path (see the `--async-io` checks in `main.py`).
+
+Usage (minimal)
+---------------
+    asyncio.run(run_pipeline_async(["mason", "anagra"], ..., run_di=True))
+"""
+
+from __future__ import annotations
+import asyncio
+import hashlib
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from azure.ai.documentintelligence.models import AnalyzeResult
+from azure.core.exceptions import HttpResponseError
+
+from blob_inventory import affair_fingerprints
+from clients import close_async_clients, get_async_clients
+from di_module import (
+    FINGERPRINT_QUERY,
+    analyze_kwargs,
+    analyze_result_to_dict,
+    blob_fingerprint,
+    build_di_payload,
+    count_pdf_pages,
+    print_di_throughput,
+    print_price_estimations,
+    select_affair,
+    select_changed_pdfs,
+    slugify_path,
+    write_local_mk_files,
+)
+from gpt_module import (
+    DOCS_BY_COMPANY_QUERY,
+    DOCS_BY_ID_QUERY,
+    affair_table_item,
+    av_identifiers,
+    avenant_messages,
+    avenants_df,
+    build_affair_df,
+    build_cgcp_messages,
+    cg_identifiers,
+    cgcp_df_from_chunks,
+    cp_identifiers,
+    exclude_docs,
+    get_cpcgav,
+    print_resp_properties,
+    rectify_df,
+    response_df_steps,
+    save_df_local,
+    tool_completion_body,
+    verify_cpcgav_separation,
+)
+from rate_limiter import estimate_request_tokens
+from resilience import acall_with_retry
+
+DEFAULT_CONCURRENCY = {"openai": 16, "di": 8, "blob": 32, "cosmos": 32, "affairs": 8}
+
+
+def make_semaphores(concurrency: Optional[Dict[str, int]] = None) -> Dict[str, asyncio.Semaphore]:
+    """One semaphore per service, `DEFAULT_CONCURRENCY` overridden by `concurrency`."""
+    limits = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+    return {name: asyncio.Semaphore(max(1, n)) for name, n in limits.items()}
+
+
+async def acquire_limiter(rate_limiter: Optional[Any], tokens: int) -> float:
+    """`rate_limiter.acquire(tokens)` in a worker thread (0.0 without limiter)."""
+    if rate_limiter is None:
+        return 0.0
+    return await asyncio.to_thread(rate_limiter.acquire, tokens)
+
+
+async def query_items_async(
+    cosmos_container: Any,
+    query: str,
+    parameters: List[Dict[str, Any]],
+    label: str = "query",
+    verbose: bool = True,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    **kwargs: Any,
+) -> List[Dict[str, Any]]:
+    """
+    Async `query_items_instrumented`: run a query and log its RU charge, pages and latency.
+
+    The aio SDK queries across partitions unless `partition_key` is given. RU
+    charges are read after each page, as in the synchronous version.
+    """
+    charges: List[float] = []
+
+    async def _collect() -> List[Dict[str, Any]]:
+        charges.clear()
+        items: List[Dict[str, Any]] = []
+        pages = cosmos_container.query_items(query=query, parameters=parameters, **kwargs).by_page()
+        async for page in pages:
+            items.extend([item async for item in page])
+            headers = cosmos_container.client_connection.last_response_headers or {}
+            charges.append(float(headers.get("x-ms-request-charge", 0) or 0))
+        return items
+
+    t0 = time.perf_counter()
+    items = await acall_with_retry("cosmos.aio.query_items", _collect, semaphore=semaphore)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    if verbose:
+        print(
+            f"[cosmos] {label}: {len(items)} items, {sum(charges):.1f} RU, "
+            f"{len(charges)} pages, {elapsed_ms:.0f} ms"
+        )
+    return items
+
+
+async def get_docs_async(
+    company_name: str,
+    cosmos_digitaliezd: Any,
+    exclude_flag: bool = True,
+    verbose: bool = True,
+    lookup: str = "id",
+    partition_key: Optional[str] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> List[Dict[str, Any]]:
+    """Async `get_docs` (same queries, company-lookup fallback and exclusions)."""
+    params = [{"name": "@kw", "value": company_name}]
+    docs: List[Dict[str, Any]] = []
+    if lookup == "company":
+        kwargs = {"partition_key": partition_key} if partition_key is not None else {}
+        docs = await query_items_async(
+            cosmos_digitaliezd, DOCS_BY_COMPANY_QUERY, [{"name": "@kw", "value": company_name.lower()}],
+            label=f"get_docs[company]({company_name})", verbose=verbose, semaphore=semaphore, **kwargs,
+        )
+        if not docs:
+            print("WARNING company lookup found no docs, falling back to id substring query")
+    if not docs:
+        docs = await query_items_async(
+            cosmos_digitaliezd, DOCS_BY_ID_QUERY, params, label=f"get_docs({company_name})",
+            verbose=verbose, semaphore=semaphore,
+        )
+    return exclude_docs(docs, exclude_flag, verbose)
+
+
+async def filter_unchanged_pdfs_async(
+    cosmos_digitaliezd: Any,
+    pdfs_company: List[str],
+    fingerprints: Dict[str, Dict[str, Optional[str]]],
+    analyse_doc_model: str,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> List[str]:
+    """Async `filter_unchanged_pdfs` (one fingerprint query, same comparison)."""
+    if not pdfs_company:
+        return pdfs_company
+    ids = {slugify_path(pdf): pdf for pdf in pdfs_company}
+    items = await query_items_async(
+        cosmos_digitaliezd, FINGERPRINT_QUERY, [{"name": "@ids", "value": list(ids)}],
+        label="DI fingerprints", verbose=False, semaphore=semaphore,
+    )
+    stored = {item["id"]: item for item in items}
+    return select_changed_pdfs(ids, stored, fingerprints, analyse_doc_model)
+
+
+async def analyze_pdf_async(
+    cosmos_digitaliezd: Any,
+    container: Any,
+    client_di: Any,
+    pdf_name: str,
+    semaphores: Dict[str, asyncio.Semaphore],
+    analyse_doc_model: str = "prebuilt-layout",
+    fingerprint: Optional[Dict[str, Optional[str]]] = None,
+    di_cache: Optional[Any] = None,
+    rate_limiter: Optional[Any] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Async `analyze_pdf`: download, analyze (or reuse the DI cache) and upsert one PDF.
+
+    The DI semaphore is held from submission until the poller's result, so it
+    bounds the analyses in flight. An `HttpResponseError` is printed and the
+    file skipped (returns None), as in the synchronous path.
+    """
+    if fingerprint is None:
+        properties = await acall_with_retry(
+            "blob.aio.get_blob_properties",
+            container.get_blob_client(pdf_name).get_blob_properties,
+            semaphore=semaphores["blob"],
+        )
+        fingerprint = blob_fingerprint(properties)
+
+    async def _download() -> bytes:
+        stream = await container.download_blob(pdf_name)
+        return await stream.readall()
+
+    async def _analyze(pdf_bytes: bytes) -> Any:
+        poller = await client_di.begin_analyze_document(
+            analyse_doc_model, pdf_bytes, **analyze_kwargs(analyse_doc_model)
+        )
+        return await poller.result()
+
+    pdf_bytes = await acall_with_retry("blob.aio.download_blob", _download, semaphore=semaphores["blob"])
+    try:
+        cache_key = f"{hashlib.sha256(pdf_bytes).hexdigest()}|{analyse_doc_model}"
+        cached = await asyncio.to_thread(di_cache.get, cache_key) if di_cache is not None else None
+        if cached is not None:
+            print("DI cache hit:", pdf_name)
+            res = AnalyzeResult(cached)
+        else:
+            n_pages = await asyncio.to_thread(count_pdf_pages, pdf_bytes)
+            waited = await acquire_limiter(rate_limiter, n_pages or 1)
+            if waited > 0:
+                print(f"DI rate limiter: waited {waited:.1f}s before {pdf_name}")
+            res = await acall_with_retry(
+                "di.aio.begin_analyze_document", _analyze, pdf_bytes, semaphore=semaphores["di"]
+            )
+            if di_cache is not None:
+                await asyncio.to_thread(di_cache.put, cache_key, analyze_result_to_dict(res))
+        payload = build_di_payload(pdf_name, res, analyse_doc_model, fingerprint)
+        await acall_with_retry(
+            "cosmos.aio.upsert_item", cosmos_digitaliezd.upsert_item, payload,
+            semaphore=semaphores["cosmos"],
+        )
+        return payload
+    except HttpResponseError as e:
+        print(f"ERROR processing {pdf_name}: {e}")
+        return None
+
+
+async def process_affair_document_intelligence_async(
+    cosmos_digitaliezd: Any,
+    container: Any,
+    client_di: Any,
+    affair: Optional[str],
+    local_path: Path,
+    fingerprints: Dict[str, Dict[str, Optional[str]]],
+    semaphores: Dict[str, asyncio.Semaphore],
+    skip_unchanged: bool = True,
+    di_cache: Optional[Any] = None,
+    analyse_doc_model: str = "prebuilt-layout",
+    rate_limiter: Optional[Any] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Async `process_affair_document_intelligence` for pre-listed `fingerprints`.
+
+    Every PDF of the affair is analyzed concurrently (bounded by the service
+    semaphores); payloads keep the order of the affair's PDF list.
+    """
+    pdfs_all = list(fingerprints)
+    print("len(pdfs_all):", len(pdfs_all))
+    pdfs_company = select_affair(pdfs_all, affair)
+    for pdf in pdfs_company:
+        print(pdf)
+    print("len(pdfs_company) = ", len(pdfs_company))
+    if skip_unchanged:
+        pdfs_company = await filter_unchanged_pdfs_async(
+            cosmos_digitaliezd, pdfs_company, fingerprints, analyse_doc_model, semaphores["cosmos"]
+        )
+    t0 = time.perf_counter()
+    results = await gather_or_raise(
+        *(
+            analyze_pdf_async(
+                cosmos_digitaliezd, container, client_di, pdf_name, semaphores, analyse_doc_model,
+                fingerprint=fingerprints.get(pdf_name), di_cache=di_cache, rate_limiter=rate_limiter,
+            )
+            for pdf_name in pdfs_company
+        )
+    )
+    docs = [doc for doc in results if doc is not None]
+    print_di_throughput(docs, time.perf_counter() - t0)
+    if di_cache is not None:
+        print("DI", di_cache.stats())
+    print_price_estimations(docs)
+    await asyncio.to_thread(write_local_mk_files, docs, local_path)
+    return docs
+
+
+async def call_tool_completion_async(
+    client_oai: Any,
+    message: List[Dict[str, str]],
+    tools: Any,
+    model: str,
+    max_tokens: int,
+    temperature: float,
+    rate_limiter: Optional[Any] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> Any:
+    """Async `call_tool_completion`: acquire quota, send one tool-calling completion, log usage."""
+    tokens = await asyncio.to_thread(estimate_request_tokens, message, tools, max_tokens)
+    waited = await acquire_limiter(rate_limiter, tokens)
+    if waited > 0:
+        print(f"rate limiter: waited {waited:.1f}s before dispatch")
+    t0 = time.perf_counter()
+    resp = await acall_with_retry(
+        "openai.aio.create", client_oai.chat.completions.create,
+        semaphore=semaphore, **tool_completion_body(message, tools, model, max_tokens, temperature),
+    )
+    print_resp_properties(resp, latency_s=time.perf_counter() - t0)
+    return resp
+
+
+async def arun_steps(steps: Any, send: Callable[[Any], Awaitable[Any]]) -> Any:
+    """
+    Async `gpt_module.run_steps`: answer each yielded request with `await send(request)`.
+
+    The generator is advanced in a worker thread, since its steps read and
+    write the LLM cache and parse responses.
+    """
+    done, value = await asyncio.to_thread(_advance_steps, steps, None)
+    while not done:
+        done, value = await asyncio.to_thread(_advance_steps, steps, await send(value))
+    return value
+
+
+def _advance_steps(steps: Any, response: Any) -> Tuple[bool, Any]:
+    """Send `response` to `steps`: (False, next request) or (True, returned value)."""
+    try:
+        return False, steps.send(response)
+    except StopIteration as stop:  # cannot cross `to_thread`: returned instead
+        return True, stop.value
+
+
+async def gather_or_raise(*aws: Awaitable[Any]) -> List[Any]:
+    """
+    `asyncio.gather` that waits for every awaitable before re-raising the first error.
+
+    A plain `gather` propagates the first exception while its siblings keep
+    running, so the caller could move on (or close the clients) under them.
+    """
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def get_response_df_async(
+    client_oai: Any,
+    message: List[Dict[str, str]],
+    tools: Any,
+    model: str = "gpt-4.1",
+    max_tokens: int = 32000,
+    rate_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    temperature: float = 0.05,
+    max_continuations: int = 2,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> pd.DataFrame:
+    """Async `get_response_df`: `response_df_steps` driven by `call_tool_completion_async`."""
+    return await arun_steps(
+        response_df_steps(message, tools, model, max_tokens, temperature, llm_cache, max_continuations),
+        lambda msgs: call_tool_completion_async(
+            client_oai, msgs, tools, model, max_tokens, temperature, rate_limiter, semaphore
+        ),
+    )
+
+
+async def run_cgcp_pipeline_async(
+    content_cadre: List[str],
+    content_sous: List[str],
+    client_oai: Any,
+    cgcp_question: str,
+    financial_prompt: str,
+    financial_tools: Any,
+    col_order: List[str],
+    rate_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    prompt_token_budget: Optional[int] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> pd.DataFrame:
+    """Async `run_cgcp_pipeline`: CG+CP chunks (if over budget) are extracted concurrently."""
+    messages_list = await asyncio.to_thread(
+        build_cgcp_messages,
+        content_cadre, content_sous, cgcp_question, financial_prompt, financial_tools,
+        prompt_token_budget, section_filter,
+    )
+    chunk_dfs = await gather_or_raise(
+        *(
+            get_response_df_async(
+                client_oai, messages, financial_tools, rate_limiter=rate_limiter,
+                llm_cache=llm_cache, semaphore=semaphore,
+            )
+            for messages in messages_list
+        )
+    )
+    return cgcp_df_from_chunks(chunk_dfs, col_order)
+
+
+async def extract_avenant_df_async(
+    i: int,
+    n_avenants: int,
+    avenant_str: str,
+    client_oai: Any,
+    avenant_question: str,
+    financial_prompt: str,
+    financial_tools: Any,
+    col_order: List[str],
+    rate_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> pd.DataFrame:
+    """Async `extract_avenant_df`."""
+    messages_av = await asyncio.to_thread(
+        avenant_messages,
+        i, n_avenants, avenant_str, avenant_question, financial_prompt, section_filter
+    )
+    df_av = await get_response_df_async(
+        client_oai, messages_av, financial_tools, rate_limiter=rate_limiter,
+        llm_cache=llm_cache, semaphore=semaphore,
+    )
+    rectify_df(df_av, col_order)  # validation only, as in `extract_avenant_df`
+    return df_av
+
+
+async def run_avenants_pipeline_async(
+    content_avenant: List[str],
+    client_oai: Any,
+    avenant_question: str,
+    financial_prompt: str,
+    financial_tools: Any,
+    col_order: List[str],
+    rate_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> Optional[pd.DataFrame]:
+    """Async `run_avenants_pipeline`: every Avenant is extracted concurrently, results kept in order."""
+    df_av_list = await gather_or_raise(
+        *(
+            extract_avenant_df_async(
+                i, len(content_avenant), avenant_str, client_oai, avenant_question,
+                financial_prompt, financial_tools, col_order, rate_limiter, llm_cache,
+                section_filter, semaphore,
+            )
+            for i, avenant_str in enumerate(content_avenant, start=1)
+        )
+    )
+    return avenants_df(df_av_list)
+
+
+async def run_pipeline_async(
+    affairs: List[str],
+    cgcp_question: str,
+    avenant_question: str,
+    financial_prompt: str,
+    financial_tools: Any,
+    col_order: List[str],
+    local_path: Path,
+    local_save_tag: str,
+    run_di: bool = False,
+    skip_unchanged: bool = True,
+    di_cache: Optional[Any] = None,
+    analyse_doc_model: str = "prebuilt-layout",
+    di_limiter: Optional[Any] = None,
+    inventory: Optional[Dict[str, Any]] = None,
+    blob_container: Optional[Any] = None,
+    docs_container_suffix: str = "",
+    docs_lookup: str = "id",
+    docs_partition_keys: Optional[Dict[str, Optional[str]]] = None,
+    oai_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    prompt_token_budget: Optional[int] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
+    cg_registry: Optional[Any] = None,
+    cg_mode: str = "summary",
+    cg_client_oai: Optional[Any] = None,
+    concurrency: Optional[Dict[str, int]] = None,
+) -> None:
+    """
+    Run the DI (if `run_di`) and GPT phases of `affairs` on the aio clients.
+
+    Parameters mirror the synchronous calls in `main.py`. The PDFs of each
+    affair are selected from the blob `inventory` with
+    `blob_inventory.affair_fingerprints` (its incremental refresh uses the
+    synchronous `blob_container`), so both modes process the same files.
+    `docs_partition_keys` maps affairs to the company partition their
+    documents are read from (see `blob_inventory.company_partition_key`).
+    `cg_registry.resolve` is synchronous (its summaries are built with the
+    synchronous `cg_client_oai`) and runs in a worker thread. `concurrency`
+    overrides `DEFAULT_CONCURRENCY`.
+
+    A failing affair is reported and the others carry on; every task has
+    finished before the clients are closed, and the first error is re-raised
+    at the end, as in `affair_pipeline.run_staged_pipeline`.
+    """
+    semaphores = make_semaphores(concurrency)
+    clients = get_async_clients(docs_container_suffix)
+    t0 = time.perf_counter()
+    failed: List[BaseException] = []
+    try:
+        if run_di:
+            # one affair at a time: refreshing the inventory mutates it
+            fingerprints = await asyncio.to_thread(
+                lambda: {
+                    affair: affair_fingerprints(inventory, blob_container, affair)
+                    for affair in affairs
+                }
+            )
+
+            async def _di(affair: str) -> None:
+                async with semaphores["affairs"]:
+                    await process_affair_document_intelligence_async(
+                        clients.cosmos_docs, clients.container, clients.client_di, affair,
+                        local_path, fingerprints[affair], semaphores, skip_unchanged=skip_unchanged,
+                        di_cache=di_cache, analyse_doc_model=analyse_doc_model,
+                        rate_limiter=di_limiter,
+                    )
+
+            failed += report_failed_affairs(
+                "DI", affairs, await asyncio.gather(*(_di(a) for a in affairs), return_exceptions=True)
+            )
+
+        async def _gpt(i: int, affair: str) -> None:
+            async with semaphores["affairs"]:
+                print(f"\nTreating affair {i}/{len(affairs)} = ", affair)
+                docs = await get_docs_async(
+                    affair, clients.cosmos_docs, lookup=docs_lookup,
+                    partition_key=(docs_partition_keys or {}).get(affair),
+                    semaphore=semaphores["cosmos"],
+                )
+                content_cadre, content_sous, content_avenant = get_cpcgav(
+                    docs, cp_identifiers, cg_identifiers, av_identifiers
+                )
+                verify_cpcgav_separation(docs, content_cadre, content_sous, content_avenant)
+                if cg_registry is not None:
+                    content_cadre = await asyncio.to_thread(
+                        cg_registry.resolve, affair, content_cadre, cg_client_oai,
+                        mode=cg_mode, rate_limiter=oai_limiter,
+                    )
+                cpcg_df, df_av_all = await gather_or_raise(
+                    run_cgcp_pipeline_async(
+                        content_cadre, content_sous, clients.client_oai, cgcp_question,
+                        financial_prompt, financial_tools, col_order, oai_limiter, llm_cache,
+                        prompt_token_budget, section_filter, semaphores["openai"],
+                    ),
+                    run_avenants_pipeline_async(
+                        content_avenant, clients.client_oai, avenant_question, financial_prompt,
+                        financial_tools, col_order, oai_limiter, llm_cache, section_filter,
+                        semaphores["openai"],
+                    ),
+                )
+                affair_df = await asyncio.to_thread(build_affair_df, cpcg_df, df_av_all)
+                await asyncio.to_thread(
+                    save_df_local, affair, local_save_tag, cpcg_df, df_av_all, affair_df
+                )
+                await acall_with_retry(
+                    "cosmos.aio.upsert_item", clients.cosmos_table.upsert_item,
+                    affair_table_item(affair_df, affair), semaphore=semaphores["cosmos"],
+                )
+                print("END", affair)
+
+        failed += report_failed_affairs(
+            "GPT",
+            affairs,
+            await asyncio.gather(
+                *(_gpt(i, affair) for i, affair in enumerate(affairs, start=1)),
+                return_exceptions=True,
+            ),
+        )
+    finally:
+        await close_async_clients(clients)
+    print(f"async pipeline: {len(affairs)} affairs in {time.perf_counter() - t0:.1f}s")
+    if failed:
+        raise failed[0]
+
+
+def report_failed_affairs(phase: str, affairs: List[str], results: List[Any]) -> List[BaseException]:
+    """Print the affairs whose task raised (`gather(..., return_exceptions=True)`); return the errors."""
+    errors = [(affair, r) for affair, r in zip(affairs, results) if isinstance(r, BaseException)]
+    for affair, exc in errors:
+        print(f"ERROR async pipeline {phase} failed for {affair}: {exc!r}")
+    if errors:
+        print(f"async pipeline: {len(errors)} affairs failed in {phase}: {', '.join(a for a, _ in errors)}")
+    return [exc for _, exc in errors]
@@ -0,0 +1,498 @@
+"""
+Offline bulk extraction through the (Azure) OpenAI Batch API.
+
+For nightly backfills latency does not matter, but throughput and cost do: Batch
+API requests are billed at half the synchronous price and do not consume the
+deployment's synchronous RPM/TPM quota. This module turns the GPT phase of many
+affairs into Batch API jobs and feeds the results back through the same parsing
+as the synchronous path.
+
+Flow
+----
+1) Build every CG+CP request (`build_cgcp_messages`, chunked when over budget)
+   and every Avenant request (`build_message_avenant`) of all affairs, with the
+   exact request body of the synchronous path (`tool_completion_body`).
+   Requests already in the LLM cache are not submitted.
+2) Write them as JSONL files (split by request count and size), upload them with
+   `files.create(purpose="batch")` and submit one `batches.create` per file.
+3) Poll `batches.retrieve` until every batch is terminal, then download the
+   output and error files.
+4) Parse each tool-call output with `products_df` (truncated outputs are
+   continued synchronously with `continue_truncated_extraction`; failed,
+   expired or unusable requests fall back to `get_response_df`, both under the
+   synchronous `rate_limiter`, and the fallbacks are counted), merge CG+CP chunks with
+   `merge_chunk_dfs`, rectify with `rectify_df` and yield per-affair tables
+   ready for `upsert_to_cosmos`.
+
+Submitted batch ids are recorded in `<work_dir>/batch_state.json`, keyed by a
+hash of the request set, so a restarted run resumes polling the same batches
+instead of paying for them twice.
+
+`LocalBatchClient` is a file-based stand-in for the `files`/`batches`
+endpoints, for testing the plumbing without the service (it answers through
+an optional chat client, else with one all-null product per request).
+
+Usage (minimal)
+---------------
+    for affair, cpcg_df, df_av_all in run_batch_extraction(
+        affair_contents, client_oai, client_oai, cgcp_question, avenant_question,
+        financial_prompt, financial_tools, col_order, work_dir=Path("./batch"),
+    ):
+        ...
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from gpt_module import (
+    avenants_df,
+    build_cgcp_messages,
+    build_message_avenant,
+    cached_response,
+    cgcp_df_from_chunks,
+    continue_truncated_extraction,
+    get_response_df,
+    llm_cache_key,
+    print_resp_properties,
+    products_df,
+    rectify_df,
+    tool_completion_body,
+    usable_cache_entry,
+)
+from markdown_sections import filter_financial_sections
+
+BATCH_ENDPOINT = "/chat/completions"
+BATCH_PRICE_FACTOR = 0.5  # Batch API price relative to synchronous calls
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def batch_request_line(custom_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    """One JSONL line of a Batch API input file."""
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+
+def build_affair_requests(
+    affair: str,
+    content_cadre: List[str],
+    content_sous: List[str],
+    content_avenant: List[str],
+    cgcp_question: str,
+    avenant_question: str,
+    financial_prompt: str,
+    financial_tools: Any,
+    prompt_token_budget: Optional[int] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[str], List[str], Dict[str, List[Dict[str, str]]]]:
+    """
+    Messages of all the extraction requests of one affair.
+
+    Returns (CG+CP custom ids, Avenant custom ids, {custom id: messages}).
+    Custom ids are `<affair>|cgcp|<chunk>` and `<affair>|av|<avenant index>`.
+    """
+    messages: Dict[str, List[Dict[str, str]]] = {}
+    cgcp_ids = []
+    cgcp_list = build_cgcp_messages(
+        content_cadre, content_sous, cgcp_question, financial_prompt, financial_tools,
+        prompt_token_budget, section_filter,
+    )
+    for k, msgs in enumerate(cgcp_list):
+        cgcp_ids.append(f"{affair}|cgcp|{k}")
+        messages[cgcp_ids[-1]] = msgs
+    av_ids = []
+    for i, avenant_str in enumerate(content_avenant, start=1):
+        if section_filter is not None:
+            avenant_str = filter_financial_sections(avenant_str, label=f"[AV {i}]", **section_filter)
+        av_ids.append(f"{affair}|av|{i}")
+        messages[av_ids[-1]] = build_message_avenant(avenant_str, avenant_question, financial_prompt)
+    return cgcp_ids, av_ids, messages
+
+
+def write_batch_files(
+    lines: List[Dict[str, Any]],
+    work_dir: Path,
+    max_requests: int = 50_000,
+    max_bytes: int = 180 * 1024**2,
+) -> List[Path]:
+    """Write request lines as JSONL files of at most `max_requests` lines / `max_bytes` each."""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    paths: List[Path] = []
+    current: List[bytes] = []
+    size = 0
+
+    def _flush() -> None:
+        path = work_dir / f"batch_input_{len(paths):03d}.jsonl"
+        path.write_bytes(b"".join(current))
+        paths.append(path)
+
+    for line in lines:
+        data = (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+        if current and (len(current) >= max_requests or size + len(data) > max_bytes):
+            _flush()
+            current, size = [], 0
+        current.append(data)
+        size += len(data)
+    if current:
+        _flush()
+    return paths
+
+
+def submit_batch_files(batch_client: Any, paths: List[Path], completion_window: str = "24h") -> List[str]:
+    """Upload each input file and create one batch per file; return the batch ids."""
+    batch_ids = []
+    for path in paths:
+        input_file = batch_client.files.create(file=(path.name, path.read_bytes()), purpose="batch")
+        batch = batch_client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=completion_window,
+        )
+        print(f"batch submitted: {batch.id} ({path.name})")
+        batch_ids.append(batch.id)
+    return batch_ids
+
+
+def wait_for_batches(
+    batch_client: Any,
+    batch_ids: List[str],
+    poll_s: float = 60.0,
+    timeout_s: Optional[float] = None,
+) -> List[Any]:
+    """Poll until every batch reaches a terminal status; return the final batch objects."""
+    t0 = time.monotonic()
+    pending = list(batch_ids)
+    done: Dict[str, Any] = {}
+    while pending:
+        for batch_id in list(pending):
+            batch = batch_client.batches.retrieve(batch_id)
+            if batch.status in TERMINAL_STATUSES:
+                print(f"batch {batch_id}: {batch.status} {getattr(batch, 'request_counts', '')}")
+                done[batch_id] = batch
+                pending.remove(batch_id)
+        if not pending:
+            break
+        if timeout_s is not None and time.monotonic() - t0 > timeout_s:
+            raise TimeoutError(f"batches still running after {timeout_s:.0f}s: {pending}")
+        print(f"waiting for {len(pending)} batches ({time.monotonic() - t0:.0f}s elapsed)")
+        time.sleep(poll_s)
+    return [done[batch_id] for batch_id in batch_ids]
+
+
+def read_batch_outputs(batch_client: Any, batches: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """Download output and error files; return {custom_id: output line}."""
+    outputs: Dict[str, Dict[str, Any]] = {}
+    for batch in batches:
+        for file_id in (getattr(batch, "output_file_id", None), getattr(batch, "error_file_id", None)):
+            if not file_id:
+                continue
+            for raw in batch_client.files.content(file_id).text.splitlines():
+                if raw.strip():
+                    line = json.loads(raw)
+                    outputs[line["custom_id"]] = line
+    return outputs
+
+
+def parse_batch_output(line: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Turn one output line into an LLM-cache-shaped entry
+    `{arguments, finish_reason, usage}`, or None if the request failed.
+    """
+    if not line or line.get("error") or (line.get("response") or {}).get("status_code") != 200:
+        return None
+    body = line["response"]["body"]
+    choice = body["choices"][0]
+    tool_calls = choice["message"].get("tool_calls")
+    if not tool_calls:
+        return None
+    usage = body.get("usage") or {}
+    return {
+        "arguments": tool_calls[0]["function"]["arguments"],
+        "finish_reason": choice.get("finish_reason"),
+        "usage": {
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+            "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0,
+        },
+    }
+
+
+def request_set_key(lines: List[Dict[str, Any]]) -> str:
+    """Stable hash of a whole set of batch requests (identifies a resumable submission)."""
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(json.dumps(line, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def run_batch_extraction(
+    affair_contents: Iterable[Tuple[str, List[str], List[str], List[str]]],
+    batch_client: Any,
+    client_oai: Any,
+    cgcp_question: str,
+    avenant_question: str,
+    financial_prompt: str,
+    financial_tools: Any,
+    col_order: List[str],
+    work_dir: Path,
+    model: str = "gpt-4.1",
+    sync_model: str = "gpt-4.1",
+    max_tokens: int = 32000,
+    temperature: float = 0.05,
+    prompt_token_budget: Optional[int] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
+    llm_cache: Optional[Any] = None,
+    poll_s: float = 60.0,
+    rate_limiter: Optional[Any] = None,
+) -> Iterator[Tuple[str, pd.DataFrame, Optional[pd.DataFrame]]]:
+    """
+    Extract the products of many affairs with Batch API jobs.
+
+    Parameters
+    ----------
+    affair_contents : iterable of (affair, content_cadre, content_sous, content_avenant)
+        Documents of each affair, as returned by `get_cpcgav`.
+    batch_client : Any
+        Client exposing `files.create/content` and `batches.create/retrieve`
+        (`client_oai`, or a `LocalBatchClient`).
+    client_oai : Any
+        Synchronous client, used for truncated-output continuations and for
+        requests the batch failed to answer.
+    work_dir : pathlib.Path
+        Folder of the JSONL input files and of `batch_state.json`.
+    model : str, default "gpt-4.1"
+        Batch deployment name written in each request body.
+    sync_model : str, default "gpt-4.1"
+        Synchronous deployment used for continuations and fallbacks.
+    llm_cache : DiskCache or None
+        Cached requests are not submitted; batch results are stored in it with
+        the key `get_response_df` uses for `model`, so a later synchronous run
+        on a deployment of the same name hits them.
+    poll_s : float, default 60
+        Seconds between two status polls.
+    rate_limiter : TokenRateLimiter or None
+        RPM/TPM limiter of the synchronous deployment, acquired by the
+        continuations and by the synchronous fallback of requests the batch
+        did not answer (failed, expired or unusable outputs).
+
+    Other parameters are those of `run_cgcp_pipeline` / `run_avenants_pipeline`.
+
+    Yields
+    ------
+    (affair, cpcg_df, df_av_all)
+        The rectified CG+CP table and the concatenated Avenant table (None
+        without Avenants), as `run_affair_extraction` returns them.
+    """
+    plans = []
+    messages: Dict[str, List[Dict[str, str]]] = {}
+    for affair, content_cadre, content_sous, content_avenant in affair_contents:
+        cgcp_ids, av_ids, affair_messages = build_affair_requests(
+            affair, content_cadre, content_sous, content_avenant, cgcp_question,
+            avenant_question, financial_prompt, financial_tools, prompt_token_budget,
+            section_filter,
+        )
+        plans.append((affair, cgcp_ids, av_ids))
+        messages.update(affair_messages)
+
+    def _cache_key(custom_id: str) -> str:
+        return llm_cache_key(messages[custom_id], financial_tools, model, temperature, max_tokens)
+
+    entries: Dict[str, Dict[str, Any]] = {}
+    if llm_cache is not None:
+        for custom_id in messages:
+            cached = llm_cache.get(_cache_key(custom_id))
+            if usable_cache_entry(cached):
+                entries[custom_id] = cached
+    lines = [
+        batch_request_line(
+            custom_id, tool_completion_body(msgs, financial_tools, model, max_tokens, temperature)
+        )
+        for custom_id, msgs in messages.items()
+        if custom_id not in entries
+    ]
+    print(f"batch: {len(messages)} requests, {len(entries)} cached, {len(lines)} to submit")
+
+    if lines:
+        state_path = work_dir / "batch_state.json"
+        key = request_set_key(lines)
+        state = json.loads(state_path.read_text(encoding="utf-8")) if state_path.exists() else {}
+        if state.get("key") == key:
+            print(f"batch: resuming {len(state['batch_ids'])} submitted batches")
+            batch_ids = state["batch_ids"]
+        else:
+            batch_ids = submit_batch_files(batch_client, write_batch_files(lines, work_dir))
+            work_dir.mkdir(parents=True, exist_ok=True)
+            state_path.write_text(json.dumps({"key": key, "batch_ids": batch_ids}), encoding="utf-8")
+        outputs = read_batch_outputs(batch_client, wait_for_batches(batch_client, batch_ids, poll_s))
+        for line in lines:
+            custom_id = line["custom_id"]
+            entry = parse_batch_output(outputs.get(custom_id))
+            if entry is None:
+                print(f"batch: {custom_id} failed, retrying synchronously")
+                continue
+            print_resp_properties(
+                cached_response(entry),
+                INPUT_EUR_PER_1M=1.73 * BATCH_PRICE_FACTOR,
+                OUTPUT_EUR_PER_1M=6.91 * BATCH_PRICE_FACTOR,
+                CACHED_INPUT_EUR_PER_1M=0.43 * BATCH_PRICE_FACTOR,
+            )
+            if entry["finish_reason"] == "length":
+                entry["arguments"], entry["finish_reason"], entry["usage"] = continue_truncated_extraction(
+                    client_oai, messages[custom_id], financial_tools, entry["arguments"],
+                    entry["usage"], sync_model, max_tokens, temperature, rate_limiter,
+                )
+            try:
+                products_df(entry["arguments"])
+            except (ValueError, KeyError, TypeError) as exc:
+                print(f"batch: {custom_id} output unusable ({exc}), retrying synchronously")
+                continue
+            entries[custom_id] = entry
+            if llm_cache is not None and entry["finish_reason"] != "length":
+                llm_cache.put(_cache_key(custom_id), entry)
+
+    fallback = [custom_id for custom_id in messages if custom_id not in entries]
+    if fallback:
+        print(
+            f"batch: {len(fallback)}/{len(messages)} requests not answered by the batch, "
+            f"sent synchronously to {sync_model}"
+            + (" under the rate limiter" if rate_limiter is not None else " WITHOUT rate limiter")
+        )
+
+    def _df(custom_id: str) -> pd.DataFrame:
+        if custom_id in entries:
+            return products_df(entries[custom_id]["arguments"])
+        return get_response_df(
+            client_oai, messages[custom_id], financial_tools, model=sync_model,
+            rate_limiter=rate_limiter, llm_cache=llm_cache,
+        )
+
+    for affair, cgcp_ids, av_ids in plans:
+        cpcg_df = cgcp_df_from_chunks([_df(custom_id) for custom_id in cgcp_ids], col_order)
+        df_av_list = []
+        for custom_id in av_ids:
+            df_av = _df(custom_id)
+            rectify_df(df_av, col_order)  # as in `extract_avenant_df`
+            df_av_list.append(df_av)
+        yield affair, cpcg_df, avenants_df(df_av_list)
+
+
+class LocalBatchClient:
+    """
+    File-based stand-in for the Batch API (`files` and `batches` endpoints).
+
+    Input/output files and batch records live under `root_dir`. A batch is
+    processed synchronously on its first `batches.retrieve`: each request body
+    is sent to `chat_client.chat.completions.create(**body)` when a chat client
+    is given, else answered with a tool call holding one product whose required
+    fields (taken from the tool schema) are all null.
+    """
+
+    def __init__(self, root_dir: Path, chat_client: Optional[Any] = None) -> None:
+        self.root_dir = Path(root_dir)
+        self.chat_client = chat_client
+        (self.root_dir / "files").mkdir(parents=True, exist_ok=True)
+        (self.root_dir / "batches").mkdir(parents=True, exist_ok=True)
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _create_file(self, file: Any, purpose: str) -> SimpleNamespace:
+        file_id = f"file-{uuid.uuid4().hex}"
+        (self.root_dir / "files" / file_id).write_bytes(file[1])
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id: str) -> SimpleNamespace:
+        return SimpleNamespace(text=(self.root_dir / "files" / file_id).read_text(encoding="utf-8"))
+
+    def _create_batch(self, input_file_id: str, endpoint: str, completion_window: str) -> SimpleNamespace:
+        record = {
+            "id": f"batch-{uuid.uuid4().hex}",
+            "status": "validating",
+            "input_file_id": input_file_id,
+            "endpoint": endpoint,
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": None,
+        }
+        self._save_batch(record)
+        return SimpleNamespace(**record)
+
+    def _retrieve_batch(self, batch_id: str) -> SimpleNamespace:
+        record = json.loads((self.root_dir / "batches" / f"{batch_id}.json").read_text(encoding="utf-8"))
+        if record["status"] not in TERMINAL_STATUSES:
+            record = self._process(record)
+        return SimpleNamespace(**record)
+
+    def _process(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        output_lines = []
+        failed = 0
+        for raw in self._file_content(record["input_file_id"]).text.splitlines():
+            if not raw.strip():
+                continue
+            request = json.loads(raw)
+            try:
+                body = self._answer(request["body"])
+                response = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body}
+                output_lines.append({"custom_id": request["custom_id"], "response": response, "error": None})
+            except Exception as exc:  # recorded per request, as the service does
+                failed += 1
+                error = {"code": type(exc).__name__, "message": str(exc)}
+                output_lines.append({"custom_id": request["custom_id"], "response": None, "error": error})
+        output_file_id = f"file-{uuid.uuid4().hex}"
+        (self.root_dir / "files" / output_file_id).write_text(
+            "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in output_lines),
+            encoding="utf-8",
+        )
+        record.update(
+            status="completed",
+            output_file_id=output_file_id,
+            request_counts={
+                "total": len(output_lines),
+                "completed": len(output_lines) - failed,
+                "failed": failed,
+            },
+        )
+        self._save_batch(record)
+        return record
+
+    def _answer(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        if self.chat_client is not None:
+            return self.chat_client.chat.completions.create(**body).model_dump()
+        function = body["tools"][0]["function"]
+        fields = function["parameters"]["properties"]["products"]["items"]["required"]
+        arguments = json.dumps({"products": [{name: None for name in fields}]})
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "model": body.get("model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "tool_calls",
+                    "message": {
+                        "role": "assistant",
+                        "content": None,
+                        "tool_calls": [
+                            {
+                                "id": f"call_{uuid.uuid4().hex[:24]}",
+                                "type": "function",
+                                "function": {"name": function["name"], "arguments": arguments},
+                            }
+                        ],
+                    },
+                }
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def _save_batch(self, record: Dict[str, Any]) -> None:
+        path = self.root_dir / "batches" / f"{record['id']}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(record), encoding="utf-8")
+        os.replace(tmp, path)
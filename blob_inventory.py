@@ -0,0 +1,301 @@
+"""
+Persistent inventory of the PDF blobs used by the Document Intelligence phase.
+
+Listing the whole Blob container once per affair (and then substring-scanning
+every name) costs O(blobs x affairs) work plus one listing round-trip per affair.
+This module lists the container once, caches the result on disk, and exposes a
+compact letter/company/affair index: an affair is resolved by matching the
+index keys (O(companies + sub-folders), not O(blobs)), and refreshing it only
+needs a `name_starts_with` listing of its companies.
+
+Inventory shape
+---------------
+    {
+        "refreshed_at": <epoch seconds of the last full listing>,
+        "prefix_refreshed_at": {<prefix>: <epoch seconds of its last listing>},
+        "blobs": {<blob name>: {"etag", "content_md5", "last_modified"}},
+        "index": {<letter>: {<company>: {<affair or 'root'>: [<blob name>, ...]}}},
+    }
+
+Only `refreshed_at`, `prefix_refreshed_at` and `blobs` are persisted; `index`
+is rebuilt with `parse_blob_path` when the cache is loaded and updated in
+place by incremental refreshes.
+
+Usage (minimal)
+---------------
+    inventory = load_blob_inventory(container, Path("./blob_inventory.json"))
+    fingerprints = affair_fingerprints(inventory, container, "sicame")
+    process_affair_document_intelligence(..., fingerprints=fingerprints)
+    save_blob_inventory(inventory)   # once, at the end of the run
+
+Notes
+-----
+- A cache older than `max_age_s` triggers a full re-listing. Otherwise an
+  affair's companies are re-listed only when their last listing is older than
+  `refresh_max_age_s`, and the affair's letter prefix only on a cache miss
+  (no indexed company or sub-folder matches, e.g. a company uploaded since the
+  last listing), at most once per run.
+- The cache file is written atomically (temporary file + `os.replace`) and an
+  unreadable one is treated as a miss, so workers sharing an out-dir never read
+  a partial file; the last worker to save wins (it is only a cache).
+- Blob names that do not follow `letter/company/.../file` are kept in `blobs` but
+  are not indexed; they (and PDFs matched only by their file name) are only
+  selected by the substring scan used when no index key matches.
+"""
+
+from __future__ import annotations
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from di_module import blob_fingerprint, parse_blob_path, select_affair
+
+
+def load_blob_inventory(
+    container: Any,
+    cache_path: Optional[Path] = None,
+    max_age_s: float = 24 * 3600,
+) -> Dict[str, Any]:
+    """
+    Load the blob inventory from `cache_path`, re-listing the container if needed.
+
+    Parameters
+    ----------
+    container : Any
+        Azure Blob ContainerClient exposing `list_blobs(name_starts_with=...)`.
+    cache_path : Path or None
+        JSON file used to persist the inventory between runs. If None, the
+        inventory lives in memory only.
+    max_age_s : float, default 24h
+        Maximum age of the cached listing before a full re-listing is done.
+
+    Returns
+    -------
+    dict
+        The inventory (see module docstring).
+    """
+    inventory: Optional[Dict[str, Any]] = None
+    if cache_path is not None and cache_path.exists():
+        try:
+            cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:  # partial or corrupt file: a cache miss
+            print(f"blob inventory cache unreadable ({e}), re-listing the container")
+            cached = None
+        if isinstance(cached, dict) and isinstance(cached.get("blobs"), dict):
+            if time.time() - cached.get("refreshed_at", 0) <= max_age_s:
+                inventory = cached
+                print(f"blob inventory loaded from cache: {len(inventory['blobs'])} PDFs")
+    if inventory is None:
+        inventory = {"refreshed_at": time.time(), "blobs": _list_pdf_blobs(container), "dirty": True}
+        print(f"blob inventory listed from container: {len(inventory['blobs'])} PDFs")
+    inventory.setdefault("prefix_refreshed_at", {})
+    inventory["index"] = build_blob_index(inventory["blobs"])
+    inventory["listed_this_run"] = set()
+    inventory["cache_path"] = str(cache_path) if cache_path is not None else None
+    save_blob_inventory(inventory)
+    return inventory
+
+
+def save_blob_inventory(inventory: Dict[str, Any]) -> None:
+    """
+    Persist the inventory to its cache path (if any) when it changed since the last save.
+
+    The file is written to a temporary file and moved into place with
+    `os.replace`, so concurrent readers see either the old or the new file.
+    """
+    cache_path = inventory.get("cache_path")
+    if not cache_path or not inventory.get("dirty"):
+        return
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(
+        json.dumps(
+            {
+                "refreshed_at": inventory["refreshed_at"],
+                "prefix_refreshed_at": inventory["prefix_refreshed_at"],
+                "blobs": inventory["blobs"],
+            }
+        ),
+        encoding="utf-8",
+    )
+    os.replace(tmp, cache_path)
+    inventory["dirty"] = False
+
+
+def build_blob_index(blobs: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, List[str]]]]:
+    """Group blob names into a nested {letter: {company: {affair: [names]}}} index."""
+    index: Dict[str, Dict[str, Dict[str, List[str]]]] = {}
+    for name in sorted(blobs):
+        _index_blob(index, name)
+    return index
+
+
+def _index_blob(index: Dict[str, Dict[str, Dict[str, List[str]]]], name: str) -> None:
+    try:
+        parts = parse_blob_path(name)
+    except ValueError:
+        return
+    affair = parts["affair"] or "root"
+    index.setdefault(parts["letter"], {}).setdefault(parts["company"], {}).setdefault(
+        affair, []
+    ).append(name)
+
+
+def refresh_prefixes(container: Any, inventory: Dict[str, Any], prefixes: List[str]) -> None:
+    """
+    Re-list only the blobs under `prefixes` and merge them into the inventory.
+
+    `prefixes` are `letter/company/` or `letter/` prefixes. Their indexed
+    entries are dropped (so PDFs deleted from the container disappear) and
+    replaced by the new listing, updating the index in place. Nothing is
+    written to disk: call `save_blob_inventory` once at the end of the run.
+    """
+    blobs = inventory["blobs"]
+    index = inventory["index"]
+    now = time.time()
+    for prefix in prefixes:
+        letter, _, company = prefix.strip("/").partition("/")
+        companies = index.get(letter, {})
+        for name_company in [company] if company else list(companies):
+            for names in companies.pop(name_company, {}).values():
+                for name in names:
+                    blobs.pop(name, None)
+        listed = _list_pdf_blobs(container, name_starts_with=prefix)
+        blobs.update(listed)
+        for name in sorted(listed):
+            _index_blob(index, name)
+        inventory["prefix_refreshed_at"][prefix] = now
+        inventory["listed_this_run"].add(prefix)
+    inventory["dirty"] = True
+
+
+def affair_folders(inventory: Dict[str, Any], affair: str) -> Dict[str, List[str]]:
+    """
+    Resolve `affair` through the index: {`letter/company/`: [PDF names]}.
+
+    The historical predicate (`affair in name.lower()`) is applied to the index
+    keys instead of every blob name: all PDFs of a company whose
+    `letter/company/` path matches, else those of its sub-folders whose
+    `letter/company/affair/` path matches.
+    """
+    matches: Dict[str, List[str]] = {}
+    for letter, companies in inventory["index"].items():
+        for company, affairs in companies.items():
+            prefix = f"{letter}/{company}/"
+            company_hit = affair in prefix.lower()
+            names = [
+                name
+                for folder, folder_names in affairs.items()
+                if company_hit or (folder != "root" and affair in f"{prefix}{folder}/".lower())
+                for name in folder_names
+            ]
+            if names:
+                matches[prefix] = names
+    return matches
+
+
+def select_affair_from_inventory(inventory: Dict[str, Any], affair: Optional[str]) -> List[str]:
+    """
+    Return the PDF names of an affair (see `affair_folders`).
+
+    When no index key matches, the substring scan of `di_module.select_affair`
+    over every inventoried name is the fallback, so PDFs matched only by their
+    file name (or not indexed) are still found.
+    """
+    if not affair:
+        return sorted(inventory["blobs"])
+    matches = affair_folders(inventory, affair)
+    if matches:
+        return sorted(name for names in matches.values() for name in names)
+    return sorted(select_affair(list(inventory["blobs"]), affair))
+
+
+def affair_prefixes(inventory: Dict[str, Any], affair: str) -> List[str]:
+    """
+    List the prefixes to re-list before selecting `affair`.
+
+    These are the `letter/company/` prefixes resolved by `affair_folders`. When
+    none matches (e.g. a company uploaded after the inventory was built), the
+    letter prefix of the affair is returned instead, so its PDFs are found
+    without a full re-listing.
+    """
+    prefixes = list(affair_folders(inventory, affair))
+    if prefixes:
+        return prefixes
+    letters = [letter for letter in inventory["index"] if letter.lower() == affair[:1].lower()]
+    return [f"{letter}/" for letter in letters or [affair[:1].upper()]]
+
+
+def company_partition_key(inventory: Dict[str, Any], affair: str) -> Optional[str]:
+    """
+    The `company_name_path` of the only inventoried company whose lower-cased
+    name starts with `affair` (the `get_docs(lookup="company")` filter), else None.
+
+    It is the partition key of the company-partitioned documents container, so
+    the affair lookup can target one partition; None (no match, or several
+    companies) keeps the cross-partition query.
+    """
+    keyword = affair.lower()
+    paths = [
+        f"{letter}/{company}"
+        for letter, companies in inventory["index"].items()
+        for company in companies
+        if company.lower().startswith(keyword)
+    ]
+    return paths[0] if len(paths) == 1 else None
+
+
+def affair_fingerprints(
+    inventory: Dict[str, Any],
+    container: Any,
+    affair: Optional[str],
+    refresh_max_age_s: float = 3600,
+) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    Return {blob name: {etag, content_md5}} for the PDFs of an affair.
+
+    The prefixes of `affair_prefixes` are re-listed with `name_starts_with`
+    first when their last listing is older than `refresh_max_age_s`, or, on a
+    cache miss, when they were not listed yet in this run. The inventory is
+    updated in memory only (see `save_blob_inventory`).
+    """
+    if affair:
+        matches = affair_folders(inventory, affair)
+        if matches:
+            now = time.time()
+            stale = [
+                prefix
+                for prefix in matches
+                if now - inventory["prefix_refreshed_at"].get(prefix, inventory["refreshed_at"])
+                > refresh_max_age_s
+            ]
+        else:
+            stale = [
+                prefix
+                for prefix in affair_prefixes(inventory, affair)
+                if prefix not in inventory["listed_this_run"]
+            ]
+        if stale:
+            refresh_prefixes(container, inventory, stale)
+    return {
+        name: {
+            "etag": inventory["blobs"][name]["etag"],
+            "content_md5": inventory["blobs"][name]["content_md5"],
+        }
+        for name in select_affair_from_inventory(inventory, affair)
+    }
+
+
+def _list_pdf_blobs(container: Any, name_starts_with: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """List PDF blobs (optionally under a prefix) as {name: fingerprint + last_modified}."""
+    blobs: Dict[str, Dict[str, Any]] = {}
+    for b in container.list_blobs(name_starts_with=name_starts_with):
+        if b.name.lower().endswith(".pdf"):
+            entry: Dict[str, Any] = dict(blob_fingerprint(b))
+            last_modified = getattr(b, "last_modified", None)
+            entry["last_modified"] = last_modified.isoformat() if last_modified else None
+            blobs[b.name] = entry
+    return blobs
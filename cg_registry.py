@@ -0,0 +1,341 @@
+"""
+Registry of distinct CG (Conditions Générales) versions shared across affairs.
+
+CG "cadre" documents are mostly the same boilerplate for every customer, yet
+each affair used to send its full CG text to the model. This module fingerprints
+CG documents so that each distinct CG version is summarized once and every
+affair using it sends the compact summary instead of the raw text.
+
+How a CG document is matched
+----------------------------
+1) Exact: SHA-256 of the normalized text (lower-cased, accents stripped,
+   Markdown/HTML markup and whitespace collapsed).
+2) Near-duplicate: Jaccard similarity of sampled word 5-shingles against every
+   registered version (`threshold`, default 0.9). Sampling keeps one shingle
+   hash in `SHINGLE_SAMPLE_MOD`, which keeps the registry small.
+
+What is sent instead of the raw CG
+----------------------------------
+    mode="summary": the version summary, plus the affair-specific sections of the
+                    document (sections whose normalized hash is not in the
+                    version, and always the first and last ones: parties,
+                    signature block).
+    mode="omit":    only the affair-specific sections.
+
+Registry file shape
+-------------------
+    {
+        "cg-001": {
+            "fingerprint": "<sha256>",
+            "shingles": [<sampled shingle hashes>],
+            "sections": [<normalized section hashes>],
+            "tokens": <raw CG tokens>,
+            "summary": "<summary text or null>",
+            "affairs": ["mason", "anagra", ...],
+        },
+        ...
+    }
+
+Usage (minimal)
+---------------
+    registry = CGRegistry(Path("./cg_registry.json"))
+    content_cadre = registry.resolve(affair, content_cadre, client_oai)
+    ...
+    registry.print_stats()
+
+Concurrency
+-----------
+Threads of one process share the registry under a lock, and each version's
+summary is built by one thread while the others wait for it. Processes sharing
+the registry file (`--shard` / `--lease` workers) serialize registrations on an
+OS lock of `<registry>.lock` (`rate_limiter.file_lock`) and merge the file into
+their in-memory state before matching and before every write, so they agree on
+version ids and never drop each other's versions. A summary can still be built
+once per process when two processes meet a new version at the same time.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from gpt_module import print_resp_properties
+from markdown_sections import split_markdown_sections
+from rate_limiter import estimate_request_tokens, estimate_tokens, file_lock
+
+SHINGLE_SIZE = 5
+SHINGLE_SAMPLE_MOD = 4
+
+CG_SUMMARY_PROMPT = """
+You condense the Conditions Générales (CG, cadre) of a service contract.
+The summary replaces the full CG in a later extraction prompt, so keep every default
+contract condition that a CP (Conditions Particulières) may rely on when it is silent:
+- billing terms and frequency, payment terms and delays, late-payment penalties;
+- contract duration, effective date rules, reconduction tacite, notice periods;
+- price revision / revalorisation / indexation clauses (index, formula, cap);
+- any product, service, option or price listed in the CG, quoted verbatim;
+- the article numbers of these clauses.
+Quote amounts, percentages, formulas and periods exactly. Keep the original language.
+Omit anything specific to one customer (names, addresses, signatures, dates of signature)
+and clauses without financial or duration impact (liability, confidentiality, GDPR, ...).
+Answer in Markdown, at most 800 words.
+"""
+
+
+def normalize_cg_text(text: str) -> str:
+    """Lower-case, strip accents, Markdown/HTML markup and collapse whitespace."""
+    text = re.sub(r"<!--.*?-->|<[^>]+>", " ", text, flags=re.DOTALL)
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    text = re.sub(r"[#*|_`>=\-]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def cg_fingerprint(normalized: str) -> str:
+    """Exact fingerprint of normalized CG text."""
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def sampled_shingles(normalized: str) -> Set[int]:
+    """Hashes of the word `SHINGLE_SIZE`-shingles, keeping one in `SHINGLE_SAMPLE_MOD`."""
+    words = normalized.split()
+    hashes = (
+        _hash64(" ".join(words[i : i + SHINGLE_SIZE]))
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    )
+    return {h for h in hashes if h % SHINGLE_SAMPLE_MOD == 0}
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    """Jaccard similarity; 0.0 for two empty sets (nothing to compare, not a match)."""
+    if not a and not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def section_hashes(text: str) -> List[str]:
+    """Hashes of the normalized Markdown sections of `text` (in document order)."""
+    return [
+        hashlib.sha256(normalize_cg_text(sec).encode("utf-8")).hexdigest()[:16]
+        for sec in split_markdown_sections(text)
+    ]
+
+
+def summarize_cg(
+    client_oai: Any,
+    cg_text: str,
+    model: str = "gpt-4.1",
+    max_tokens: int = 2000,
+    rate_limiter: Optional[Any] = None,
+) -> str:
+    """One plain (tool-less) chat completion condensing a CG into its default conditions."""
+    messages = [
+        {"role": "system", "content": CG_SUMMARY_PROMPT},
+        {"role": "user", "content": cg_text},
+    ]
+    if rate_limiter is not None:
+        rate_limiter.acquire(estimate_request_tokens(messages, None, max_tokens))
+    t0 = time.perf_counter()
+    resp = client_oai.chat.completions.create(
+        model=model, messages=messages, temperature=0.0, max_tokens=max_tokens
+    )
+    print_resp_properties(resp, latency_s=time.perf_counter() - t0)
+    return resp.choices[0].message.content or ""
+
+
+class CGRegistry:
+    """Thread-safe JSON registry of CG versions, their summaries and the affairs using them."""
+
+    def __init__(self, path: Path, threshold: float = 0.9) -> None:
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix(self.path.suffix + ".lock")
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._summary_locks: Dict[str, threading.Lock] = {}
+        self._versions: Dict[str, Dict[str, Any]] = {}
+        self.raw_tokens = 0
+        self.sent_tokens = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, file_lock(self.lock_path):
+            self._reload()
+        if self._versions:
+            print(f"CG registry: {len(self._versions)} CG versions in {self.path}")
+
+    def match(self, cg_text: str) -> Tuple[Optional[str], float]:
+        """Return (version id, similarity) of the closest registered version above `threshold`."""
+        normalized = normalize_cg_text(cg_text)
+        with self._lock:
+            return self._match_locked(cg_fingerprint(normalized), sampled_shingles(normalized))
+
+    def _match_locked(self, fingerprint: str, shingles: Set[int]) -> Tuple[Optional[str], float]:
+        """`match` on a normalized text's fingerprint and shingles; the caller holds `_lock`."""
+        best, best_sim = None, 0.0
+        for version_id, version in self._versions.items():
+            if version["fingerprint"] == fingerprint:
+                return version_id, 1.0
+            sim = jaccard(shingles, set(version["shingles"]))
+            if sim > best_sim:
+                best, best_sim = version_id, sim
+        if best_sim >= self.threshold:
+            return best, best_sim
+        return None, best_sim
+
+    def register(self, cg_text: str, affair: str) -> str:
+        """
+        Return the version id of `cg_text` (registering a new version if needed) and record `affair`.
+
+        Matching and registering happen under one lock acquisition, so affairs
+        processed concurrently with the same new CG share one version.
+        """
+        normalized = normalize_cg_text(cg_text)
+        fingerprint = cg_fingerprint(normalized)
+        shingles = sampled_shingles(normalized)
+        with self._lock, file_lock(self.lock_path):
+            self._reload()
+            version_id, sim = self._match_locked(fingerprint, shingles)
+            if version_id is None:
+                version_id = self._next_version_id()
+                self._versions[version_id] = {
+                    "fingerprint": fingerprint,
+                    "shingles": sorted(shingles),
+                    "sections": section_hashes(cg_text),
+                    "tokens": estimate_tokens(cg_text),
+                    "summary": None,
+                    "affairs": [],
+                }
+                print(f"CG registry: new version {version_id} (closest similarity {sim:.2f})")
+            else:
+                print(f"CG registry: {affair} matches {version_id} (similarity {sim:.2f})")
+            affairs = self._versions[version_id]["affairs"]
+            if affair not in affairs:
+                affairs.append(affair)
+            self._flush()
+        return version_id
+
+    def _next_version_id(self) -> str:
+        """`cg-NNN` after the highest registered number; the caller holds `_lock`."""
+        numbers = [int(v[3:]) for v in self._versions if re.fullmatch(r"cg-\d+", v)]
+        return f"cg-{max(numbers, default=0) + 1:03d}"
+
+    def summary(
+        self,
+        version_id: str,
+        cg_text: str,
+        client_oai: Any,
+        rate_limiter: Optional[Any] = None,
+    ) -> str:
+        """
+        Return the summary of `version_id`, building it from `cg_text` the first time.
+
+        Only one thread builds a version's summary; concurrent callers of the
+        same version wait for it instead of paying for their own.
+        """
+        with self._lock:
+            version_lock = self._summary_locks.setdefault(version_id, threading.Lock())
+        with version_lock:
+            with self._lock, file_lock(self.lock_path):
+                self._reload()
+                summary = self._versions[version_id]["summary"]
+            if summary is None:
+                print(f"CG registry: summarizing {version_id}")
+                summary = summarize_cg(client_oai, cg_text, rate_limiter=rate_limiter)
+                with self._lock, file_lock(self.lock_path):
+                    self._reload()
+                    self._versions[version_id]["summary"] = summary
+                    self._flush()
+        return summary
+
+    def affair_specific_sections(self, version_id: str, cg_text: str) -> str:
+        """Sections of `cg_text` not in the registered version, plus its first and last sections."""
+        sections = split_markdown_sections(cg_text)
+        known = set(self._versions[version_id]["sections"])
+        hashes = section_hashes(cg_text)
+        keep = [
+            sec
+            for i, (sec, h) in enumerate(zip(sections, hashes))
+            if i in (0, len(sections) - 1) or h not in known
+        ]
+        return "".join(keep)
+
+    def resolve(
+        self,
+        affair: str,
+        content_cadre: List[str],
+        client_oai: Any,
+        mode: str = "summary",
+        rate_limiter: Optional[Any] = None,
+    ) -> List[str]:
+        """
+        Replace each CG document of an affair by its version summary and/or its
+        affair-specific sections (see module docstring for `mode`).
+        """
+        resolved = []
+        for cg_text in content_cadre:
+            version_id = self.register(cg_text, affair)
+            specific = self.affair_specific_sections(version_id, cg_text)
+            if mode == "summary":
+                summary = self.summary(version_id, cg_text, client_oai, rate_limiter)
+                text = (
+                    f"[Résumé des Conditions Générales {version_id}]\n{summary.strip()}\n\n"
+                    f"[Sections propres au client]\n{specific}"
+                )
+            else:
+                text = specific
+            raw_tokens, sent_tokens = estimate_tokens(cg_text), estimate_tokens(text)
+            with self._lock:
+                self.raw_tokens += raw_tokens
+                self.sent_tokens += sent_tokens
+            resolved.append(text)
+        return resolved
+
+    def print_stats(self) -> None:
+        """Print how many affairs share each CG version and the prompt tokens saved this run."""
+        with self._lock:
+            versions = sorted(self._versions.items(), key=lambda kv: -len(kv[1]["affairs"]))
+        print("\n========== CG versions ==========")
+        for version_id, version in versions:
+            print(
+                f"{version_id}: {len(version['affairs'])} affairs, {version['tokens']} tokens "
+                f"(summary: {'yes' if version['summary'] else 'no'}) -> {', '.join(version['affairs'])}"
+            )
+        if self.raw_tokens:
+            print(
+                f"CG tokens this run: {self.raw_tokens} raw -> {self.sent_tokens} sent "
+                f"({1 - self.sent_tokens / self.raw_tokens:.0%} saved)"
+            )
+
+    def _reload(self) -> None:
+        """
+        Merge the registry file into memory; the caller holds `_lock` and the file lock.
+
+        Versions written by other processes are added, the affair lists are
+        united and a summary found on either side is kept.
+        """
+        try:
+            on_disk = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"CG registry: cannot read {self.path} ({e}), keeping the in-memory versions")
+            return
+        for version_id, version in on_disk.items():
+            mine = self._versions.setdefault(version_id, version)
+            if mine is version:
+                continue
+            mine["affairs"] += [a for a in version["affairs"] if a not in mine["affairs"]]
+            mine["summary"] = mine["summary"] or version["summary"]
+
+    def _flush(self) -> None:
+        """Write the registry atomically; the caller holds `_lock` and the file lock."""
+        tmp = self.path.with_suffix(f"{self.path.suffix}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self._versions, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
@@ -33,11 +33,26 @@ Exports
 - `cosms_db`:   `azure.cosmos.database.DatabaseProxy` (created if not exists)
 - `cosmos_digitaliezd`: `azure.cosmos.container.ContainerProxy`
 - `cosmos_table`:       `azure.cosmos.container.ContainerProxy`
+- `get_cosmos_docs_by_company()`: documents container partitioned on `/company_name_path`
+- `get_cosmos_table_rows()`: results container with one item per product row (`/affair`)
+- `get_cosmos_leases()`: affair lease documents of multi-worker runs (`/id`, item TTL on)
+- `DOCS_INDEXING_POLICY`: indexing policy of the documents containers (excludes `/content`)
 - `client_oai`: `openai.AzureOpenAI`
+- `get_async_clients()` / `close_async_clients()`: the `aio` counterparts of the
+  clients above (`AsyncAzureOpenAI`, `azure.*.aio`), built on demand for
+  `async_pipeline`
+
+All exported clients and containers are wrapped in `resilience.ResilientClient`:
+each call is retried on 429/503 and transient errors (honoring `Retry-After`,
+jittered exponential backoff otherwise) and admitted by a per-service
+`AIMDLimiter` (`oai_concurrency`, `di_concurrency`, `blob_concurrency`, `cosmos_concurrency`)
+that shrinks concurrency on throttling and grows it back on success.
 
 Behavior
 --------
-- Cosmos database and containers are created if they do not already exist.
+- Cosmos database and containers are created if they do not already exist. The
+  indexing policy only applies on creation; existing containers are updated by
+  `migrate_docs_schema.py --apply-indexing-policy`.
 - The Blob `ContainerClient` is obtained from the provided connection string and container name.
 - All clients are instantiated at import time for convenience and reuse.
 
@@ -63,8 +78,11 @@ Notes
   a `get_clients()` accessor to defer this work.
 - Secrets should ultimately come from environment variables or a secure secret store
   (e.g., Azure Key Vault) rather than a committed Python file.
-- If you need custom retry/timeout policies, consider constructing clients with
-  explicit `transport`/`retry_total`/`request_timeout` settings.
+- Every client is built with its SDK retries disabled (`max_retries=0` for
+  OpenAI, `retry_total=0` for DI and Blob, `cosmos_connection_policy()` plus
+  `retry_total=0` for Cosmos): retries are owned by the resilience layer, which
+  also covers paged iteration (`query_items`, `list_blobs`) and DI polling, so
+  attempts do not multiply and throttles reach the `AIMDLimiter`s.
 - Keep API versions pinned (e.g., Azure OpenAI) to avoid breaking changes.
 """
 
@@ -72,7 +90,12 @@ from azure.ai.documentintelligence import DocumentIntelligenceClient
 from azure.core.credentials import AzureKeyCredential
 from openai import AzureOpenAI
 from azure.storage.blob import BlobServiceClient
+from types import SimpleNamespace
+
 from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos.documents import ConnectionPolicy, RetryOptions
+
+from resilience import AIMDLimiter, ResilientClient
 
 from keys_generix import (
     di_endpoint,
@@ -88,17 +111,166 @@ from keys_generix import (
     COSMOS_CONTAINER_table,
 )
 
-client_di = DocumentIntelligenceClient(di_endpoint, AzureKeyCredential(di_key))
-blob = BlobServiceClient.from_connection_string(BLOB_CONNECTION_STRING)
-container = blob.get_container_client(BLOB_CONTAINER)
-cosmos = CosmosClient(COSMOS_ENDPOINT, COSMOS_KEY)
+oai_concurrency = AIMDLimiter(initial=8, max_limit=32)
+di_concurrency = AIMDLimiter(initial=8, max_limit=16)
+blob_concurrency = AIMDLimiter(initial=16, max_limit=64)
+cosmos_concurrency = AIMDLimiter(initial=16, max_limit=64)
+
+
+
+def cosmos_connection_policy() -> ConnectionPolicy:
+    """Cosmos connection policy without the SDK's own 429 retries (`retry_total=0` alone keeps them)."""
+    policy = ConnectionPolicy()
+    policy.RetryOptions = RetryOptions(max_retry_attempt_count=0)
+    return policy
+
+
+client_di = ResilientClient(
+    DocumentIntelligenceClient(di_endpoint, AzureKeyCredential(di_key), retry_total=0),
+    "di",
+    di_concurrency,
+)
+blob = BlobServiceClient.from_connection_string(BLOB_CONNECTION_STRING, retry_total=0)
+container = ResilientClient(blob.get_container_client(BLOB_CONTAINER), "blob", blob_concurrency)
+cosmos = CosmosClient(
+    COSMOS_ENDPOINT, COSMOS_KEY, connection_policy=cosmos_connection_policy(), retry_total=0
+)
 cosms_db = cosmos.create_database_if_not_exists(id=COSMOS_DATABASE)
-cosmos_digitaliezd = cosms_db.create_container_if_not_exists(
-    id=COSMOS_CONTAINER_digitalized, partition_key=PartitionKey(path="/id")
+# Documents are looked up by company fields, never by their (large) Markdown
+# content: keep `content` out of the index to cut write RU and index size.
+DOCS_INDEXING_POLICY = {
+    "indexingMode": "consistent",
+    "automatic": True,
+    "includedPaths": [{"path": "/*"}],
+    "excludedPaths": [{"path": "/content/?"}, {"path": '/"_etag"/?'}],
+}
+cosmos_digitaliezd = ResilientClient(
+    cosms_db.create_container_if_not_exists(
+        id=COSMOS_CONTAINER_digitalized,
+        partition_key=PartitionKey(path="/id"),
+        indexing_policy=DOCS_INDEXING_POLICY,
+    ),
+    "cosmos",
+    cosmos_concurrency,
 )
-cosmos_table = cosms_db.create_container_if_not_exists(
-    id=COSMOS_CONTAINER_table, partition_key=PartitionKey(path="/id")
+cosmos_table = ResilientClient(
+    cosms_db.create_container_if_not_exists(
+        id=COSMOS_CONTAINER_table, partition_key=PartitionKey(path="/id")
+    ),
+    "cosmos",
+    cosmos_concurrency,
 )
-client_oai = AzureOpenAI(
-    api_key=oai_key, api_version="2024-12-01-preview", azure_endpoint=oai_endpoint
+
+
+def get_cosmos_docs_by_company(suffix: str = "_by_company"):
+    """
+    Return (creating it if needed) a documents container partitioned by company.
+
+    Items keep the same schema as `cosmos_digitaliezd`, but the partition key is
+    `/company_name_path` so affair lookups can be single-partition queries. The
+    container is created lazily because it is only used once items have been
+    migrated (see `migrate_docs_schema.py`).
+    """
+    return ResilientClient(
+        cosms_db.create_container_if_not_exists(
+            id=COSMOS_CONTAINER_digitalized + suffix,
+            partition_key=PartitionKey(path="/company_name_path"),
+            indexing_policy=DOCS_INDEXING_POLICY,
+        ),
+        "cosmos",
+        cosmos_concurrency,
+    )
+
+
+def get_cosmos_table_rows(suffix: str = "_rows"):
+    """
+    Return (creating it if needed) the row-level results container.
+
+    One item per extracted product row, partitioned on `/affair` so that an
+    affair's rows can be written with transactional batches (see
+    `gpt_module.upsert_rows_to_cosmos`).
+    """
+    return ResilientClient(
+        cosms_db.create_container_if_not_exists(
+            id=COSMOS_CONTAINER_table + suffix, partition_key=PartitionKey(path="/affair")
+        ),
+        "cosmos",
+        cosmos_concurrency,
+    )
+
+
+def get_cosmos_leases(suffix: str = "_leases"):
+    """
+    Return (creating it if needed) the container of affair leases (see `leases`).
+
+    Partitioned on `/id` (one lease per document, point reads and
+    ETag-conditional replaces); `default_ttl=-1` enables the per-item `ttl`
+    that expires the lease documents of old runs.
+    """
+    return ResilientClient(
+        cosms_db.create_container_if_not_exists(
+            id=COSMOS_CONTAINER_table + suffix,
+            partition_key=PartitionKey(path="/id"),
+            default_ttl=-1,
+        ),
+        "cosmos",
+        cosmos_concurrency,
+    )
+
+
+client_oai = ResilientClient(
+    AzureOpenAI(
+        api_key=oai_key,
+        api_version="2024-12-01-preview",
+        azure_endpoint=oai_endpoint,
+        max_retries=0,
+    ),
+    "openai",
+    oai_concurrency,
 )
+
+
+def get_async_clients(docs_container_suffix: str = "") -> SimpleNamespace:
+    """
+    Build the asyncio clients of every service (nothing is created at import time).
+
+    Returns a namespace with `client_di`, `container` (Blob), `cosmos_docs`,
+    `cosmos_table` and `client_oai`. The Cosmos containers must already exist
+    (they are created by this module's synchronous bootstrap);
+    `docs_container_suffix="_by_company"` selects the company-partitioned
+    documents container. SDK retries are disabled as for the synchronous
+    clients (`async_pipeline` retries through `acall_with_retry`). Close them
+    with `close_async_clients`.
+    """
+    from azure.ai.documentintelligence.aio import DocumentIntelligenceClient as AioDocumentIntelligenceClient
+    from azure.cosmos.aio import CosmosClient as AioCosmosClient
+    from azure.storage.blob.aio import BlobServiceClient as AioBlobServiceClient
+    from openai import AsyncAzureOpenAI
+
+    blob_aio = AioBlobServiceClient.from_connection_string(BLOB_CONNECTION_STRING, retry_total=0)
+    cosmos_aio = AioCosmosClient(
+        COSMOS_ENDPOINT, COSMOS_KEY, connection_policy=cosmos_connection_policy(), retry_total=0
+    )
+    db_aio = cosmos_aio.get_database_client(COSMOS_DATABASE)
+    return SimpleNamespace(
+        client_di=AioDocumentIntelligenceClient(di_endpoint, AzureKeyCredential(di_key), retry_total=0),
+        blob_service=blob_aio,
+        container=blob_aio.get_container_client(BLOB_CONTAINER),
+        cosmos=cosmos_aio,
+        cosmos_docs=db_aio.get_container_client(COSMOS_CONTAINER_digitalized + docs_container_suffix),
+        cosmos_table=db_aio.get_container_client(COSMOS_CONTAINER_table),
+        client_oai=AsyncAzureOpenAI(
+            api_key=oai_key,
+            api_version="2024-12-01-preview",
+            azure_endpoint=oai_endpoint,
+            max_retries=0,
+        ),
+    )
+
+
+async def close_async_clients(clients: SimpleNamespace) -> None:
+    """Close the transports opened by `get_async_clients`."""
+    await clients.client_di.close()
+    await clients.blob_service.close()
+    await clients.cosmos.close()
+    await clients.client_oai.close()
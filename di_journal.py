@@ -0,0 +1,96 @@
+"""
+Local journal of in-flight Document Intelligence operations.
+
+`begin_analyze_document` returns a long-running-operation poller whose state can
+be serialized with `poller.continuation_token()`. Recording that token (keyed by
+blob name, blob ETag and page range) before blocking on `poller.result()` lets a
+restarted run resume the same analysis with
+`begin_analyze_document(model, None, continuation_token=token)` instead of
+submitting (and paying for) it again.
+
+Journal file shape
+------------------
+    {
+        "<blob name>@<etag>#<pages or 'all'>": {
+            "token": "<continuation token>",
+            "model": "prebuilt-layout",
+            "submitted_at": <epoch seconds>,
+        },
+        ...
+    }
+
+Notes
+-----
+- DI keeps analysis results for 24 hours; older entries are dropped when read
+  (`max_age_s`) since they can no longer be resumed.
+- The file is the source of truth: every lookup and change re-reads it under
+  an OS lock of `<journal>.lock` (`rate_limiter.file_lock`) plus a thread lock,
+  and changes are written back atomically (`os.replace`). The journal can thus
+  be shared by the DI thread pools and by several workers on one out-dir
+  (`--shard` / `--lease`) without one worker dropping the others' tokens.
+"""
+
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from rate_limiter import file_lock
+
+
+class DIJournal:
+    """Thread-safe JSON journal of pending DI continuation tokens."""
+
+    def __init__(self, path: Path, max_age_s: float = 23 * 3600) -> None:
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix(self.path.suffix + ".lock")
+        self.max_age_s = max_age_s
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, file_lock(self.lock_path):
+            entries = self._read()
+        if entries:
+            print(f"DI journal: {len(entries)} resumable operations in {self.path}")
+
+    def pending(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the recorded {token, model, submitted_at} for `key`, if any."""
+        with self._lock, file_lock(self.lock_path):
+            return self._read().get(key)
+
+    def record(self, key: str, token: str, model: str) -> None:
+        """Record the continuation token of a freshly submitted analysis."""
+        with self._lock, file_lock(self.lock_path):
+            entries = self._read()
+            entries[key] = {"token": token, "model": model, "submitted_at": time.time()}
+            self._write(entries)
+
+    def complete(self, key: str) -> None:
+        """Forget an analysis whose result has been retrieved."""
+        with self._lock, file_lock(self.lock_path):
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        """Entries of the journal file younger than `max_age_s`; the caller holds both locks."""
+        try:
+            entries = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"DI journal: cannot read {self.path} ({e}), starting empty")
+            return {}
+        now = time.time()
+        return {
+            key: entry
+            for key, entry in entries.items()
+            if now - entry.get("submitted_at", 0) <= self.max_age_s
+        }
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        tmp = self.path.with_suffix(f"{self.path.suffix}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(entries, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path)
@@ -3,10 +3,19 @@ Lightweight helpers for contract ingestion with Azure services.
 
 This module provides small, focused functions to:
 - List and filter PDF blob names (`read_pdfs`, `select_affair`)
+- Fingerprint blobs (ETag/Content-MD5) and skip PDFs already analyzed with the same
+  content and model (`read_pdf_fingerprints`, `filter_unchanged_pdfs`)
 - Parse blob paths into structured fields (`parse_blob_path`)
 - Produce safe identifiers from paths (`slugify_path`)
-- Run Azure Document Intelligence on PDFs and upsert results to Cosmos DB
-  (`upsert_cosmos_df`)
+- Run Azure Document Intelligence on PDFs and upsert results to Cosmos DB,
+  sequentially or with a bounded number of concurrent analyses
+  (`upsert_cosmos_df`, `analyze_pdf`, `build_di_payload`)
+- Split very long PDFs into page ranges analyzed concurrently and stitch the
+  results back together (`analyze_pdf_bytes`, `merge_analyze_results`)
+- Resume interrupted analyses from journaled continuation tokens (see `di_journal`)
+- Reuse DI results from a local content-addressed cache (see `disk_cache`)
+- Tier DI models: cheap `prebuilt-read` everywhere, `prebuilt-layout` only on
+  pages that look like pricing tables (`analyze_pdf_tiered`, `TIERED_DI_MODEL`)
 - Emit quick pricing stats from page counts (`print_price_estimations`)
 - Write per-document Markdown outputs (`write_local_mk_files`)
 - Orchestrate the whole DI flow for one affair (`process_affair_document_intelligence`)
@@ -32,7 +41,9 @@ Function outputs (shapes)
 -------------------------
 - `upsert_cosmos_df(...) -> list[dict]` where each dict includes:
     id, title, content, file_path, language, page_count, analyse_doc_model,
-    company_letter, company_name, company_affair, company_name_path, company_affair_path
+    company_letter, company_name, company_name_lc, company_affair, company_name_path,
+    company_affair_path, di_pages_by_model,
+    blob_etag, blob_content_md5
 
 Usage (minimal)
 ---------------
@@ -45,15 +56,23 @@ Usage (minimal)
 Notes
 -----
 - Case-insensitive filtering is performed via substring matching; adjust as needed.
-- Error handling is intentionally simple (per-file `HttpResponseError` is printed and skipped).
-- For production, consider structured logging, retries/timeouts, and stricter typing for SDK clients.
+- Throttling and transient errors are retried by the clients built in `clients.py`
+  (see `resilience`); a per-file `HttpResponseError` that survives the retries is
+  printed and skipped, also in concurrent mode where each file runs in its own worker.
 """
 
 from __future__ import annotations
+import base64
+import hashlib
 import os
 import re
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Any, Dict, List, Optional
+from azure.ai.documentintelligence.models import AnalyzeResult, DocumentSpan
 from azure.core.exceptions import HttpResponseError
 
 def print_db_content(cosmos_digitaliezd: Any, max_item_count: int = 100) -> None:
@@ -69,18 +88,29 @@ def process_affair_document_intelligence(
     client_di: Any,
     affair: Optional[str],
     local_path: Path,
+    max_concurrency: int = 1,
+    skip_unchanged: bool = True,
+    fingerprints: Optional[Dict[str, Dict[str, Optional[str]]]] = None,
+    page_range_size: Optional[int] = None,
+    journal: Optional[Any] = None,
+    di_cache: Optional[Any] = None,
+    analyse_doc_model: str = "prebuilt-layout",
+    rate_limiter: Optional[Any] = None,
 ) -> None:
     """
     Orchestrate the Document Intelligence phase for a single affair.
 
     Steps
     -----
-    1) List PDFs from the given blob container.
+    1) List PDFs (with their ETag/Content-MD5) from the given blob container,
+       unless `fingerprints` were already provided (e.g. by a blob inventory).
     2) Filter the list by `affair` (if provided).
-    3) Run Azure Document Intelligence on each selected PDF and upsert the
+    3) Drop PDFs whose fingerprint and DI model match what is already stored in
+       Cosmos (if `skip_unchanged`).
+    4) Run Azure Document Intelligence on each remaining PDF and upsert the
        resulting payloads into Cosmos.
-    4) Print basic price/page statistics.
-    5) Write Markdown outputs to `local_path`.
+    5) Print basic price/page statistics.
+    6) Write Markdown outputs to `local_path`.
 
     Parameters
     ----------
@@ -94,18 +124,53 @@ def process_affair_document_intelligence(
         Substring filter for PDF names. If `None`, process all PDFs.
     local_path : Path
         Directory where per-document Markdown files will be written.
+    max_concurrency : int, default 1
+        Number of concurrent DI analyses (see `upsert_cosmos_df`).
+    skip_unchanged : bool, default True
+        Skip PDFs already analyzed with the same blob content and DI model.
+    fingerprints : dict[str, dict] or None
+        Pre-listed {blob name: {etag, content_md5}}, typically
+        `blob_inventory.affair_fingerprints(...)`. Avoids listing the container.
+    page_range_size : int or None
+        Analyze PDFs longer than this many pages as concurrent page ranges.
+    journal : DIJournal or None
+        Journal of continuation tokens used to resume interrupted analyses.
+    di_cache : DiskCache or None
+        Local cache of DI results consulted before calling the service.
+    analyse_doc_model : str, default 'prebuilt-layout'
+        DI model, or `TIERED_DI_MODEL` for read-then-layout tiering.
+    rate_limiter : TokenRateLimiter or None
+        Requests/pages per minute limiter (see `upsert_cosmos_df`).
 
     Returns
     -------
     None
     """
-    pdfs_all = read_pdfs(container)
+    if fingerprints is None:
+        fingerprints = read_pdf_fingerprints(container)
+    pdfs_all = list(fingerprints)
     print("len(pdfs_all):", len(pdfs_all))
     pdfs_company = select_affair(pdfs_all, affair)
     for pdf in pdfs_company:
         print(pdf)
     print("len(pdfs_company) = ", len(pdfs_company))
-    docs = upsert_cosmos_df(cosmos_digitaliezd, container, client_di, pdfs_company)
+    if skip_unchanged:
+        pdfs_company = filter_unchanged_pdfs(
+            cosmos_digitaliezd, pdfs_company, fingerprints, analyse_doc_model
+        )
+    docs = upsert_cosmos_df(
+        cosmos_digitaliezd,
+        container,
+        client_di,
+        pdfs_company,
+        analyse_doc_model=analyse_doc_model,
+        max_concurrency=max_concurrency,
+        blob_fingerprints=fingerprints,
+        page_range_size=page_range_size,
+        journal=journal,
+        di_cache=di_cache,
+        rate_limiter=rate_limiter,
+    )
     print_price_estimations(docs)
     write_local_mk_files(docs, local_path)
 
@@ -156,18 +221,570 @@ def read_pdfs(container: Any) -> List[str]:
     return [b.name for b in container.list_blobs() if b.name.lower().endswith(".pdf")]
 
 
+def read_pdf_fingerprints(container: Any) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    List all PDF blobs with their change fingerprints in a single listing.
+
+    Returns
+    -------
+    dict[str, dict[str, str | None]]
+        Mapping blob name -> {"etag", "content_md5"}; `content_md5` is the
+        base64 Content-MD5 of the blob (None when the service did not compute one).
+    """
+    fingerprints: Dict[str, Dict[str, Optional[str]]] = {}
+    for b in container.list_blobs():
+        if b.name.lower().endswith(".pdf"):
+            fingerprints[b.name] = blob_fingerprint(b)
+    return fingerprints
+
+
+def blob_fingerprint(blob_properties: Any) -> Dict[str, Optional[str]]:
+    """Extract {etag, content_md5} from a `BlobProperties` object."""
+    settings = getattr(blob_properties, "content_settings", None)
+    md5 = getattr(settings, "content_md5", None) if settings is not None else None
+    return {
+        "etag": blob_properties.etag,
+        "content_md5": base64.b64encode(bytes(md5)).decode("ascii") if md5 else None,
+    }
+
+
+def filter_unchanged_pdfs(
+    cosmos_digitaliezd: Any,
+    pdfs_company: List[str],
+    fingerprints: Dict[str, Dict[str, Optional[str]]],
+    analyse_doc_model: str,
+) -> List[str]:
+    """
+    Drop PDFs whose stored fingerprint and DI model match the current blob.
+
+    The stored fingerprints of all candidates are fetched with one Cosmos query
+    (instead of one read per document). A PDF is considered unchanged when the
+    stored `analyse_doc_model` is the same and the Content-MD5 matches (or, if
+    either side has no MD5, the ETag matches).
+    """
+    if not pdfs_company:
+        return pdfs_company
+    ids = {slugify_path(pdf): pdf for pdf in pdfs_company}
+    stored = {
+        item["id"]: item
+        for item in cosmos_digitaliezd.query_items(
+            query=FINGERPRINT_QUERY,
+            parameters=[{"name": "@ids", "value": list(ids)}],
+            enable_cross_partition_query=True,
+        )
+    }
+    return select_changed_pdfs(ids, stored, fingerprints, analyse_doc_model)
+
+
+FINGERPRINT_QUERY = (
+    "SELECT c.id, c.blob_etag, c.blob_content_md5, c.analyse_doc_model FROM c "
+    "WHERE ARRAY_CONTAINS(@ids, c.id)"
+)
+
+
+def select_changed_pdfs(
+    ids: Dict[str, str],
+    stored: Dict[str, Dict[str, Any]],
+    fingerprints: Dict[str, Dict[str, Optional[str]]],
+    analyse_doc_model: str,
+) -> List[str]:
+    """Compare stored fingerprints ({doc id: item}) with the blobs ({doc id: pdf}); keep changed PDFs."""
+    to_process: List[str] = []
+    for doc_id, pdf in ids.items():
+        item = stored.get(doc_id)
+        current = fingerprints.get(pdf) or {}
+        if item is None or item.get("analyse_doc_model") != analyse_doc_model:
+            to_process.append(pdf)
+        elif current.get("content_md5") and item.get("blob_content_md5"):
+            if current["content_md5"] != item["blob_content_md5"]:
+                to_process.append(pdf)
+        elif not current.get("etag") or current["etag"] != item.get("blob_etag"):
+            to_process.append(pdf)
+    print(
+        f"DI fingerprint check: {len(ids) - len(to_process)} unchanged (skipped), "
+        f"{len(to_process)} to analyze"
+    )
+    return to_process
+
+
 def select_affair(pdfs_all: List[str], affair: Optional[str]) -> List[str]:
     """Filter PDFs by a case-insensitive substring; return all if no affair."""
     if not affair:
         return pdfs_all
     return [pdf for pdf in pdfs_all if affair in pdf.lower()]
 
+def build_di_payload(
+    pdf_name: str,
+    res: Any,
+    analyse_doc_model: str,
+    fingerprint: Optional[Dict[str, Optional[str]]] = None,
+) -> Dict[str, Any]:
+    """Build the Cosmos payload for one analyzed PDF from its DI `AnalyzeResult`."""
+    folder_strct_dict = parse_blob_path(pdf_name)
+    fingerprint = fingerprint or {}
+    return {
+        "id": slugify_path(pdf_name),
+        "title": os.path.basename(pdf_name),
+        "content": res.content or "",
+        "file_path": os.path.abspath(pdf_name),
+        "language": (res.languages[0].locale if res.languages else "unknown"),
+        "page_count": len(res.pages),
+        "analyse_doc_model": analyse_doc_model,
+        "di_pages_by_model": _pages_by_model(res, analyse_doc_model),
+        "company_letter": folder_strct_dict["letter"],
+        "company_name": folder_strct_dict["company"],
+        "company_name_lc": folder_strct_dict["company"].lower(),
+        "company_affair": folder_strct_dict["affair"],
+        "company_name_path": folder_strct_dict["company_key"],
+        "company_affair_path": folder_strct_dict["affair_key"],
+        "blob_etag": fingerprint.get("etag"),
+        "blob_content_md5": fingerprint.get("content_md5"),
+    }
+
+
+def _pages_by_model(res: Any, analyse_doc_model: str) -> Dict[str, int]:
+    """Pages billed per DI model: set by tiered analyses, else all pages on one model."""
+    pages_by_model = getattr(res, "pages_by_model", None)
+    if pages_by_model is None and hasattr(res, "get"):
+        pages_by_model = res.get("pagesByModel")
+    return pages_by_model or {analyse_doc_model: len(res.pages)}
+
+
+def analyze_pdf(
+    cosmos_digitaliezd: Any,
+    container: Any,
+    client_di: Any,
+    pdf_name: str,
+    analyse_doc_model: str = "prebuilt-layout",
+    fingerprint: Optional[Dict[str, Optional[str]]] = None,
+    page_range_size: Optional[int] = None,
+    journal: Optional[Any] = None,
+    di_cache: Optional[Any] = None,
+    rate_limiter: Optional[Any] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Download, analyze and upsert a single PDF.
+
+    Returns the upserted payload, or `None` if Document Intelligence raised an
+    `HttpResponseError` for this file (the error is printed and swallowed so that
+    one bad file never stops the rest of the batch). `fingerprint` is the blob's
+    {etag, content_md5} stored alongside the result for change detection.
+    `page_range_size` enables split analysis of long PDFs and `journal` makes the
+    analysis resumable (see `analyze_pdf_bytes`). With `di_cache`, a result
+    cached for the same PDF bytes and model is reused without calling DI.
+    With `rate_limiter`, one request and its page count are acquired before
+    each DI submission (see `_begin_analyze`; cache hits acquire nothing).
+    """
+    if fingerprint is None:
+        fingerprint = blob_fingerprint(container.get_blob_client(pdf_name).get_blob_properties())
+    pdf_bytes = container.download_blob(pdf_name).readall()
+    try:
+        cache_key = f"{hashlib.sha256(pdf_bytes).hexdigest()}|{analyse_doc_model}"
+        cached = di_cache.get(cache_key) if di_cache is not None else None
+        if cached is not None:
+            print("DI cache hit:", pdf_name)
+            res = AnalyzeResult(cached)
+        else:
+            res = analyze_pdf_bytes(
+                client_di,
+                pdf_bytes,
+                analyse_doc_model,
+                page_range_size,
+                journal=journal,
+                journal_prefix=f"{pdf_name}@{fingerprint.get('etag') or ''}",
+                rate_limiter=rate_limiter,
+            )
+            if di_cache is not None:
+                di_cache.put(cache_key, analyze_result_to_dict(res))
+        payload = build_di_payload(pdf_name, res, analyse_doc_model, fingerprint)
+        cosmos_digitaliezd.upsert_item(payload)
+        return payload
+    except HttpResponseError as e:
+        print(f"ERROR processing {pdf_name}: {e}")
+        return None
+
+
+def analyze_pdf_bytes(
+    client_di: Any,
+    pdf_bytes: bytes,
+    analyse_doc_model: str = "prebuilt-layout",
+    page_range_size: Optional[int] = None,
+    max_range_workers: int = 4,
+    journal: Optional[Any] = None,
+    journal_prefix: str = "",
+    rate_limiter: Optional[Any] = None,
+) -> Any:
+    """
+    Run Document Intelligence on one PDF, optionally split into page ranges.
+
+    Without `page_range_size` (or when the PDF is not longer than it) this is a
+    single `begin_analyze_document` call. Otherwise the document is analyzed as
+    concurrent `pages="a-b"` requests of `page_range_size` pages each, and the
+    partial results are stitched with `merge_analyze_results` into an object
+    exposing the same `content`, `pages` and `languages` attributes as an
+    `AnalyzeResult`, so the downstream payload is identical in shape.
+
+    The page count is read from the PDF structure (`count_pdf_pages`); if it
+    cannot be determined the document is sent in one piece.
+
+    With a `journal`, each request is recorded under
+    `"<journal_prefix>#<pages or 'all'>"` (see `_begin_analyze`), and
+    `rate_limiter` is acquired for each request.
+
+    `analyse_doc_model=TIERED_DI_MODEL` delegates to `analyze_pdf_tiered`.
+    """
+    if analyse_doc_model == TIERED_DI_MODEL:
+        return analyze_pdf_tiered(
+            client_di, pdf_bytes, journal=journal, journal_prefix=journal_prefix,
+            rate_limiter=rate_limiter,
+        )
+    n_pages = count_pdf_pages(pdf_bytes) if page_range_size else 0
+    if not page_range_size or n_pages <= page_range_size:
+        return _begin_analyze(
+            client_di, analyse_doc_model, pdf_bytes, journal=journal, journal_prefix=journal_prefix,
+            rate_limiter=rate_limiter,
+        )
+
+    ranges = [
+        f"{start}-{min(start + page_range_size - 1, n_pages)}"
+        for start in range(1, n_pages + 1, page_range_size)
+    ]
+    print(f"analyzing {n_pages} pages as {len(ranges)} ranges of {page_range_size}")
+    with ThreadPoolExecutor(max_workers=min(max_range_workers, len(ranges))) as pool:
+        partials = list(
+            pool.map(
+                lambda pages: _begin_analyze(
+                    client_di, analyse_doc_model, pdf_bytes, pages, journal, journal_prefix,
+                    rate_limiter,
+                ),
+                ranges,
+            )
+        )
+    return merge_analyze_results(partials)
+
+
+def analyze_kwargs(analyse_doc_model: str, pages: Optional[str] = None) -> Dict[str, Any]:
+    """Keyword arguments of `begin_analyze_document` (Markdown output except for prebuilt-read)."""
+    kwargs: Dict[str, Any] = {}
+    if analyse_doc_model != "prebuilt-read":
+        kwargs["output_content_format"] = "markdown"
+    if pages:
+        kwargs["pages"] = pages
+    return kwargs
+
+
+def _begin_analyze(
+    client_di: Any,
+    analyse_doc_model: str,
+    pdf_bytes: bytes,
+    pages: Optional[str] = None,
+    journal: Optional[Any] = None,
+    journal_prefix: str = "",
+    rate_limiter: Optional[Any] = None,
+) -> Any:
+    """
+    Submit one DI analysis (optionally restricted to `pages`) and wait for it.
+
+    With `rate_limiter`, one request and the pages it analyzes are acquired
+    before a new submission (a resumed operation was already admitted).
+
+    If `journal` holds a continuation token for this analysis (same blob, ETag,
+    page range and model), the operation is resumed from it. Otherwise the new
+    poller's token is journaled before blocking on `result()`, and removed once
+    the result is retrieved. A token that can no longer be resumed (expired or
+    unknown operation) falls back to a fresh submission.
+    """
+    key = f"{journal_prefix}#{pages or 'all'}"
+    pending = journal.pending(key) if journal is not None else None
+    if pending and pending["model"] == analyse_doc_model:
+        try:
+            print("resuming DI operation from journal:", key)
+            poller = client_di.begin_analyze_document(
+                analyse_doc_model, None, continuation_token=pending["token"]
+            )
+            res = poller.result()
+            journal.complete(key)
+            return res
+        except (HttpResponseError, ValueError) as e:
+            print(f"WARNING could not resume {key}, resubmitting: {e}")
+
+    if rate_limiter is not None:
+        n_pages = count_range_pages(pages) if pages else count_pdf_pages(pdf_bytes)
+        waited = rate_limiter.acquire(n_pages or 1)
+        if waited > 0:
+            print(f"DI rate limiter: waited {waited:.1f}s before {key}")
+    poller = client_di.begin_analyze_document(
+        analyse_doc_model, pdf_bytes, **analyze_kwargs(analyse_doc_model, pages)
+    )
+    if journal is not None:
+        journal.record(key, poller.continuation_token(), analyse_doc_model)
+    res = poller.result()
+    if journal is not None:
+        journal.complete(key)
+    return res
+
+
+_PDF_PAGE_RE = re.compile(rb"/Type\s*/Page(?!s)")
+
+
+def count_pdf_pages(pdf_bytes: bytes) -> int:
+    """
+    Count pages of a PDF by scanning for `/Type /Page` objects.
+
+    This is a dependency-free heuristic: it returns 0 when page objects live in
+    compressed object streams, in which case callers should not split the file.
+    """
+    return len(_PDF_PAGE_RE.findall(pdf_bytes))
+
+
+_PAGE_BREAK = "\n\n<!-- PageBreak -->\n\n"
+
+
+def merge_analyze_results(results: List[Any]) -> SimpleNamespace:
+    """
+    Stitch per-page-range DI results back into a single result-like object.
+
+    - `content`: Markdown of each range joined with a DI page-break marker.
+    - `pages`: concatenation of the range pages, with span offsets shifted to
+      point into the merged content.
+    - `languages`: detected languages, ordered by the amount of text they cover.
+    """
+    contents: List[str] = []
+    pages: List[Any] = []
+    language_weight: Dict[str, int] = {}
+    languages: Dict[str, Any] = {}
+    offset = 0
+    for res in results:
+        content = res.content or ""
+        for page in res.pages or []:
+            for span in getattr(page, "spans", None) or []:
+                span.offset += offset
+            pages.append(page)
+        for lang in res.languages or []:
+            weight = sum(span.length for span in (getattr(lang, "spans", None) or []))
+            language_weight[lang.locale] = language_weight.get(lang.locale, 0) + weight
+            languages.setdefault(lang.locale, lang)
+        contents.append(content)
+        offset += len(content) + len(_PAGE_BREAK)
+    ranked = sorted(languages, key=lambda locale: -language_weight[locale])
+    return SimpleNamespace(
+        content=_PAGE_BREAK.join(contents),
+        pages=pages,
+        languages=[languages[locale] for locale in ranked],
+    )
+
+
+TIERED_DI_MODEL = "prebuilt-read+prebuilt-layout"
+
+# Matched in heading-like lines only: in CG prose these words appear on almost
+# every page, which would send most pages to layout.
+FINANCIAL_PAGE_KEYWORDS = [
+    "prix",
+    "abonnement",
+    "conditions financieres",
+    "modalites de facturation",
+    "loyer",
+    "redevance",
+    "tarif",
+    "montant",
+    "prix unitaire",
+    "total ht",
+]
+
+_AMOUNT_RE = re.compile(r"\d[\d .,\u00a0\u202f]*\s?(?:€|eur\b|euros?\b|ht\b|ttc\b)")
+
+
+def is_financial_page(
+    text: str,
+    min_numeric_density: float = 0.12,
+    min_amounts: int = 3,
+    max_heading_words: int = 10,
+) -> bool:
+    """
+    Guess whether a page likely holds pricing tables (worth the layout model).
+
+    A bare keyword in running text is not enough. On the accent-insensitive
+    text, the page is flagged if:
+    - a heading-like line (at most `max_heading_words` words) contains one of
+      `FINANCIAL_PAGE_KEYWORDS` and the page quotes at least one amount;
+    - or it quotes at least `min_amounts` amounts (a number followed by €,
+      EUR, HT or TTC);
+    - or a currency marker appears while at least `min_numeric_density` of the
+      tokens are numbers (price grids without headings or units per cell).
+    """
+    folded = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    folded_amounts = unicodedata.normalize("NFKD", text.lower())  # keeps "€"
+    amounts = len(_AMOUNT_RE.findall(folded_amounts))
+    if amounts >= min_amounts:
+        return True
+    if amounts and any(
+        len(line.split()) <= max_heading_words and any(kw in line for kw in FINANCIAL_PAGE_KEYWORDS)
+        for line in folded.splitlines()
+    ):
+        return True
+    tokens = folded.split()
+    if not tokens:
+        return False
+    numeric = sum(1 for tok in tokens if re.fullmatch(r"[\d.,]*\d[\d.,€%]*", tok))
+    has_currency = "€" in text or " eur" in folded or "euro" in folded
+    return has_currency and numeric / len(tokens) >= min_numeric_density
+
+
+def tiered_break_even(read_model: str, layout_model: str) -> float:
+    """
+    Share of layout pages above which tiering costs more than layout alone.
+
+    Tiered: read x N + layout x F pages; layout only: layout x N. Break-even at
+    F / N = 1 - read / layout (about 0.85 with `DI_PRICE_1000P`).
+    """
+    return 1 - DI_PRICE_1000P[read_model] / DI_PRICE_1000P[layout_model]
+
+
+def page_texts(res: Any) -> Dict[int, str]:
+    """Map page number -> text of that page, using the page spans into `res.content`."""
+    content = res.content or ""
+    return {
+        page.page_number: "".join(
+            content[span.offset : span.offset + span.length] for span in (page.spans or [])
+        )
+        for page in res.pages
+    }
+
+
+def pages_to_ranges(page_numbers: List[int]) -> str:
+    """Compress sorted page numbers into DI's `pages` syntax, e.g. [1,2,3,7] -> '1-3,7'."""
+    ranges: List[str] = []
+    for n in sorted(page_numbers):
+        if ranges and int(ranges[-1].split("-")[-1]) == n - 1:
+            ranges[-1] = f"{ranges[-1].split('-')[0]}-{n}"
+        else:
+            ranges.append(str(n))
+    return ",".join(ranges)
+
+
+def count_range_pages(pages: str) -> int:
+    """Number of pages of a DI `pages` value, e.g. '1-3,7' -> 4."""
+    total = 0
+    for part in pages.split(","):
+        start, _, end = part.strip().partition("-")
+        total += int(end or start) - int(start) + 1
+    return total
+
+
+def analyze_pdf_tiered(
+    client_di: Any,
+    pdf_bytes: bytes,
+    read_model: str = "prebuilt-read",
+    layout_model: str = "prebuilt-layout",
+    journal: Optional[Any] = None,
+    journal_prefix: str = "",
+    rate_limiter: Optional[Any] = None,
+) -> SimpleNamespace:
+    """
+    Cheap-first analysis: `prebuilt-read` everywhere, `prebuilt-layout` on pricing pages.
+
+    1) Run the read model over the whole PDF.
+    2) Flag pages that likely contain pricing tables (`is_financial_page`).
+    3) Run the layout model only on those pages (DI `pages` parameter).
+    4) Rebuild the document page by page: layout Markdown for flagged pages,
+       plain read text for the others, joined with DI page-break markers.
+
+    When the flagged share exceeds `tiered_break_even`, tiering did not pay for
+    this document: the layout model analyzes it whole and its result is
+    returned as is (one coherent layout document for at most ~15% more layout
+    pages than the flagged ones).
+
+    The returned object exposes `content`, `pages` and `languages` like an
+    `AnalyzeResult`, plus `pages_by_model` with the pages billed per model
+    (reported by `print_price_estimations`). `rate_limiter` is acquired for
+    each of the two requests, with the pages each one analyzes.
+    """
+    res_read = _begin_analyze(
+        client_di, read_model, pdf_bytes, journal=journal, journal_prefix=journal_prefix + "|read",
+        rate_limiter=rate_limiter,
+    )
+    read_texts = page_texts(res_read)
+    financial = [n for n, text in read_texts.items() if is_financial_page(text)]
+    if read_texts and len(financial) / len(read_texts) > tiered_break_even(read_model, layout_model):
+        print(
+            f"tiered DI: {len(financial)}/{len(read_texts)} pages flagged, over the break-even "
+            f"share; whole document sent to {layout_model}"
+        )
+        res_layout = _begin_analyze(
+            client_di, layout_model, pdf_bytes, journal=journal,
+            journal_prefix=journal_prefix + "|layout", rate_limiter=rate_limiter,
+        )
+        return SimpleNamespace(
+            content=res_layout.content,
+            pages=res_layout.pages,
+            languages=res_layout.languages or [],
+            pages_by_model={read_model: len(res_read.pages), layout_model: len(res_layout.pages)},
+        )
+    print(f"tiered DI: {len(financial)}/{len(read_texts)} pages sent to {layout_model}")
+
+    layout_pages: Dict[int, Any] = {}
+    layout_texts: Dict[int, str] = {}
+    if financial:
+        res_layout = _begin_analyze(
+            client_di,
+            layout_model,
+            pdf_bytes,
+            pages_to_ranges(financial),
+            journal=journal,
+            journal_prefix=journal_prefix + "|layout",
+            rate_limiter=rate_limiter,
+        )
+        layout_pages = {page.page_number: page for page in res_layout.pages}
+        layout_texts = page_texts(res_layout)
+
+    contents: List[str] = []
+    pages: List[Any] = []
+    offset = 0
+    for page in res_read.pages:
+        n = page.page_number
+        text = layout_texts.get(n, read_texts[n])
+        merged_page = layout_pages.get(n, page)
+        merged_page.spans = [DocumentSpan(offset=offset, length=len(text))]
+        pages.append(merged_page)
+        contents.append(text)
+        offset += len(text) + len(_PAGE_BREAK)
+    return SimpleNamespace(
+        content=_PAGE_BREAK.join(contents),
+        pages=pages,
+        languages=res_read.languages or [],
+        pages_by_model={read_model: len(res_read.pages), layout_model: len(layout_pages)},
+    )
+
+
+def analyze_result_to_dict(res: Any) -> Dict[str, Any]:
+    """
+    Serialize a DI result to a JSON-compatible dict loadable by `AnalyzeResult(...)`.
+
+    Works for SDK `AnalyzeResult` objects and for the merged page-range results
+    of `merge_analyze_results`.
+    """
+    if hasattr(res, "as_dict"):
+        return res.as_dict()
+    return {
+        "content": res.content,
+        "pages": [page.as_dict() for page in res.pages],
+        "languages": [lang.as_dict() for lang in res.languages],
+        "pagesByModel": getattr(res, "pages_by_model", None),
+    }
+
+
 def upsert_cosmos_df(
     cosmos_digitaliezd: Any,
     container: Any,
     client_di: Any,
     pdfs_company: List[str],
     analyse_doc_model: str = "prebuilt-layout",
+    max_concurrency: int = 1,
+    blob_fingerprints: Optional[Dict[str, Dict[str, Optional[str]]]] = None,
+    page_range_size: Optional[int] = None,
+    journal: Optional[Any] = None,
+    di_cache: Optional[Any] = None,
+    rate_limiter: Optional[Any] = None,
 ) -> List[Dict[str, Any]]:
     """
     Analyze PDFs with Azure Document Intelligence and upsert results into Cosmos.
@@ -183,54 +800,105 @@ def upsert_cosmos_df(
     pdfs_company : list[str]
         The list of blob names to process.
     analyse_doc_model : str, default 'prebuilt-layout'
-        DI model identifier (e.g., 'prebuilt-layout', 'prebuilt-read').
+        DI model identifier (e.g., 'prebuilt-layout', 'prebuilt-read'), or
+        `TIERED_DI_MODEL` for read-then-layout tiering.
+    max_concurrency : int, default 1
+        Number of analyses kept in flight at the same time. With 1 the files are
+        processed sequentially; above 1 a thread pool downloads, analyzes and
+        upserts several files concurrently (the SDK clients are thread-safe).
+    blob_fingerprints : dict[str, dict] or None
+        Blob name -> {etag, content_md5} as returned by `read_pdf_fingerprints`,
+        stored in each payload. Missing entries are fetched per blob.
+    page_range_size : int or None
+        If set, PDFs longer than this many pages are analyzed as concurrent
+        page ranges and stitched back together (see `analyze_pdf_bytes`).
+    journal : DIJournal or None
+        If given, the continuation token of every submitted analysis is
+        journaled before waiting on it, and pending operations left by a
+        previous (crashed) run are resumed instead of resubmitted.
+    di_cache : DiskCache or None
+        Content-addressed cache of DI results (keyed by PDF SHA-256 + model).
+        Hits skip the DI call entirely; misses are stored after analysis.
+    rate_limiter : TokenRateLimiter or None
+        Limiter acquired before each analysis, with the PDF page count as
+        "tokens" (requests/minute and pages/minute). A `SharedTokenRateLimiter`
+        shares the DI resource quota with other pipeline processes.
 
     Returns
     -------
     list[dict[str, Any]]
-        A list of payloads that were upserted into Cosmos and used for output.
+        A list of payloads that were upserted into Cosmos and used for output,
+        in the same order as `pdfs_company` regardless of completion order.
 
     Side Effects
     ------------
-    - Prints progress to stdout.
+    - Prints progress and throughput (pages/minute) to stdout.
     - Upserts each payload to `cosmos_digitaliezd`.
 
     Exceptions
     ----------
     Catches `HttpResponseError` per-document and continues processing others.
     """
-    docs: List[Dict[str, Any]] = []
-    for i, pdf_name in enumerate(pdfs_company, start=1):
-        print(f"processing....{i}/{len(pdfs_company)}", pdf_name)
-        pdf_bytes = container.download_blob(pdf_name).readall()
-        try:
-            poller = client_di.begin_analyze_document(
-                analyse_doc_model, pdf_bytes, output_content_format="markdown"
-            )
-            res = poller.result()
-            folder_strct_dict = parse_blob_path(pdf_name)
-            payload: Dict[str, Any] = {
-                "id": slugify_path(pdf_name),
-                "title": os.path.basename(pdf_name),
-                "content": res.content or "",
-                "file_path": os.path.abspath(pdf_name),
-                "language": (res.languages[0].locale if res.languages else "unknown"),
-                "page_count": len(res.pages),
-                "analyse_doc_model": analyse_doc_model,
-                "company_letter": folder_strct_dict["letter"],
-                "company_name": folder_strct_dict["company"],
-                "company_affair": folder_strct_dict["affair"],
-                "company_name_path": folder_strct_dict["company_key"],
-                "company_affair_path": folder_strct_dict["affair_key"],
+    t0 = time.perf_counter()
+    n_pdfs = len(pdfs_company)
+    blob_fingerprints = blob_fingerprints or {}
+
+    def _analyze(pdf_name: str) -> Optional[Dict[str, Any]]:
+        return analyze_pdf(
+            cosmos_digitaliezd,
+            container,
+            client_di,
+            pdf_name,
+            analyse_doc_model,
+            fingerprint=blob_fingerprints.get(pdf_name),
+            page_range_size=page_range_size,
+            journal=journal,
+            di_cache=di_cache,
+            rate_limiter=rate_limiter,
+        )
+
+    if max_concurrency <= 1:
+        results: List[Optional[Dict[str, Any]]] = []
+        for i, pdf_name in enumerate(pdfs_company, start=1):
+            print(f"processing....{i}/{n_pdfs}", pdf_name)
+            results.append(_analyze(pdf_name))
+    else:
+        results = [None] * n_pdfs
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            futures = {
+                pool.submit(_analyze, pdf_name): idx for idx, pdf_name in enumerate(pdfs_company)
             }
-            docs.append(payload)
-            cosmos_digitaliezd.upsert_item(payload)
-        except HttpResponseError as e:
-            print(f"ERROR processing {pdf_name}: {e}")
+            for done, future in enumerate(as_completed(futures), start=1):
+                idx = futures[future]
+                results[idx] = future.result()
+                print(f"processed....{done}/{n_pdfs}", pdfs_company[idx])
+    docs = [doc for doc in results if doc is not None]
+    print_di_throughput(docs, time.perf_counter() - t0)
+    if di_cache is not None:
+        print("DI", di_cache.stats())
     return docs
 
+
+def print_di_throughput(docs: List[Dict[str, Any]], elapsed_s: float) -> None:
+    """Print analyzed documents/pages and the resulting pages/minute throughput."""
+    pages = sum(doc["page_count"] for doc in docs)
+    pages_per_min = pages / (elapsed_s / 60) if elapsed_s > 0 else 0.0
+    print(
+        f"DI throughput: {len(docs)} docs, {pages} pages in {elapsed_s:.1f}s "
+        f"= {pages_per_min:.1f} pages/min"
+    )
+
+DI_PRICE_1000P = {"prebuilt-layout": 8.626, "prebuilt-read": 1.294}
+
+
 def print_price_estimations(docs: List[Dict[str, Any]], model_price_1000p=8.626) -> None:
-    """Print mean pages and price estimate; no-op if docs is empty."""
+    """
+    Print mean pages and price estimate; no-op if docs is empty.
+
+    Documents carrying `di_pages_by_model` (tiered analyses) are priced per model
+    with `DI_PRICE_1000P`, and the blended cost per page is compared with the
+    layout-only price `model_price_1000p`.
+    """
     if not docs:
         print("No documents processed; skipping stats.")
         return
@@ -243,6 +911,29 @@ def print_price_estimations(docs: List[Dict[str, Any]], model_price_1000p=8.626)
         model_price_page * doc_mean,
         model_price_page * 2000 * doc_mean,
     )
+    pages_by_model: Dict[str, int] = {}
+    for doc in docs:
+        doc_pages_by_model = doc.get("di_pages_by_model") or {
+            doc.get("analyse_doc_model"): doc["page_count"]
+        }
+        for model, n in doc_pages_by_model.items():
+            pages_by_model[model] = pages_by_model.get(model, 0) + n
+    if set(pages_by_model) - {"prebuilt-layout"}:
+        total_cost = sum(
+            n * DI_PRICE_1000P.get(model, model_price_1000p) / 1000
+            for model, n in pages_by_model.items()
+        )
+        blended_page = total_cost / sum(doc_pages)
+        print("billed pages per model =", pages_by_model)
+        print(
+            f"blended price per page = {blended_page:.5f} "
+            f"(layout only = {model_price_page:.5f}, saving {1 - blended_page / model_price_page:.0%})"
+        )
+        print(
+            "blended price [single document, 2000X]",
+            blended_page * doc_mean,
+            blended_page * 2000 * doc_mean,
+        )
 
 def write_local_mk_files(docs: List[Dict[str, Any]], out_dir: Path) -> None:
     """
@@ -0,0 +1,99 @@
+"""
+Small on-disk JSON cache with a size cap and LRU eviction.
+
+Entries are JSON files named after the SHA-256 of their key, so any string
+(e.g. "<pdf sha256>|prebuilt-layout") can be used as a key. Recency is tracked
+with the file modification time, which is refreshed on every hit; when the total
+size exceeds `max_bytes`, the least recently used files are deleted first.
+
+Usage (minimal)
+---------------
+    cache = DiskCache(Path("./di_cache"), max_bytes=2 * 1024**3)
+    value = cache.get(key)
+    if value is None:
+        value = expensive_call()
+        cache.put(key, value)
+
+Notes
+-----
+- Writes are atomic (`os.replace`) and guarded by a lock, so a cache can be
+  shared by the thread pools of the DI and GPT phases.
+- The cache is local to one machine; deleting the directory simply empties it.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+class DiskCache:
+    """Content-addressed JSON cache on disk with LRU eviction above `max_bytes`."""
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 2 * 1024**3) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._sizes: Dict[Path, int] = {
+            f: f.stat().st_size for f in self.cache_dir.glob("*.json")
+        }
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / (hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for `key` (refreshing its recency) or None."""
+        path = self._path(key)
+        with self._lock:
+            if path not in self._sizes:
+                self.misses += 1
+                return None
+            try:
+                value = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._sizes.pop(path, None)
+                self.misses += 1
+                return None
+            now = time.time()
+            os.utime(path, (now, now))
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        """Store `value` (JSON-serializable) under `key`, then evict down to the cap."""
+        path = self._path(key)
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+            self._sizes[path] = len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        by_age = sorted(self._sizes, key=lambda f: f.stat().st_mtime if f.exists() else 0)
+        for f in by_age:
+            if total <= self.max_bytes:
+                break
+            total -= self._sizes.pop(f)
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> str:
+        """One-line summary of hits, misses, entries and size."""
+        return (
+            f"cache {self.cache_dir}: {self.hits} hits, {self.misses} misses, "
+            f"{len(self._sizes)} entries, {sum(self._sizes.values()) / 1024**2:.1f} MB"
+        )
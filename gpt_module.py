@@ -2,17 +2,36 @@
 Utilities for extracting product/financial data from contract text using GPT and Cosmos.
 
 This module contains lightweight helpers to:
-- Query digitalized contract documents from Cosmos (`get_docs`)
+- Query digitalized contract documents from Cosmos in one query, with RU/latency logging,
+  either by id substring or by the indexed company fields (`get_docs`, `query_items_instrumented`)
+- Retrieve the documents of many affairs from one paged id query, one affair at a time
+  (`iter_affair_docs`)
 - Partition documents into CG/CP/Avenant buckets (`get_cpcgav`)
-- Join CG/CP text blocks for prompting (`process_cgcp`)
-- Build chat messages for CG+CP and Avenant prompts (`build_message_cgcp`, `build_message_avenant`)
-- Call the chat model with tool calls and normalize outputs to a DataFrame (`get_response_df`)
-- Log token usage and rough € cost for a completion (`print_resp_properties`)
+- Join CG/CP text blocks for prompting (`process_cgcp`), and split them into token-budgeted
+  chunks extracted in parallel when the prompt is too large (`chunk_cgcp_content`, `merge_chunk_dfs`)
+- Build chat messages for CG+CP and Avenant prompts around one byte-stable, prompt-cacheable
+  prefix (`build_message_cgcp`, `build_message_avenant`, `build_chat_messages`), optionally
+  keeping only the financially relevant sections of each document (`section_filter`, see
+  `markdown_sections.filter_financial_sections`)
+- Call the chat model with tool calls and normalize outputs to a DataFrame (`get_response_df`,
+  `products_df`), recovering truncated outputs with follow-up requests
+  (`continue_truncated_extraction`); the request body and CG+CP message lists are shared
+  with the Batch API mode (`tool_completion_body`, `build_cgcp_messages`, see `batch_gpt`)
+- Log token usage and rough € cost for a completion (`print_resp_properties`) and for the
+  whole run (`usage_log`, `print_usage_summary`)
+- Cache completions on disk, keyed on the full request (`llm_cache_key`, see `disk_cache`)
 - Merge CG/CP and Avenant product tables with date normalization (`get_df_cpcgav_all`)
 - Clean pricing fields for one-shot/non-volume items (`loyer2null`)
 - Validate/rectify a DataFrame to a target column order (`validate_columns`, `rectify_df`)
 - Upsert the final results back into Cosmos as a single batch row (`upsert_to_cosmos`)
+  or as one item per row with delta transactional batches (`upsert_rows_to_cosmos`)
 - Concatenate multiple Avenant result tables (`concat_avenant_df`)
+- Expose the query constants and merge/persist helpers shared with the asyncio pipeline
+  (`DOCS_BY_ID_QUERY`, `DOCS_BY_COMPANY_QUERY`, `exclude_docs`, `build_affair_df`,
+  `affair_table_item`, see `async_pipeline`)
+- Run Avenant extractions concurrently under an RPM/TPM limiter (`run_avenants_pipeline`,
+  see `rate_limiter`), or the CG+CP and all Avenant calls of an affair at once
+  (`run_affair_extraction`)
 
 Expectations & external dependencies
 ------------------------------------
@@ -63,12 +82,25 @@ Notes
 - For stricter environments, consider retries, structured logging, and schema validation.
 """
 
+import hashlib
 import json
-from typing import Any, Dict, List, Tuple, Optional
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Generator, Iterator, List, Tuple, Optional
 
 import pandas as pd
 import numpy as np
 
+from markdown_sections import (
+    filter_financial_sections,
+    pack_sections,
+    section_outline,
+    split_markdown_sections,
+)
+from rate_limiter import estimate_request_tokens, estimate_tokens
+
 cp_identifiers = [
     "SOUSCRIPTION",
     "CP",
@@ -80,35 +112,180 @@ cp_identifiers = [
 cg_identifiers = ["CADRE", "CG"]
 av_identifiers = ["AVENANT-", "APPLICATION"]
 
+exclusin_flags = ["-ASP-", "PLAN-PROJET-GENERIX", "ANNEXE-DONNEES-PERSONNELLES"]
+
+
 def get_docs(
     company_name: str,
     cosmos_digitaliezd: Any,
     exclude_flag: bool = True,
     verbose: bool = True,
+    lookup: str = "id",
+    partition_key: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
-    """Fetch company docs from Cosmos by id substring; optionally exclude '-ASP-'."""
-    exclusin_flags = ["-ASP-", "PLAN-PROJET-GENERIX", "ANNEXE-DONNEES-PERSONNELLES"]
-    query = (
-        "SELECT VALUE c.id FROM c "
-        "WHERE CONTAINS(c.id, @kw, true) AND ENDSWITH(c.id, '.pdf')"
-    )
+    """
+    Fetch company docs from Cosmos by id substring; optionally exclude '-ASP-'.
+
+    Full documents are returned by a single query (no per-document `read_item`
+    round-trip); the exclusion flags are applied on the returned ids.
+
+    With `lookup="company"` the query filters on the structured
+    `company_name_lc` field written by the DI phase (`STARTSWITH`, served by
+    the range index) instead of scanning every id with `CONTAINS`. If
+    `partition_key` is also given (a `company_name_path`, for containers
+    partitioned by company, see `blob_inventory.company_partition_key`), the
+    query targets that single partition. When the
+    company lookup finds nothing (e.g. items not migrated yet, or a keyword that
+    is not a company-name prefix) it falls back to the id substring query.
+    """
     params = [{"name": "@kw", "value": company_name}]
-    doc_ids = list(
-        cosmos_digitaliezd.query_items(
-            query=query,
-            parameters=params,
-            enable_cross_partition_query=True,
+    docs: List[Dict[str, Any]] = []
+    if lookup == "company":
+        params = [{"name": "@kw", "value": company_name.lower()}]
+        kwargs: Dict[str, Any] = {}
+        if partition_key is not None:
+            kwargs = {"partition_key": partition_key, "enable_cross_partition_query": False}
+        docs = query_items_instrumented(
+            cosmos_digitaliezd, DOCS_BY_COMPANY_QUERY, params,
+            label=f"get_docs[company]({company_name})", verbose=verbose, **kwargs,
         )
-    )
+        if not docs:
+            print("WARNING company lookup found no docs, falling back to id substring query")
+            params = [{"name": "@kw", "value": company_name}]
+    if not docs:
+        docs = query_items_instrumented(
+            cosmos_digitaliezd, DOCS_BY_ID_QUERY, params, label=f"get_docs({company_name})",
+            verbose=verbose,
+        )
+    return exclude_docs(docs, exclude_flag, verbose)
+
+
+DOCS_BY_ID_QUERY = "SELECT * FROM c WHERE CONTAINS(c.id, @kw, true) AND ENDSWITH(c.id, '.pdf')"
+DOCS_BY_COMPANY_QUERY = (
+    "SELECT * FROM c WHERE STARTSWITH(c.company_name_lc, @kw) AND ENDSWITH(c.id, '.pdf')"
+)
+
+
+def exclude_docs(
+    docs: List[Dict[str, Any]], exclude_flag: bool = True, verbose: bool = True
+) -> List[Dict[str, Any]]:
+    """Drop documents carrying an exclusion flag (when `exclude_flag`), logging what was dropped."""
     if verbose:
-        print("numbers of docs original =", len(doc_ids))
+        print("numbers of docs original =", len(docs))
     if exclude_flag:
-        doc_final = [doc_id for doc_id in doc_ids if all([flag.lower() not in doc_id.lower() for flag in exclusin_flags ])]
-        if len(doc_final)!=len(doc_ids):
+        doc_final = [doc for doc in docs if not is_excluded_doc(doc["id"])]
+        if len(doc_final)!=len(docs):
             print("numbers of docs after exclusion =", len(doc_final))
-            print("excluded contracts = ", set(doc_ids) - set(doc_final))
+            print("excluded contracts = ", {doc["id"] for doc in docs} - {doc["id"] for doc in doc_final})
+        return doc_final
+    return docs
 
-    return [cosmos_digitaliezd.read_item(item=i, partition_key=i) for i in doc_final]
+
+def iter_affair_docs(
+    affairs: List[str],
+    cosmos_digitaliezd: Any,
+    exclude_flag: bool = True,
+    page_size: int = 200,
+    fetch_batch_size: int = 100,
+    verbose: bool = True,
+) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Yield `(affair, docs)` for many affairs from one paged id query.
+
+    Instead of one `get_docs` cross-partition scan per affair:
+
+    1) A single query projects only the ids matching any affair keyword
+       (`CONTAINS(c.id, @kw_i, true)` OR-ed together), streamed in pages of
+       `page_size`. Ids are assigned to every affair whose keyword they contain
+       (same case-insensitive semantics as `get_docs`) and exclusion flags are
+       applied.
+    2) Affairs are then yielded in input order; full documents (with their
+       Markdown content) of one affair are fetched in batches of at most
+       `fetch_batch_size` ids right before it is yielded, so only one affair's
+       content is held in memory at a time.
+
+    Each yielded `docs` list has the same shape as `get_docs` output; callers
+    classify it with `get_cpcgav` before moving to the next affair.
+    """
+    if not affairs:
+        return
+    keywords = {f"@kw{i}": affair for i, affair in enumerate(affairs)}
+    query = (
+        "SELECT VALUE c.id FROM c WHERE ("
+        + " OR ".join(f"CONTAINS(c.id, {name}, true)" for name in keywords)
+        + ") AND ENDSWITH(c.id, '.pdf')"
+    )
+    doc_ids = query_items_instrumented(
+        cosmos_digitaliezd,
+        query,
+        [{"name": name, "value": affair} for name, affair in keywords.items()],
+        label=f"iter_affair_docs[ids]({len(affairs)} affairs)",
+        verbose=verbose,
+        max_item_count=page_size,
+    )
+    ids_by_affair: Dict[str, List[str]] = {affair: [] for affair in affairs}
+    for doc_id in doc_ids:
+        if exclude_flag and is_excluded_doc(doc_id):
+            continue
+        for affair in affairs:
+            if affair.lower() in doc_id.lower():
+                ids_by_affair[affair].append(doc_id)
+
+    for affair in affairs:
+        affair_ids = ids_by_affair[affair]
+        docs: List[Dict[str, Any]] = []
+        for start in range(0, len(affair_ids), fetch_batch_size):
+            docs.extend(
+                query_items_instrumented(
+                    cosmos_digitaliezd,
+                    "SELECT * FROM c WHERE ARRAY_CONTAINS(@ids, c.id)",
+                    [{"name": "@ids", "value": affair_ids[start : start + fetch_batch_size]}],
+                    label=f"iter_affair_docs[docs]({affair})",
+                    verbose=verbose,
+                )
+            )
+        if verbose:
+            print(f"numbers of docs for {affair} =", len(docs))
+        yield affair, docs
+
+
+def is_excluded_doc(doc_id: str) -> bool:
+    """True if the document id carries one of the `exclusin_flags` (case-insensitive)."""
+    return any(flag.lower() in doc_id.lower() for flag in exclusin_flags)
+
+
+def query_items_instrumented(
+    cosmos_container: Any,
+    query: str,
+    parameters: List[Dict[str, Any]],
+    label: str = "query",
+    verbose: bool = True,
+    **kwargs: Any,
+) -> List[Dict[str, Any]]:
+    """
+    Run a cross-partition Cosmos query and log its RU charge, page count and latency.
+
+    The results are read page by page (`by_page()`) and the request charge is
+    the `x-ms-request-charge` header of `client_connection.last_response_headers`
+    after each page. The SDK `response_hook` is not used: some azure-cosmos
+    versions also call it once up front with the previous operation's headers.
+    """
+    charges: List[float] = []
+    items: List[Dict[str, Any]] = []
+    t0 = time.perf_counter()
+    kwargs.setdefault("enable_cross_partition_query", True)
+    pages = cosmos_container.query_items(query=query, parameters=parameters, **kwargs).by_page()
+    for page in pages:
+        items.extend(page)
+        headers = cosmos_container.client_connection.last_response_headers or {}
+        charges.append(float(headers.get("x-ms-request-charge", 0) or 0))
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    if verbose:
+        print(
+            f"[cosmos] {label}: {len(items)} items, {sum(charges):.1f} RU, "
+            f"{len(charges)} pages, {elapsed_ms:.0f} ms"
+        )
+    return items
 
 
 def get_cpcgav(
@@ -175,34 +352,49 @@ def build_message_cgcp(
         + "=== DOC: SOUSCRIPTION — type=souscription ===\n"
         + content_sous_str.strip()
     )
-    messages_cpcg = [
-        {"role": "system", "content": financial_prompt},
-        {
-            "role": "user",
-            "content": f"DOCUMENT CONTENT:\n\n{content_cpcg}\n\nTASK:\n{user_question}",
-        },
-    ]
+    messages_cpcg = build_chat_messages(content_cpcg, user_question, financial_prompt)
     return messages_cpcg
 
 def build_message_avenant(
     avenant_str: str, avenant_question: str, financial_prompt: str
 ) -> List[Dict[str, str]]:
     """Build chat messages for a single Avenant section using the financial prompt."""
-    messages_av = [
+    messages_av = build_chat_messages(avenant_str, avenant_question, financial_prompt)
+    return messages_av
+
+
+def build_chat_messages(
+    document_content: str, question: str, financial_prompt: str
+) -> List[Dict[str, str]]:
+    """
+    Build the messages of any extraction call around one byte-stable prefix.
+
+    Azure OpenAI prompt caching reuses the longest previously seen prefix of
+    the request (in 128-token steps, from 1024 tokens on): tools first, then
+    messages in order. Every CG+CP and Avenant call therefore starts with the
+    exact same tools (`financial_tools`) and system message (`financial_prompt`,
+    passed through unmodified), and everything that varies (document content,
+    then the task) comes after it in the single user message. Nothing
+    call-specific (ids, dates, counters) may be added before the document.
+    """
+    return [
         {"role": "system", "content": financial_prompt},
         {
             "role": "user",
-            "content": f"DOCUMENT CONTENT:\n\n{avenant_str}\n\nTASK:\n{avenant_question}",
+            "content": f"DOCUMENT CONTENT:\n\n{document_content}\n\nTASK:\n{question}",
         },
     ]
-    return messages_av
 
 def get_response_df(
     client_oai: Any,
     message: List[Dict[str, str]],
     tools: Any,
     model="gpt-4.1",
-    max_tokens=32000
+    max_tokens=32000,
+    rate_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    temperature: float = 0.05,
+    max_continuations: int = 2,
 ) -> pd.DataFrame:
     """
     Call the chat model with tools and return a normalized DataFrame of products.
@@ -219,6 +411,20 @@ def get_response_df(
         Deployment/model name for the completion call.
     max_tokens : int, default 32000
         Max tokens for the completion.
+    rate_limiter : TokenRateLimiter or None
+        If given, one request and the estimated quota tokens (prompt + tools +
+        `max_tokens`) are acquired from it before dispatch.
+    llm_cache : DiskCache or None
+        Response cache keyed on messages + tools + model + temperature +
+        max_tokens (`llm_cache_key`). A hit returns the stored tool-call
+        arguments without calling the model; a miss stores the arguments,
+        usage and finish reason once they parsed (see `response_df`). Pass
+        None to bypass it.
+    temperature : float, default 0.05
+        Sampling temperature of the completion call.
+    max_continuations : int, default 2
+        Follow-up requests allowed when the tool-call output is truncated
+        (`finish_reason == "length"`), see `continue_truncated_extraction`.
 
     Returns
     -------
@@ -229,40 +435,418 @@ def get_response_df(
     -----
     - Assumes the first choice contains a `tool_calls` entry with a JSON payload
       matching `{"products": [...]}`.
-    - Prints basic token usage and computed costs via `print_resp_properties`.
+    - Prints basic token usage and computed costs via `print_resp_properties`,
+      which also records the call (or cache hit) in `usage_log`.
     """
-    resp = client_oai.chat.completions.create(
-        model=model,
-        messages=message,
-        tools=tools,
-        tool_choice="auto", 
-        temperature=0.05,  
-        max_tokens=max_tokens,
+    return run_steps(
+        response_df_steps(message, tools, model, max_tokens, temperature, llm_cache, max_continuations),
+        lambda msgs: call_tool_completion(
+            client_oai, msgs, tools, model, max_tokens, temperature, rate_limiter
+        ),
     )
-    print_resp_properties(resp)
-    tool_call = resp.choices[0].message.tool_calls[0]
-    args_str = tool_call.function.arguments
+
+
+def response_df_steps(
+    message: List[Dict[str, str]],
+    tools: Any,
+    model: str,
+    max_tokens: int,
+    temperature: float,
+    llm_cache: Optional[Any] = None,
+    max_continuations: int = 2,
+) -> Generator[List[Dict[str, str]], Any, pd.DataFrame]:
+    """
+    Control flow of `get_response_df` without the I/O.
+
+    A generator that yields the messages of each completion to send, receives
+    the response, and returns the products DataFrame: cache lookup
+    (`cached_response_df`), truncation recovery (`continuation_steps`), parsing
+    and caching (`response_df`). `get_response_df` drives it with
+    `call_tool_completion`, the asyncio pipeline with its awaited counterpart
+    (see `run_steps`).
+    """
+    cache_key = llm_cache_key(message, tools, model, temperature, max_tokens)
+    df = cached_response_df(llm_cache, cache_key)
+    if df is not None:
+        return df
+    resp = yield message
+    args_str = tool_call_arguments(resp)
+    finish_reason = getattr(resp.choices[0], "finish_reason", None)
+    usage = usage_dict(resp)
+    if finish_reason == "length":
+        args_str, finish_reason, usage = yield from continuation_steps(
+            message, args_str, usage, max_continuations
+        )
+    return response_df(args_str, finish_reason, usage, llm_cache, cache_key)
+
+
+def run_steps(steps: Generator[Any, Any, Any], send: Callable[[Any], Any]) -> Any:
+    """Drive a `*_steps` generator, answering each yielded request with `send(request)`."""
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(send(request))
+    except StopIteration as stop:
+        return stop.value
+
+
+def products_df(args_str: str) -> pd.DataFrame:
+    """Normalize the `{"products": [...]}` tool-call arguments into a DataFrame."""
+    if not args_str:
+        raise ValueError("the model returned no tool call")
     data = json.loads(args_str)
     df = pd.json_normalize(data["products"])
     return df
 
 
-def print_resp_properties(resp: Any, INPUT_EUR_PER_1M = 1.73, OUTPUT_EUR_PER_1M = 6.91) -> None:
-    """Print token usage, rough € cost, and finish reason for a chat completion."""
+def response_df(
+    args_str: str,
+    finish_reason: Optional[str],
+    usage: Dict[str, int],
+    llm_cache: Optional[Any] = None,
+    cache_key: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Parse the final tool-call arguments, then cache them if the output is complete.
+
+    The entry is only stored once `products_df` succeeded and the output is no
+    longer truncated: a missing tool call, invalid JSON or products salvaged
+    from a still-truncated output must not be replayed by later runs.
+    """
+    df = products_df(args_str)
+    if llm_cache is not None and finish_reason != "length":
+        llm_cache.put(
+            cache_key, {"arguments": args_str, "finish_reason": finish_reason, "usage": usage}
+        )
+    return df
+
+
+def usable_cache_entry(entry: Optional[Dict[str, Any]]) -> bool:
+    """True for a cached completion that is complete and parses (see `response_df`)."""
+    if entry is None or entry.get("finish_reason") == "length":
+        return False
+    try:
+        products_df(entry["arguments"])
+    except (ValueError, KeyError, TypeError):
+        return False
+    return True
+
+
+def cached_response_df(llm_cache: Optional[Any], cache_key: str) -> Optional[pd.DataFrame]:
+    """
+    DataFrame of a cached completion (logged as a cache hit), None on a miss.
+
+    Entries that are truncated or do not parse (written before `response_df`
+    checked them) count as misses, so the request is sent again and the entry
+    overwritten.
+    """
+    cached = llm_cache.get(cache_key) if llm_cache is not None else None
+    if cached is None:
+        return None
+    if not usable_cache_entry(cached):
+        print("LLM cache: ignoring an incomplete or unparseable entry")
+        return None
+    print_resp_properties(cached_response(cached), cache_hit=True)
+    return products_df(cached["arguments"])
+
+
+def tool_completion_body(
+    message: List[Dict[str, str]],
+    tools: Any,
+    model: str,
+    max_tokens: int,
+    temperature: float,
+) -> Dict[str, Any]:
+    """Keyword arguments of one tool-calling chat completion (also the Batch API request body)."""
+    return {
+        "model": model,
+        "messages": message,
+        "tools": tools,
+        "tool_choice": "auto",
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+
+
+def call_tool_completion(
+    client_oai: Any,
+    message: List[Dict[str, str]],
+    tools: Any,
+    model: str,
+    max_tokens: int,
+    temperature: float,
+    rate_limiter: Optional[Any] = None,
+) -> Any:
+    """Acquire quota, send one tool-calling chat completion, and log its usage."""
+    if rate_limiter is not None:
+        waited = rate_limiter.acquire(estimate_request_tokens(message, tools, max_tokens))
+        if waited > 0:
+            print(f"rate limiter: waited {waited:.1f}s before dispatch")
+    t0 = time.perf_counter()
+    resp = client_oai.chat.completions.create(
+        **tool_completion_body(message, tools, model, max_tokens, temperature)
+    )
+    print_resp_properties(resp, latency_s=time.perf_counter() - t0)
+    return resp
+
+
+def tool_call_arguments(resp: Any) -> str:
+    """Arguments string of the first tool call ("" if the output has none)."""
+    tool_calls = resp.choices[0].message.tool_calls
+    return tool_calls[0].function.arguments if tool_calls else ""
+
+
+def usage_dict(resp: Any) -> Dict[str, int]:
+    """Token usage of a completion as a plain dict (as stored in the LLM cache)."""
+    return {
+        "prompt_tokens": resp.usage.prompt_tokens,
+        "completion_tokens": resp.usage.completion_tokens,
+        "total_tokens": resp.usage.total_tokens,
+        "cached_tokens": cached_prompt_tokens(resp),
+    }
+
+
+def salvage_products(args_str: str) -> List[Dict[str, Any]]:
+    """
+    Recover the complete product objects from a truncated `{"products": [...]}` string.
+
+    Objects are decoded one by one from the start of the `products` array; the
+    first incomplete one (cut by the token limit) and everything after it are
+    discarded.
+    """
+    match = re.search(r'"products"\s*:\s*\[', args_str)
+    if match is None:
+        return []
+    decoder = json.JSONDecoder()
+    products: List[Dict[str, Any]] = []
+    pos = match.end()
+    while True:
+        while pos < len(args_str) and args_str[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(args_str) or args_str[pos] != "{":
+            break
+        try:
+            product, pos = decoder.raw_decode(args_str, pos)
+        except json.JSONDecodeError:
+            break
+        products.append(product)
+    return products
+
+
+def continue_truncated_extraction(
+    client_oai: Any,
+    message: List[Dict[str, str]],
+    tools: Any,
+    args_str: str,
+    usage: Dict[str, int],
+    model: str,
+    max_tokens: int,
+    temperature: float,
+    rate_limiter: Optional[Any] = None,
+    max_continuations: int = 2,
+) -> Tuple[str, Optional[str], Dict[str, int]]:
+    """
+    Recover a tool-call output truncated by `max_tokens` instead of re-running it.
+
+    The complete products already emitted are salvaged (`salvage_products`),
+    then a follow-up request made of the *same* messages plus one user message
+    listing what was already extracted asks only for the remaining products.
+    Because the original messages are repeated byte for byte, the follow-up
+    prompt is served from the provider prompt cache (see `build_chat_messages`)
+    and only the new instruction is billed at the full input rate. This repeats
+    while the output stays truncated, up to `max_continuations` times.
+
+    Returns the merged `{"products": [...]}` arguments string, the last finish
+    reason and the summed usage.
+    """
+    return run_steps(
+        continuation_steps(message, args_str, usage, max_continuations),
+        lambda msgs: call_tool_completion(
+            client_oai, msgs, tools, model, max_tokens, temperature, rate_limiter
+        ),
+    )
+
+
+def continuation_steps(
+    message: List[Dict[str, str]],
+    args_str: str,
+    usage: Dict[str, int],
+    max_continuations: int = 2,
+) -> Generator[List[Dict[str, str]], Any, Tuple[str, Optional[str], Dict[str, int]]]:
+    """
+    Control flow of `continue_truncated_extraction` (see `response_df_steps`).
+
+    Chat completions are stateless, so each continuation re-sends the whole
+    prompt (document included) followed by `continuation_prompt`. The prompt is
+    byte-identical to the first call, so it is billed at the prompt-cache rate
+    when the service caches it; the truncated output itself is not re-sent, only
+    the key fields of the products already extracted. A follow-up whose tool
+    call is not valid `{"products": [...]}` JSON keeps the products that can be
+    salvaged from it instead of losing everything extracted so far.
+    """
+    products = salvage_products(args_str)
+    finish_reason: Optional[str] = "length"
+    usage = dict(usage)
+    for n in range(1, max_continuations + 1):
+        print(f"truncated output: {len(products)} products salvaged, continuation {n}/{max_continuations}")
+        resp = yield message + [{"role": "user", "content": continuation_prompt(products)}]
+        for k, v in usage_dict(resp).items():
+            usage[k] = usage.get(k, 0) + v
+        finish_reason = getattr(resp.choices[0], "finish_reason", None)
+        more_args = tool_call_arguments(resp)
+        if finish_reason == "length":
+            products.extend(salvage_products(more_args))
+            continue
+        try:
+            products.extend(json.loads(more_args)["products"] if more_args else [])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"WARNING unparseable continuation ({e!r}); keeping salvaged products")
+            products.extend(salvage_products(more_args))
+        break
+    else:
+        print("WARNING output still truncated after continuations; keeping salvaged products")
+    return json.dumps({"products": products}, ensure_ascii=False), finish_reason, usage
+
+
+def continuation_prompt(products: List[Dict[str, Any]]) -> str:
+    """Ask for the products that come after those already extracted."""
+    done = "\n".join(
+        f"- {p.get('avenant_number')} | {p.get('product_code')} | {p.get('product_name')}"
+        for p in products
+    )
+    return (
+        "Your previous tool call was cut by the output token limit. "
+        f"These {len(products)} products were already extracted "
+        "(avenant_number | product_code | product_name):\n"
+        f"{done}\n\n"
+        "Continue from where you stopped: return via the tool ONLY the remaining products, "
+        "in the same order and with the same rules. Do not repeat the products listed above."
+    )
+
+
+def llm_cache_key(
+    message: List[Dict[str, str]],
+    tools: Any,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+) -> str:
+    """Stable SHA-256 key of everything that determines a completion request."""
+    request = {
+        "messages": message,
+        "tools": tools,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    blob = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def cached_response(cached: Dict[str, Any]) -> SimpleNamespace:
+    """Rebuild a response-like object (usage, choices[0].finish_reason) from a cache entry."""
+    usage = dict(cached["usage"])
+    cached_tokens = usage.pop("cached_tokens", 0)
+    return SimpleNamespace(
+        usage=SimpleNamespace(
+            **usage, prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens)
+        ),
+        choices=[SimpleNamespace(finish_reason=cached.get("finish_reason"))],
+    )
+
+
+def cached_prompt_tokens(resp: Any) -> int:
+    """Prompt tokens served from the provider prompt cache (0 if not reported)."""
+    details = getattr(resp.usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+
+
+# One entry per completion (or cache hit) of this process, see `print_usage_summary`.
+usage_log: List[Dict[str, Any]] = []
+
+
+def print_resp_properties(
+    resp: Any,
+    INPUT_EUR_PER_1M = 1.73,
+    OUTPUT_EUR_PER_1M = 6.91,
+    cache_hit: bool = False,
+    latency_s: Optional[float] = None,
+    CACHED_INPUT_EUR_PER_1M = 0.43,
+) -> None:
+    """
+    Print token usage, rough € cost, and finish reason; record the call in `usage_log`.
+
+    Prompt tokens served from the provider prompt cache (`cached_tokens`) are
+    billed at `CACHED_INPUT_EUR_PER_1M`; the printed cost is the effective,
+    discounted one.
+    """
     pt = resp.usage.prompt_tokens
     ct = resp.usage.completion_tokens
     tt = resp.usage.total_tokens
-    print(f"prompt: {pt}, completion: {ct}, total: {tt}")
-    cost_eur = (pt / 1_000_000) * INPUT_EUR_PER_1M + (
+    cached = cached_prompt_tokens(resp)
+    print(
+        f"{'[LLM cache hit] ' if cache_hit else ''}prompt: {pt} (cached: {cached}), "
+        f"completion: {ct}, total: {tt}"
+    )
+    cost_eur = ((pt - cached) / 1_000_000) * INPUT_EUR_PER_1M + (
+        cached / 1_000_000
+    ) * CACHED_INPUT_EUR_PER_1M + (
         ct / 1_000_000
     ) * OUTPUT_EUR_PER_1M
-    print(f"Cost per doc: €{cost_eur:.2f}")
+    prompt_cache_saving = (cached / 1_000_000) * (INPUT_EUR_PER_1M - CACHED_INPUT_EUR_PER_1M)
+    usage_log.append(
+        {
+            "cache_hit": cache_hit,
+            "prompt_tokens": pt,
+            "cached_tokens": cached,
+            "completion_tokens": ct,
+            "cost_eur": 0.0 if cache_hit else cost_eur,
+            "saved_eur": cost_eur if cache_hit else 0.0,
+            "prompt_cache_saved_eur": 0.0 if cache_hit else prompt_cache_saving,
+            "latency_s": latency_s,
+        }
+    )
+    print(f"Cost per doc: €{cost_eur:.2f}{' (saved by cache)' if cache_hit else ''}")
     print(f"Cost all: €{2000*cost_eur:.2f}")    
     print(
         "Finish reason (if length then truncated output) = ",
         getattr(resp.choices[0], "finish_reason", None),
     )
 
+def print_usage_summary() -> None:
+    """
+    Print totals of `usage_log`: calls, cache hits, tokens, € spent and saved.
+
+    Provider prompt caching is reported separately: the share of prompt tokens
+    served from it, the € it saved, and the mean latency of calls with and
+    without cached prefix.
+    """
+    if not usage_log:
+        return
+    hits = sum(1 for u in usage_log if u["cache_hit"])
+    latencies = [u["latency_s"] for u in usage_log if u["latency_s"] is not None]
+    called = [u for u in usage_log if not u["cache_hit"]]
+    prompt_called = sum(u["prompt_tokens"] for u in called)
+    cached_called = sum(u["cached_tokens"] for u in called)
+    print(
+        f"LLM usage: {len(usage_log)} calls ({hits} cache hits), "
+        f"prompt {sum(u['prompt_tokens'] for u in usage_log)}, "
+        f"completion {sum(u['completion_tokens'] for u in usage_log)}, "
+        f"spent €{sum(u['cost_eur'] for u in usage_log):.2f}, "
+        f"saved €{sum(u['saved_eur'] for u in usage_log):.2f}, "
+        f"mean latency {sum(latencies) / len(latencies) if latencies else 0:.1f}s"
+    )
+    warm = [u["latency_s"] for u in called if u["cached_tokens"] and u["latency_s"] is not None]
+    cold = [u["latency_s"] for u in called if not u["cached_tokens"] and u["latency_s"] is not None]
+    print(
+        f"prompt caching: {cached_called}/{prompt_called} prompt tokens cached "
+        f"({cached_called / prompt_called if prompt_called else 0:.0%}), "
+        f"saved €{sum(u['prompt_cache_saved_eur'] for u in called):.2f}, "
+        f"mean latency cached-prefix {sum(warm) / len(warm) if warm else 0:.1f}s "
+        f"vs cold {sum(cold) / len(cold) if cold else 0:.1f}s"
+    )
+
+
 def get_df_cpcgav_all(df_cpcg: pd.DataFrame, df_av_all: pd.DataFrame) -> pd.DataFrame:
     """Concat CG/CP & AV, normalize 'null' dates, sort, and clean helper column."""
     df = pd.concat([df_cpcg, df_av_all])
@@ -309,8 +893,103 @@ def loyer2null(df: pd.DataFrame, safe_flag: bool = True) -> pd.DataFrame:
 
 def upsert_to_cosmos(affair_df: pd.DataFrame, affair: str, cosmos_table: Any) -> None:
     """Upsert all rows as a single batch item {id=affair, rows=[...] }."""
+    cosmos_table.upsert_item(affair_table_item(affair_df, affair))
+
+
+def affair_table_item(affair_df: pd.DataFrame, affair: str) -> Dict[str, Any]:
+    """The single results item {id=affair, rows=[...]} of an affair."""
     rows = json.loads(affair_df.to_json(orient="records"))
-    cosmos_table.upsert_item({"id": affair, "rows": rows})
+    return {"id": affair, "rows": rows}
+
+
+def build_affair_df(cpcg_df: pd.DataFrame, df_av_all: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """Merge the CG+CP and Avenant tables of an affair and clean them for persistence."""
+    if df_av_all is not None:
+        affair_df = get_df_cpcgav_all(cpcg_df, df_av_all)
+    else:
+        affair_df = cpcg_df.copy()
+    affair_df = loyer2null(affair_df)
+    affair_df = affair_df.fillna("null")
+    return affair_df
+
+ROW_KEY_COLUMNS = ["avenant_number", "product_code", "product_name"]
+
+
+def build_row_items(rows: List[Dict[str, Any]], affair: str) -> List[Dict[str, Any]]:
+    """
+    Turn product rows into one Cosmos item per row for row-level storage.
+
+    Each item keeps the row fields and adds:
+    - `id`: `<affair>-<key hash>`, where the key is (`ROW_KEY_COLUMNS`, occurrence
+      index among rows sharing those values), so ids are stable across re-runs
+      even if the row order changes.
+    - `affair`: the partition key.
+    - `row_hash`: SHA-1 of the row content, used to detect changed rows.
+    """
+    items: List[Dict[str, Any]] = []
+    occurrences: Dict[str, int] = {}
+    safe_affair = affair.replace("/", "_").replace("\\", "_").replace("?", "_").replace("#", "_")
+    for row in rows:
+        key = json.dumps([row.get(c) for c in ROW_KEY_COLUMNS], sort_keys=True, default=str)
+        n = occurrences.get(key, 0)
+        occurrences[key] = n + 1
+        key_hash = hashlib.sha1(f"{key}|{n}".encode("utf-8")).hexdigest()[:16]
+        row_hash = hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        items.append({**row, "id": f"{safe_affair}-{key_hash}", "affair": affair, "row_hash": row_hash})
+    return items
+
+
+def upsert_rows_to_cosmos(
+    affair_df: pd.DataFrame,
+    affair: str,
+    cosmos_rows: Any,
+    batch_size: int = 100,
+) -> Dict[str, int]:
+    """
+    Delta-upsert one Cosmos item per product row, partitioned by affair.
+
+    Unlike `upsert_to_cosmos` (one `{id, rows}` item per affair, bounded by the
+    2 MB item limit and fully rewritten on each run), rows are written as
+    separate items in a container partitioned on `/affair`:
+
+    1) The stored `id`/`row_hash` pairs of the affair are read with one
+       single-partition query.
+    2) Only new or changed rows are upserted, and rows that disappeared are
+       deleted, through transactional batches of at most `batch_size`
+       operations (the Cosmos batch limit is 100).
+
+    Returns counters {upserted, unchanged, deleted}.
+    """
+    items = build_row_items(json.loads(affair_df.to_json(orient="records")), affair)
+    stored = {
+        item["id"]: item["row_hash"]
+        for item in query_items_instrumented(
+            cosmos_rows,
+            "SELECT c.id, c.row_hash FROM c",
+            [],
+            label=f"row hashes({affair})",
+            partition_key=affair,
+            enable_cross_partition_query=False,
+        )
+    }
+    new_ids = {item["id"] for item in items}
+    operations: List[Tuple[str, Tuple[Any, ...]]] = [
+        ("upsert", (item,)) for item in items if stored.get(item["id"]) != item["row_hash"]
+    ]
+    deletes = [item_id for item_id in stored if item_id not in new_ids]
+    operations += [("delete", (item_id,)) for item_id in deletes]
+    for start in range(0, len(operations), batch_size):
+        cosmos_rows.execute_item_batch(
+            batch_operations=operations[start : start + batch_size], partition_key=affair
+        )
+    stats = {
+        "upserted": len(operations) - len(deletes),
+        "unchanged": len(items) - (len(operations) - len(deletes)),
+        "deleted": len(deletes),
+    }
+    print(f"row-level upsert [{affair}]:", stats)
+    return stats
+
 
 def validate_columns(df: pd.DataFrame, col_order: List[str]) -> None:
     """Ensure df columns exactly match `col_order` (order & membership)."""
@@ -338,6 +1017,11 @@ def run_cgcp_pipeline(
     financial_prompt: str,
     financial_tools: Any,
     col_order: List[str],
+    rate_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    prompt_token_budget: Optional[int] = None,
+    max_workers: int = 4,
+    section_filter: Optional[Dict[str, Any]] = None,
 ) -> pd.DataFrame:
     """
     Build a CG+CP prompt, call the model, and return a rectified products DataFrame.
@@ -365,19 +1049,180 @@ def run_cgcp_pipeline(
         Tool definitions passed to the completion call.
     col_order : list[str]
         Expected column order enforced by `rectify_df`.
+    rate_limiter : TokenRateLimiter or None
+        Shared RPM/TPM limiter acquired before the completion call.
+    llm_cache : DiskCache or None
+        Completion cache (see `get_response_df`).
+    prompt_token_budget : int or None
+        Pre-flight budget for the prompt (messages + tools) in tokens. If the
+        joined CG+CP prompt exceeds it, the content is split along Markdown
+        section boundaries into chunks that fit (`chunk_cgcp_content`), the
+        chunks are extracted in parallel and the product tables are merged with
+        `merge_chunk_dfs` before rectification.
+    max_workers : int, default 4
+        Concurrent chunk extractions when the budget is exceeded.
+    section_filter : dict or None
+        When given, keyword arguments of `filter_financial_sections` (e.g.
+        `{"context": 1, "min_keep_fraction": 0.3}`): the CG and CP text is reduced
+        to its financially relevant sections before the prompt is built. None
+        sends the full text.
 
     Returns
     -------
     pandas.DataFrame
         The rectified products table extracted from CG+CP content.
     """
+    messages_list = build_cgcp_messages(
+        content_cadre, content_sous, cgcp_question, financial_prompt, financial_tools,
+        prompt_token_budget, section_filter,
+    )
+
+    def _extract(messages: List[Dict[str, str]]) -> pd.DataFrame:
+        return get_response_df(
+            client_oai, messages, financial_tools, rate_limiter=rate_limiter, llm_cache=llm_cache
+        )
+
+    if len(messages_list) == 1:
+        chunk_dfs = [_extract(messages_list[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            chunk_dfs = list(pool.map(_extract, messages_list))
+    return cgcp_df_from_chunks(chunk_dfs, col_order)
+
+
+def cgcp_df_from_chunks(chunk_dfs: List[pd.DataFrame], col_order: List[str]) -> pd.DataFrame:
+    """Merge the CG+CP chunk tables (`merge_chunk_dfs`, if several) and rectify the result."""
+    affair_df = chunk_dfs[0] if len(chunk_dfs) == 1 else merge_chunk_dfs(chunk_dfs)
+    return rectify_df(affair_df, col_order)
+
+
+def build_cgcp_messages(
+    content_cadre: List[str],
+    content_sous: List[str],
+    cgcp_question: str,
+    financial_prompt: str,
+    financial_tools: Any,
+    prompt_token_budget: Optional[int] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
+) -> List[List[Dict[str, str]]]:
+    """
+    Message lists of the CG+CP extraction: one, or one per chunk when the prompt
+    exceeds `prompt_token_budget` (see `run_cgcp_pipeline` for the parameters).
+    Several message lists must be merged with `merge_chunk_dfs`.
+    """
     content_cadre_str, content_sous_str = process_cgcp(content_cadre, content_sous)
+    if section_filter is not None:
+        content_cadre_str = filter_financial_sections(content_cadre_str, label="[CG]", **section_filter)
+        content_sous_str = filter_financial_sections(content_sous_str, label="[CP]", **section_filter)
     messages_cpcg = build_message_cgcp(
         content_cadre_str, content_sous_str, cgcp_question, financial_prompt
     )
-    affair_df = get_response_df(client_oai, messages_cpcg, financial_tools)
-    affair_df = rectify_df(affair_df, col_order)
-    return affair_df
+    prompt_tokens = estimate_request_tokens(messages_cpcg, financial_tools)
+    print("estimated prompt tokens [CG+CP] =", prompt_tokens)
+    if prompt_token_budget is None or prompt_tokens <= prompt_token_budget:
+        return [messages_cpcg]
+    fixed_tokens = estimate_request_tokens(
+        build_message_cgcp("", "", cgcp_question, financial_prompt), financial_tools
+    )
+    if prompt_token_budget - fixed_tokens < MIN_CHUNK_TOKENS:
+        raise ValueError(
+            f"CG+CP token budget {prompt_token_budget} leaves {prompt_token_budget - fixed_tokens} "
+            f"tokens per chunk after the fixed prompt and tools ({fixed_tokens} tokens); "
+            f"raise --cgcp-token-budget to at least {fixed_tokens + MIN_CHUNK_TOKENS}"
+        )
+    chunks = chunk_cgcp_content(
+        content_cadre_str, content_sous_str, prompt_token_budget - fixed_tokens
+    )
+    print(f"CG+CP prompt over budget ({prompt_tokens} > {prompt_token_budget}): {len(chunks)} chunks")
+    return [
+        build_message_cgcp(cg, cp, cgcp_question, financial_prompt) for cg, cp in chunks
+    ]
+
+
+def chunk_cgcp_content(
+    content_cadre_str: str, content_sous_str: str, max_tokens: int
+) -> List[Tuple[str, str]]:
+    """
+    Split CG and CP Markdown into (cg_part, cp_part) chunks of at most `max_tokens`.
+
+    Each document is cut along heading boundaries (`split_markdown_sections`)
+    and packed into budget-sized pieces (`pack_sections`). CP pieces come first
+    since they carry the products; CG pieces (default conditions) follow in
+    their own chunks. Each chunk keeps the CADRE/SOUSCRIPTION labelling of
+    `build_message_cgcp`. CG chunks carry the CP as context (`cp_context`), so
+    the model reads the default conditions against the subscribed products
+    instead of inventing rows from CG prose; the rows it restates are dropped by
+    `merge_chunk_dfs`. `max_tokens` is never enlarged (see `MIN_CHUNK_TOKENS`).
+    """
+    cp_chunks = pack_sections(split_markdown_sections(content_sous_str), max_tokens)
+    context = cp_context(content_sous_str, max_tokens // 4)
+    cg_chunks = pack_sections(
+        split_markdown_sections(content_cadre_str), max_tokens - estimate_tokens(context)
+    )
+    return [("", cp) for cp in cp_chunks] + [(cg, context) for cg in cg_chunks]
+
+
+def cp_context(content_sous_str: str, max_tokens: int) -> str:
+    """
+    The CP as sent with CG chunks: the whole CP if it fits in `max_tokens`, else
+    its heading outline (its content is extracted in the CP chunks).
+    """
+    if estimate_tokens(content_sous_str) <= max_tokens:
+        return content_sous_str
+    return (
+        "[Plan des Conditions Particulières — contenu extrait séparément]\n"
+        + section_outline(content_sous_str, max_tokens)
+    )
+
+
+# Smallest per-chunk content budget left by --cgcp-token-budget after the fixed prompt.
+MIN_CHUNK_TOKENS = 1000
+
+CHUNK_DEDUP_COLUMNS = [
+    "avenant_number",
+    "product_code",
+    "product_name",
+    "price_unitaire",
+    "quantity",
+    "loyer",
+    "loyer_periodicity",
+    "one_shot_service",
+    "is_included",
+]
+CONTRACT_LEVEL_COLUMNS = [
+    "company_name",
+    "numero_de_contrat",
+    "signature_date_cg",
+    "signature_date_cp",
+    "reconduction_tacite",
+    "duree_de_service",
+    "payment_terms",
+]
+
+
+def merge_chunk_dfs(chunk_dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Merge per-chunk product tables into one CG+CP table.
+
+    - Contract-level fields (`CONTRACT_LEVEL_COLUMNS`) missing in a chunk (e.g.
+      the signature date lives in another chunk) are filled with the first value
+      found in any chunk.
+    - Rows repeated across chunks (a product table spanning a chunk boundary or
+      restated in an annex) are dropped on `CHUNK_DEDUP_COLUMNS`, keeping the
+      first occurrence.
+    """
+    df = pd.concat(chunk_dfs, ignore_index=True)
+    for c in CONTRACT_LEVEL_COLUMNS:
+        if c in df.columns:
+            values = df[c].replace("null", np.nan)
+            first = values.dropna()
+            if not first.empty:
+                df[c] = values.fillna(first.iloc[0])
+    subset = [c for c in CHUNK_DEDUP_COLUMNS if c in df.columns]
+    n_rows = len(df)
+    df = df.loc[~df[subset].astype(str).duplicated()].reset_index(drop=True)
+    print(f"merged {len(chunk_dfs)} chunks: {n_rows} rows, {n_rows - len(df)} duplicates dropped")
+    return df
 
 def run_avenants_pipeline(
     content_avenant: List[str],
@@ -386,6 +1231,10 @@ def run_avenants_pipeline(
     financial_prompt: str,
     financial_tools: Any,
     col_order: List[str],
+    max_workers: int = 1,
+    rate_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
 ) -> Optional[pd.DataFrame]:
     """
     Build messages for each Avenant block, call the model, and concatenate results.
@@ -410,6 +1259,15 @@ def run_avenants_pipeline(
         System prompt used for financial extraction.
     financial_tools : Any
         Tool definitions passed to the completion call.
+    max_workers : int, default 1
+        Number of avenant extractions run concurrently (threads). Results are
+        collected by position, so concatenation is independent of completion order.
+    rate_limiter : TokenRateLimiter or None
+        Shared RPM/TPM limiter acquired before each completion call.
+    llm_cache : DiskCache or None
+        Completion cache (see `get_response_df`).
+    section_filter : dict or None
+        Financial-section pre-filter applied to each Avenant (see `run_cgcp_pipeline`).
 
     Returns
     -------
@@ -422,20 +1280,133 @@ def run_avenants_pipeline(
       `rectify_df(df_av)` as written. Ensure `rectify_df` is compatible with
       this call in your environment.
     """
-    df_av_list: List[pd.DataFrame] = []
-    for i, avenant_str in enumerate(content_avenant, start=1):
-        print(f"*****************  processing {i}/{len(content_avenant)} *****************")
-        messages_av = build_message_avenant(avenant_str, avenant_question, financial_prompt)
-        print("content [AV]=", len(avenant_str))
-        df_av = get_response_df(client_oai, messages_av, financial_tools)
-        rectify_df(df_av, col_order)  # kept exactly as in your snippet
-        df_av_list.append(df_av)
+    def _extract(i: int, avenant_str: str) -> pd.DataFrame:
+        return extract_avenant_df(
+            i, len(content_avenant), avenant_str, client_oai, avenant_question,
+            financial_prompt, financial_tools, col_order, rate_limiter, llm_cache,
+            section_filter,
+        )
 
-    if df_av_list:
-        df_av_all = concat_avenant_df(df_av_list)
-        return df_av_all
+    if max_workers <= 1:
+        df_av_list: List[pd.DataFrame] = [
+            _extract(i, avenant_str) for i, avenant_str in enumerate(content_avenant, start=1)
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            df_av_list = list(
+                pool.map(_extract, range(1, len(content_avenant) + 1), content_avenant)
+            )
+
+    return avenants_df(df_av_list)
+
+def extract_avenant_df(
+    i: int,
+    n_avenants: int,
+    avenant_str: str,
+    client_oai: Any,
+    avenant_question: str,
+    financial_prompt: str,
+    financial_tools: Any,
+    col_order: List[str],
+    rate_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
+) -> pd.DataFrame:
+    """Extract the products of the `i`-th (1-based) of `n_avenants` Avenant blocks."""
+    messages_av = avenant_messages(
+        i, n_avenants, avenant_str, avenant_question, financial_prompt, section_filter
+    )
+    df_av = get_response_df(
+        client_oai, messages_av, financial_tools, rate_limiter=rate_limiter, llm_cache=llm_cache
+    )
+    rectify_df(df_av, col_order)  # kept exactly as in your snippet
+    return df_av
+
+
+def avenant_messages(
+    i: int,
+    n_avenants: int,
+    avenant_str: str,
+    avenant_question: str,
+    financial_prompt: str,
+    section_filter: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, str]]:
+    """Messages of the `i`-th Avenant extraction, after the optional section filter."""
+    print(f"*****************  processing {i}/{n_avenants} *****************")
+    if section_filter is not None:
+        avenant_str = filter_financial_sections(avenant_str, label=f"[AV {i}]", **section_filter)
+    print("content [AV]=", len(avenant_str))
+    return build_message_avenant(avenant_str, avenant_question, financial_prompt)
+
+
+def avenants_df(df_av_list: List[pd.DataFrame]) -> Optional[pd.DataFrame]:
+    """Concatenated Avenant table (`concat_avenant_df`), None when there are no Avenants."""
+    return concat_avenant_df(df_av_list) if df_av_list else None
+
+
+def run_affair_extraction(
+    content_cadre: List[str],
+    content_sous: List[str],
+    content_avenant: List[str],
+    client_oai: Any,
+    cgcp_question: str,
+    avenant_question: str,
+    financial_prompt: str,
+    financial_tools: Any,
+    col_order: List[str],
+    max_workers: int = 4,
+    rate_limiter: Optional[Any] = None,
+    llm_cache: Optional[Any] = None,
+    prompt_token_budget: Optional[int] = None,
+    section_filter: Optional[Dict[str, Any]] = None,
+) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Run the CG+CP extraction and every Avenant extraction of an affair concurrently.
+
+    `run_cgcp_pipeline` and `run_avenants_pipeline` are independent until
+    `get_df_cpcgav_all` merges them, so all calls are submitted to one thread
+    pool at once: the affair's critical path becomes its slowest single call
+    instead of the sum of all calls. Quota is still enforced per call by the
+    shared `rate_limiter`. `prompt_token_budget` is forwarded to
+    `run_cgcp_pipeline` (chunked CG+CP extraction for oversized prompts) and
+    `section_filter` to every call (financial-section pre-filter).
+
+    Returns
+    -------
+    (pandas.DataFrame, pandas.DataFrame or None)
+        The CG+CP table (as `run_cgcp_pipeline`) and the concatenated Avenant
+        table (as `run_avenants_pipeline`, None when there are no Avenants).
+    """
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        cgcp_future = pool.submit(
+            run_cgcp_pipeline,
+            content_cadre=content_cadre,
+            content_sous=content_sous,
+            client_oai=client_oai,
+            cgcp_question=cgcp_question,
+            financial_prompt=financial_prompt,
+            financial_tools=financial_tools,
+            col_order=col_order,
+            rate_limiter=rate_limiter,
+            llm_cache=llm_cache,
+            prompt_token_budget=prompt_token_budget,
+            max_workers=max_workers,
+            section_filter=section_filter,
+        )
+        av_futures = [
+            pool.submit(
+                extract_avenant_df, i, len(content_avenant), avenant_str, client_oai,
+                avenant_question, financial_prompt, financial_tools, col_order, rate_limiter,
+                llm_cache, section_filter,
+            )
+            for i, avenant_str in enumerate(content_avenant, start=1)
+        ]
+        cpcg_df = cgcp_future.result()
+        df_av_list = [future.result() for future in av_futures]
+    print(f"affair extraction: {1 + len(av_futures)} calls in {time.perf_counter() - t0:.1f}s")
+    return cpcg_df, avenants_df(df_av_list)
 
-    return None
 
 def concat_avenant_df(df_av_list: List[pd.DataFrame]) -> pd.DataFrame:
     """Concatenate and sort Avenant DataFrames by `avenant_number` with basic logging."""
@@ -29,6 +29,7 @@ must always be present in the output if retained by the client.
 - In older contracts (signature date before 2023) products are usually found in "Prix, modalites de facturation et de reglement". Old contracts tend to have reconduction tacite.
 Older contracts tend to not have the product_code.
 - In avenants products are usually found under "2 ARTICLE 5.2 - ABONNEMENT" or "Modifications de l'article 5.2 des Conditions Particulières du Contrat".
+- "[…sections omitted…]" marks sections without financial content left out of the document; do not infer products or values from the gap.
 
 ## How to identify products & prices:
 - One row = one priced block. A "block" may be the items in a table row, a bullet/list item, bordered callouts, or a short paragraph (≤3 lines) where a label is clearly tied to a
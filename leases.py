@@ -0,0 +1,507 @@
+"""
+Spread an affair list over several machines: static shards or leased affairs.
+
+Static sharding (`--shard i/n`)
+-------------------------------
+`shard_affairs` keeps the affairs whose stable hash (SHA-1 of the lower-cased
+name, independent of `PYTHONHASHSEED` and of the list order) falls in shard
+`i` of `n`. Every worker given the same affair list and a different `i`
+processes a disjoint subset, and together they cover the list.
+
+Lease mode
+----------
+Workers share one affair list and claim affairs one at a time through lease
+documents, so faster workers take more affairs and a dead worker's affairs are
+taken over. One lease document per (run, affair):
+
+    {
+        "id": "<run>:<affair>",        # slugified
+        "run": "<run id>", "affair": "<affair>",
+        "owner": "<worker id>", "state": "leased" | "done" | "failed",
+        "claimed_at": <epoch>, "expires_at": <epoch>, "done_at": <epoch or null>,
+        "elapsed_s": <seconds from claim to completion>,
+        "attempts": <claims so far>, "error": "<message or null>",
+        "ttl": <Cosmos item TTL (retention) in seconds>,
+    }
+
+- Claim: create the document, or take over an existing one whose lease has
+  expired, with an ETag-conditional replace. Of two workers racing for the
+  same affair exactly one wins (409 on create / 412 on replace for the other).
+- Renew: `LeaseHeartbeat` pushes `expires_at` forward every `ttl_s / 3` for
+  every affair the worker holds, while it is processed. A renewal that finds
+  the affair reclaimed marks it lost (`is_lost`); the worker stops processing
+  it (`drop_lost_leases` in the staged pipeline).
+- Reclaim: a worker that stalls or dies stops renewing; once `expires_at` has
+  passed, any worker still looping over the list claims the affair again
+  (`attempts` > 1 in the report).
+- Finish: `complete` marks the affair done (never claimed again in this run).
+  `fail` records the error and expires the lease at once, so any worker
+  (this one included) claims the affair again; once it was claimed
+  `max_attempts` times it is marked failed, so a poison affair is not retried
+  by every worker forever.
+
+`CosmosLeaseStore` keeps the documents in a Cosmos container (see
+`clients.get_cosmos_leases`, item TTL enabled so old runs expire);
+`LocalLeaseStore` keeps them as JSON files in a directory guarded by a lock
+file (several processes on one machine, or tests).
+
+Usage (minimal)
+---------------
+    store = LocalLeaseStore(Path("./leases"), run="backfill-01")
+    heartbeat = LeaseHeartbeat(store, worker_id, ttl_s=300).start()
+    for affair in claim_affairs(store, affairs, worker_id, heartbeat):
+        ...                                   # process the affair (stop if heartbeat.is_lost(affair))
+        heartbeat.complete(affair)            # or heartbeat.fail(affair, exc)
+    heartbeat.stop()
+    print_worker_throughput(store)
+"""
+
+from __future__ import annotations
+import abc
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError,
+)
+
+from rate_limiter import file_lock
+
+LEASE_RETENTION_S = 7 * 24 * 3600  # Cosmos item TTL of lease documents
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse "i/n" (0 <= i < n) into (i, n)."""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", value)
+    if match is None:
+        raise ValueError(f"shard must look like 'i/n', got {value!r}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"shard index must be in [0, {count - 1}], got {value!r}")
+    return index, count
+
+
+def shard_of(affair: str, count: int) -> int:
+    """Stable shard number of an affair among `count` shards."""
+    digest = hashlib.sha1(affair.strip().lower().encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def shard_affairs(affairs: List[str], index: int, count: int) -> List[str]:
+    """Affairs of shard `index` of `count`, in input order."""
+    selected = [affair for affair in affairs if shard_of(affair, count) == index]
+    print(f"shard {index}/{count}: {len(selected)}/{len(affairs)} affairs")
+    return selected
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def lease_id(run: str, affair: str) -> str:
+    """Document id of the lease of `affair` in `run` (Cosmos ids may not contain / \\ ? #)."""
+    return re.sub(r"[/\\?#]", "_", f"{run}:{affair}")
+
+
+class LeaseStore(abc.ABC):
+    """
+    Lease protocol on top of the storage primitives implemented by subclasses
+    (`_read`, `_create`, `_replace` and `list_leases`).
+    """
+
+    def __init__(self, run: str) -> None:
+        self.run = run
+
+    @abc.abstractmethod
+    def _read(self, doc_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return `(doc, etag)`, or `(None, None)` if the lease does not exist."""
+
+    @abc.abstractmethod
+    def _create(self, doc: Dict[str, Any]) -> bool:
+        """Create `doc`; False if a lease with its id already exists."""
+
+    @abc.abstractmethod
+    def _replace(self, doc: Dict[str, Any], etag: str) -> bool:
+        """Replace the lease; False if the stored document changed since `etag` was read."""
+
+    @abc.abstractmethod
+    def list_leases(self) -> List[Dict[str, Any]]:
+        """Every lease document of the run."""
+
+    def try_acquire(self, affair: str, owner: str, ttl_s: float) -> str:
+        """
+        Claim `affair` for `owner`; returns "acquired", "busy" (live lease of
+        another worker, or lost race), "done" or "failed".
+        """
+        now = time.time()
+        doc_id = lease_id(self.run, affair)
+        doc, etag = self._read(doc_id)
+        if doc is None:
+            doc = {
+                "id": doc_id, "run": self.run, "affair": affair, "owner": owner,
+                "state": "leased", "claimed_at": now, "expires_at": now + ttl_s,
+                "done_at": None, "elapsed_s": None, "attempts": 1, "error": None,
+                "ttl": LEASE_RETENTION_S,
+            }
+            return "acquired" if self._create(doc) else "busy"
+        if doc["state"] in ("done", "failed"):
+            return doc["state"]
+        if doc["owner"] != owner and doc["expires_at"] > now:
+            return "busy"
+        previous, expired_s = doc["owner"], now - doc["expires_at"]
+        doc.update(
+            owner=owner, claimed_at=now, expires_at=now + ttl_s, attempts=doc["attempts"] + 1
+        )
+        if not self._replace(doc, etag):
+            return "busy"
+        reason = f"last error: {doc['error']}" if doc["error"] else f"expired {expired_s:.0f}s ago"
+        print(f"lease: reclaimed {affair} from {previous} ({reason}, attempt {doc['attempts']})")
+        return "acquired"
+
+    def renew(self, affair: str, owner: str, ttl_s: float) -> bool:
+        """Extend the lease of `affair`; False if `owner` no longer holds it."""
+        doc, etag = self._read(lease_id(self.run, affair))
+        if doc is None or doc["owner"] != owner or doc["state"] != "leased":
+            return False
+        doc["expires_at"] = time.time() + ttl_s
+        return self._replace(doc, etag)
+
+    def finish(self, affair: str, owner: str, state: str, error: Optional[str] = None) -> bool:
+        """Mark the lease of `affair` "done" or "failed"; False if `owner` lost it meanwhile."""
+        doc, etag = self._read(lease_id(self.run, affair))
+        if doc is None or doc["owner"] != owner:
+            return False
+        now = time.time()
+        doc.update(state=state, done_at=now, elapsed_s=now - doc["claimed_at"], error=error)
+        return self._replace(doc, etag)
+
+    def release(self, affair: str, owner: str, error: str, max_attempts: int) -> Optional[str]:
+        """
+        Record a failed attempt at `affair`: mark it "failed" once it was claimed
+        `max_attempts` times, else expire the lease now so any worker claims it
+        again. Returns "failed" or "released"; None if `owner` lost it meanwhile.
+        """
+        doc, etag = self._read(lease_id(self.run, affair))
+        if doc is None or doc["owner"] != owner or doc["state"] != "leased":
+            return None
+        if doc["attempts"] >= max_attempts:
+            return "failed" if self.finish(affair, owner, "failed", error) else None
+        doc.update(expires_at=time.time(), error=error)
+        return "released" if self._replace(doc, etag) else None
+
+
+class CosmosLeaseStore(LeaseStore):
+    """Lease documents in a Cosmos container partitioned on `/id` (ETag-conditional writes)."""
+
+    def __init__(self, container: Any, run: str) -> None:
+        super().__init__(run)
+        self.container = container
+
+    def _read(self, doc_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        try:
+            doc = self.container.read_item(item=doc_id, partition_key=doc_id)
+        except CosmosResourceNotFoundError:
+            return None, None
+        return doc, doc["_etag"]
+
+    def _create(self, doc: Dict[str, Any]) -> bool:
+        try:
+            self.container.create_item(body=doc)
+        except CosmosResourceExistsError:
+            return False
+        return True
+
+    def _replace(self, doc: Dict[str, Any], etag: str) -> bool:
+        try:
+            self.container.replace_item(
+                item=doc["id"], body=doc, etag=etag, match_condition=MatchConditions.IfNotModified
+            )
+        except (CosmosAccessConditionFailedError, CosmosResourceNotFoundError):
+            return False
+        return True
+
+    def list_leases(self) -> List[Dict[str, Any]]:
+        return list(
+            self.container.query_items(
+                query="SELECT * FROM c WHERE c.run = @run",
+                parameters=[{"name": "@run", "value": self.run}],
+                enable_cross_partition_query=True,
+            )
+        )
+
+
+class LocalLeaseStore(LeaseStore):
+    """
+    Lease documents as `<root_dir>/<run>/<id>.json`, one lock file per run.
+
+    A version counter stored in the document plays the role of the ETag; each
+    read-compare-write holds the run's OS file lock (`rate_limiter.file_lock`).
+    """
+
+    def __init__(self, root_dir: Path, run: str) -> None:
+        super().__init__(run)
+        self.dir = Path(root_dir) / re.sub(r"[^A-Za-z0-9._-]+", "-", run)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.dir / "leases.lock"
+
+    def _path(self, doc_id: str) -> Path:
+        return self.dir / (re.sub(r"[^A-Za-z0-9._-]+", "-", doc_id) + ".json")
+
+    def _load(self, path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: Path, doc: Dict[str, Any]) -> None:
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(doc, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _read(self, doc_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        doc = self._load(self._path(doc_id))
+        return (doc, doc["_etag"]) if doc is not None else (None, None)
+
+    def _create(self, doc: Dict[str, Any]) -> bool:
+        path = self._path(doc["id"])
+        with file_lock(self.lock_path):
+            if path.exists():
+                return False
+            self._write(path, {**doc, "_etag": "1"})
+        return True
+
+    def _replace(self, doc: Dict[str, Any], etag: str) -> bool:
+        path = self._path(doc["id"])
+        with file_lock(self.lock_path):
+            current = self._load(path)
+            if current is None or current["_etag"] != etag:
+                return False
+            self._write(path, {**doc, "_etag": str(int(etag) + 1)})
+        return True
+
+    def list_leases(self) -> List[Dict[str, Any]]:
+        return [doc for path in sorted(self.dir.glob("*.json")) if (doc := self._load(path))]
+
+
+class LeaseHeartbeat:
+    """
+    Background thread renewing every lease held by this worker every `ttl_s / 3`.
+
+    A failed affair is released for another attempt until it was claimed
+    `max_attempts` times, then marked failed.
+    """
+
+    def __init__(
+        self, store: LeaseStore, owner: str, ttl_s: float = 300.0, max_attempts: int = 3
+    ) -> None:
+        self.store = store
+        self.owner = owner
+        self.ttl_s = ttl_s
+        self.max_attempts = max_attempts
+        self.held: Dict[str, float] = {}  # affair -> claimed at (monotonic)
+        self.done: List[Tuple[str, float]] = []  # (affair, seconds held)
+        self.lost: List[str] = []
+        self.released: List[str] = []  # failed, to be claimed again
+        self._failing: List[str] = []  # failure being recorded in the store
+        self._lock = threading.Lock()
+        self._changed = threading.Event()  # set when a held affair is completed or released
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+        self.started_at = time.monotonic()
+
+    def start(self) -> "LeaseHeartbeat":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def hold(self, affair: str) -> None:
+        with self._lock:
+            self.held[affair] = time.monotonic()
+
+    def holding(self) -> bool:
+        """True while this worker holds at least one lease."""
+        with self._lock:
+            return bool(self.held or self._failing)
+
+    def take_released(self) -> List[str]:
+        """Affairs this worker released after a failure since the last call."""
+        with self._lock:
+            released, self.released = self.released, []
+        return released
+
+    def wait_change(self, timeout_s: float) -> None:
+        """Wait up to `timeout_s` for a held affair to be completed or released."""
+        self._changed.wait(timeout_s)
+        self._changed.clear()
+
+    def is_lost(self, affair: str) -> bool:
+        """True once a renewal found `affair` reclaimed by another worker."""
+        with self._lock:
+            return affair in self.lost
+
+    def complete(self, affair: str) -> None:
+        """Mark `affair` done and stop renewing it."""
+        self._release(affair, "done")
+
+    def fail(self, affair: str, error: BaseException) -> None:
+        """
+        Release `affair` for another attempt (by any worker), or mark it failed
+        after `max_attempts` claims, and stop renewing it.
+        """
+        with self._lock:
+            if self.held.pop(affair, None) is None:
+                return
+            self._failing.append(affair)
+        state = None
+        try:
+            state = self.store.release(affair, self.owner, str(error)[:500], self.max_attempts)
+        finally:
+            with self._lock:
+                self._failing.remove(affair)
+                if state == "released":
+                    self.released.append(affair)
+            self._changed.set()
+        if state is None:
+            print(f"WARNING lease of {affair} was taken over before its failure was recorded")
+        elif state == "released":
+            print(f"lease: released {affair} after a failure, it will be claimed again")
+        else:
+            print(f"lease: {affair} failed {self.max_attempts} times, marked failed")
+
+    def _release(self, affair: str, state: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            claimed = self.held.pop(affair, None)
+        if claimed is None:
+            return
+        try:
+            finished = self.store.finish(affair, self.owner, state, error)
+        finally:
+            self._changed.set()
+        if finished:
+            if state == "done":
+                self.done.append((affair, time.monotonic() - claimed))
+        else:
+            print(f"WARNING lease of {affair} was taken over before it was marked {state}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.ttl_s / 3):
+            with self._lock:
+                affairs = list(self.held)
+            for affair in affairs:
+                try:
+                    renewed = self.store.renew(affair, self.owner, self.ttl_s)
+                except Exception as exc:  # keep renewing the others; retried next beat
+                    print(f"WARNING lease renewal of {affair} failed: {exc}")
+                    continue
+                if not renewed:
+                    print(f"WARNING lost the lease of {affair} (another worker reclaimed it)")
+                    with self._lock:
+                        self.held.pop(affair, None)
+                        self.lost.append(affair)
+                    self._changed.set()
+
+
+def claim_affairs(
+    store: LeaseStore,
+    affairs: List[str],
+    owner: str,
+    heartbeat: LeaseHeartbeat,
+    poll_s: Optional[float] = None,
+) -> Iterator[str]:
+    """
+    Yield the affairs this worker claims, one at a time, until every affair is
+    done or failed (by any worker) and this worker holds no lease. Each affair
+    is claimed when the next one is
+    requested, so consume the generator only when an affair can be started
+    (`affair_pipeline.run_staged_pipeline` pulls its inputs on demand).
+
+    Affairs leased by live workers are polled every `poll_s` (default
+    `ttl_s / 4`) and claimed once their lease expires. Each worker starts at a
+    different offset of the list (stable hash of `owner`) to limit contention.
+    Claimed affairs are handed to `heartbeat`, which renews them until
+    `heartbeat.complete` / `heartbeat.fail`; affairs released after a failure
+    are claimed again (by this worker or another one).
+    """
+    poll_s = poll_s or heartbeat.ttl_s / 4
+    remaining = list(affairs)
+    if remaining:
+        offset = shard_of(owner, len(remaining))
+        remaining = remaining[offset:] + remaining[:offset]
+    while True:
+        holding = heartbeat.holding()  # before take_released: a release ends a holding
+        remaining += [affair for affair in heartbeat.take_released() if affair not in remaining]
+        if not remaining and not holding:
+            return
+        claimed_any = False
+        for affair in list(remaining):
+            state = store.try_acquire(affair, owner, heartbeat.ttl_s)
+            if state == "busy":
+                continue
+            remaining.remove(affair)
+            if state == "acquired":
+                claimed_any = True
+                heartbeat.hold(affair)
+                print(f"lease: {owner} claimed {affair}")
+                yield affair
+        if not claimed_any:
+            if remaining:
+                print(f"lease: {len(remaining)} affairs leased by other workers, retrying in {poll_s:.0f}s")
+            # wake up early when one of ours finishes: it may have been released for a retry
+            heartbeat.wait_change(poll_s)
+
+
+def drop_lost_leases(
+    fn: Callable[[Dict[str, Any]], Any], heartbeat: LeaseHeartbeat
+) -> Callable[[Dict[str, Any]], Any]:
+    """
+    Wrap a pipeline stage function (see `affair_pipeline.Stage`) so that an
+    item whose lease was lost is dropped (returns None) instead of processed:
+    the worker that reclaimed the affair does it.
+    """
+
+    def _run(item: Dict[str, Any]) -> Any:
+        if heartbeat.is_lost(item["affair"]):
+            print(f"lease: dropping {item['affair']}, its lease was reclaimed by another worker")
+            return None
+        return fn(item)
+
+    return _run
+
+
+def print_worker_throughput(store: LeaseStore, heartbeat: Optional[LeaseHeartbeat] = None) -> None:
+    """Print affairs done, time held and affairs/hour per worker of the run (from the lease documents)."""
+    leases = store.list_leases()
+    print(f"\n========== Workers (run {store.run}) ==========")
+    if heartbeat is not None:
+        wall = time.monotonic() - heartbeat.started_at
+        print(
+            f"this worker ({heartbeat.owner}): {len(heartbeat.done)} affairs in {wall:.0f}s, "
+            f"{len(heartbeat.lost)} leases lost"
+        )
+    by_owner: Dict[str, List[Dict[str, Any]]] = {}
+    for lease in leases:
+        if lease["state"] == "done":
+            by_owner.setdefault(lease["owner"], []).append(lease)
+    for owner, done in sorted(by_owner.items()):
+        busy = sum(lease["elapsed_s"] or 0 for lease in done)
+        span = max(lease["done_at"] for lease in done) - min(lease["claimed_at"] for lease in done)
+        rate = len(done) / (span / 3600) if span > 0 else 0.0
+        print(f"{owner}: {len(done)} affairs, {busy:.0f}s busy, {rate:.1f} affairs/hour")
+    counts: Dict[str, int] = {}
+    for lease in leases:
+        counts[lease["state"]] = counts.get(lease["state"], 0) + 1
+    reclaimed = sum(1 for lease in leases if lease["attempts"] > 1)
+    print(f"leases: {counts}, {reclaimed} claimed more than once (stalled worker or retry)")
@@ -89,36 +89,108 @@ Notes
 
 """
 
+import asyncio
+import time
 from pathlib import Path
-from di_module import process_affair_document_intelligence, print_db_content
+from di_module import process_affair_document_intelligence, print_db_content, TIERED_DI_MODEL
+from blob_inventory import (
+    load_blob_inventory,
+    save_blob_inventory,
+    affair_fingerprints,
+    company_partition_key,
+)
+from di_journal import DIJournal
+from disk_cache import DiskCache
 from IPython import embed
 from pathlib import Path
-from clients import client_di, cosmos_digitaliezd, client_oai, cosmos_table, container
+from clients import (
+    client_di,
+    cosmos_digitaliezd,
+    client_oai,
+    cosmos_table,
+    container,
+    get_cosmos_docs_by_company,
+    get_cosmos_table_rows,
+    get_cosmos_leases,
+)
 import argparse
 
 from gpt_module import (
     get_docs,
+    iter_affair_docs,
     get_cpcgav,
     verify_cpcgav_separation,
     run_avenants_pipeline,
     run_cgcp_pipeline,
-    get_df_cpcgav_all,
-    loyer2null,
+    run_affair_extraction,
+    build_affair_df,
     upsert_to_cosmos,
+    upsert_rows_to_cosmos,
     save_df_local,
+    print_usage_summary,
     cp_identifiers,
     cg_identifiers,
     av_identifiers
 )
+from rate_limiter import SharedTokenRateLimiter, TokenRateLimiter
+from resilience import print_resilience_summary
+from cg_registry import CGRegistry
+from batch_gpt import LocalBatchClient, run_batch_extraction
+from async_pipeline import run_pipeline_async
+from affair_pipeline import Stage, run_staged_pipeline
+from leases import (
+    CosmosLeaseStore,
+    LeaseHeartbeat,
+    LocalLeaseStore,
+    claim_affairs,
+    default_worker_id,
+    drop_lost_leases,
+    parse_shard,
+    print_worker_throughput,
+    shard_affairs,
+)
 from gpt_module_financial_agent import financial_prompt, financial_tools, col_order, cgcp_question, avenant_question
 
 DEFAULT_AFFAIRS = ["mason", "anagra"]
 DEFAULT_DI = False
 DEFAULT_TAG = "main"
+DEFAULT_DI_WORKERS = 1
 DEFAULT_OUTDIR = Path(
     r"C:\Users\EstebanSzames\OneDrive - CELLENZA\Bureau\Generix\generix_phase1_01\doc_digitalized_sample"
 )
 
+def store_affair_results(
+    affair: str,
+    cpcg_df,
+    df_av_all,
+    local_save_tag: str,
+    row_storage: bool,
+    cosmos_table,
+    cosmos_table_rows=None,
+) -> None:
+    """Merge the CG+CP and Avenant tables of an affair, save them locally and upsert them."""
+    affair_df = postprocess_affair_results(affair, cpcg_df, df_av_all, local_save_tag)
+    persist_affair_results(affair, affair_df, row_storage, cosmos_table, cosmos_table_rows)
+
+
+def postprocess_affair_results(affair: str, cpcg_df, df_av_all, local_save_tag: str):
+    """Merge the CG+CP and Avenant tables of an affair and save them locally."""
+    affair_df = build_affair_df(cpcg_df, df_av_all)
+    save_df_local(affair, local_save_tag, cpcg_df, df_av_all, affair_df)
+    return affair_df
+
+
+def persist_affair_results(
+    affair: str, affair_df, row_storage: bool, cosmos_table, cosmos_table_rows=None
+) -> None:
+    """Upsert the merged table of an affair (one item, or one item per row)."""
+    if row_storage:
+        upsert_rows_to_cosmos(affair_df, affair, cosmos_table_rows)
+    else:
+        upsert_to_cosmos(affair_df, affair, cosmos_table)
+    print("END")
+
+
 def parse_cli_args() -> argparse.Namespace:
     """
     Parse CLI arguments for the pipeline.
@@ -128,6 +200,32 @@ def parse_cli_args() -> argparse.Namespace:
       --affairs mason,anagra
 
     --di enables the Document Intelligence phase (default off).
+    --di-workers sets how many DI analyses run concurrently (default 1).
+    --di-model selects the DI model ('tiered' = read everywhere, layout on pricing pages).
+    --di-page-range N analyzes PDFs longer than N pages as parallel page ranges.
+    --di-journal sets the file where in-flight DI operations are journaled.
+    --di-cache-dir / --di-cache-max-gb configure the local DI result cache.
+    --di-force re-analyzes PDFs whose blob fingerprint did not change.
+    --docs-lookup / --docs-container select the Cosmos affair lookup strategy; with
+      --docs-lookup company --docs-container by-company, an affair matching a single
+      company of the blob inventory is looked up in that company's partition only.
+    --gpt-workers / --oai-rpm / --oai-tpm run an affair's GPT calls concurrently within quota.
+    --di-rpm / --di-ppm limit DI submissions (requests and pages per minute).
+    --shared-limiter-dir shares the OpenAI and DI quotas between several main.py processes.
+    --cgcp-token-budget N extracts CG+CP in section chunks when the prompt exceeds N tokens.
+    --section-filter / --section-context / --section-min-keep send only the financial sections.
+    --cg-registry / --cg-mode / --cg-threshold send one shared summary per distinct CG version.
+    --batch runs the GPT phase through the Batch API (--batch-local DIR for a file-based stand-in).
+    --async-io runs DI and GPT on the asyncio clients (--async-* set the per-service concurrency).
+    --pipeline streams each affair from DI to GPT through bounded stage queues.
+    --shard i/n keeps the affairs of shard i (0-based) of n, by stable hash.
+    --lease / --lease-local DIR claim affairs through renewed leases shared by several workers
+      (implies --pipeline; --lease-run / --lease-ttl / --lease-in-flight / --lease-max-attempts /
+      --worker-id).
+    --llm-cache-dir / --llm-cache-max-gb / --no-llm-cache control the GPT response cache.
+    --row-storage writes one Cosmos item per product row with delta upserts.
+    --docs-batch retrieves all affairs' documents from one paged query.
+    --inventory-cache / --inventory-max-age control the cached blob listing.
     """
     def comma_or_list(arg: str) -> list[str]:
         # allow "a,b,c" or "a" (single item)
@@ -148,6 +246,306 @@ def parse_cli_args() -> argparse.Namespace:
         help="Enable Document Intelligence ingestion (default: off).",
         default=DEFAULT_DI,
     )
+    parser.add_argument(
+        "--di-workers",
+        type=int,
+        help="Number of concurrent Document Intelligence analyses. Default: %(default)s",
+        default=DEFAULT_DI_WORKERS,
+    )
+    parser.add_argument(
+        "--di-force",
+        action="store_true",
+        help="Re-analyze every PDF, even those unchanged since the last DI run.",
+        default=False,
+    )
+    parser.add_argument(
+        "--di-model",
+        choices=["prebuilt-layout", "prebuilt-read", "tiered"],
+        help="DI model; 'tiered' runs prebuilt-read then layout on pricing pages only. Default: %(default)s",
+        default="prebuilt-layout",
+    )
+    parser.add_argument(
+        "--di-page-range",
+        type=int,
+        help="Split PDFs longer than N pages into N-page ranges analyzed in parallel (default: off).",
+        default=None,
+    )
+    parser.add_argument(
+        "--di-journal",
+        type=Path,
+        help="Journal of in-flight DI operations, resumed after a crash. Default: <out-dir>/di_journal.json",
+        default=None,
+    )
+    parser.add_argument(
+        "--di-cache-dir",
+        type=Path,
+        help="Directory of the local DI result cache. Default: <out-dir>/di_cache",
+        default=None,
+    )
+    parser.add_argument(
+        "--di-cache-max-gb",
+        type=float,
+        help="Size cap of the DI result cache (LRU eviction above it). Default: %(default)s",
+        default=2.0,
+    )
+    parser.add_argument(
+        "--inventory-cache",
+        type=Path,
+        help="JSON file caching the blob inventory between runs. Default: <out-dir>/blob_inventory.json",
+        default=None,
+    )
+    parser.add_argument(
+        "--inventory-max-age",
+        type=float,
+        help="Hours before the cached blob inventory is fully re-listed. Default: %(default)s",
+        default=24.0,
+    )
+    parser.add_argument(
+        "--docs-lookup",
+        choices=["id", "company"],
+        help="How get_docs finds an affair: id substring scan or indexed company fields. Default: %(default)s",
+        default="id",
+    )
+    parser.add_argument(
+        "--docs-container",
+        choices=["default", "by-company"],
+        help="Documents container: default (/id partitions) or partitioned by company. Default: %(default)s",
+        default="default",
+    )
+    parser.add_argument(
+        "--docs-batch",
+        action="store_true",
+        help="Retrieve the documents of all affairs with one paged query (id lookup only).",
+        default=False,
+    )
+    parser.add_argument(
+        "--row-storage",
+        action="store_true",
+        help="Store results as one Cosmos item per product row (delta upserts) instead of one item per affair.",
+        default=False,
+    )
+    parser.add_argument(
+        "--gpt-workers",
+        type=int,
+        help="Concurrent GPT calls per affair; above 1 the CG+CP and avenant calls run together. Default: %(default)s",
+        default=1,
+    )
+    parser.add_argument(
+        "--oai-rpm",
+        type=float,
+        help="Azure OpenAI deployment quota in requests/minute. Default: %(default)s",
+        default=60,
+    )
+    parser.add_argument(
+        "--oai-tpm",
+        type=float,
+        help="Azure OpenAI deployment quota in tokens/minute. Default: %(default)s",
+        default=150_000,
+    )
+    parser.add_argument(
+        "--di-rpm",
+        type=float,
+        help="Document Intelligence analyses per minute (default: unlimited).",
+        default=None,
+    )
+    parser.add_argument(
+        "--di-ppm",
+        type=float,
+        help="Document Intelligence pages per minute, used with --di-rpm. Default: %(default)s",
+        default=10_000,
+    )
+    parser.add_argument(
+        "--shared-limiter-dir",
+        type=Path,
+        help="Folder of the rate limiter state shared by concurrent main.py processes (default: per process).",
+        default=None,
+    )
+    parser.add_argument(
+        "--cgcp-token-budget",
+        type=int,
+        help="Prompt token budget of the CG+CP call; larger inputs are extracted in section chunks (default: off).",
+        default=None,
+    )
+    parser.add_argument(
+        "--section-filter",
+        action="store_true",
+        help="Send only the financially relevant Markdown sections of each document to GPT.",
+        default=False,
+    )
+    parser.add_argument(
+        "--section-context",
+        type=int,
+        help="Neighbouring sections kept around each financial section. Default: %(default)s",
+        default=1,
+    )
+    parser.add_argument(
+        "--section-min-keep",
+        type=float,
+        help="Recall margin: minimum fraction of a document's tokens kept by the section filter. Default: %(default)s",
+        default=0.3,
+    )
+    parser.add_argument(
+        "--cg-registry",
+        type=Path,
+        help="JSON registry of distinct CG versions; enables sending CG summaries instead of raw CG (default: off).",
+        default=None,
+    )
+    parser.add_argument(
+        "--cg-mode",
+        choices=["summary", "omit"],
+        help="What replaces a registered CG: its summary plus affair-specific sections, or only the latter. Default: %(default)s",
+        default="summary",
+    )
+    parser.add_argument(
+        "--cg-threshold",
+        type=float,
+        help="Shingle Jaccard similarity above which two CGs are the same version. Default: %(default)s",
+        default=0.9,
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit all GPT requests as Batch API jobs and wait for them (offline backfills).",
+        default=False,
+    )
+    parser.add_argument(
+        "--batch-model",
+        type=str,
+        help="Batch deployment name used in the batch request bodies. Default: %(default)s",
+        default="gpt-4.1",
+    )
+    parser.add_argument(
+        "--batch-dir",
+        type=Path,
+        help="Folder of the batch JSONL files and resume state. Default: <out-dir>/batch",
+        default=None,
+    )
+    parser.add_argument(
+        "--batch-local",
+        type=Path,
+        help="Use a local file-based stand-in for the Batch API rooted at this folder (testing).",
+        default=None,
+    )
+    parser.add_argument(
+        "--batch-poll",
+        type=float,
+        help="Seconds between two batch status polls. Default: %(default)s",
+        default=60.0,
+    )
+    parser.add_argument(
+        "--async-io",
+        action="store_true",
+        help="Run the DI and GPT phases on the asyncio Azure/OpenAI clients (one event loop).",
+        default=False,
+    )
+    parser.add_argument(
+        "--async-openai",
+        type=int,
+        help="Async mode: concurrent OpenAI calls. Default: %(default)s",
+        default=16,
+    )
+    parser.add_argument(
+        "--async-di",
+        type=int,
+        help="Async mode: concurrent DI analyses. Default: %(default)s",
+        default=8,
+    )
+    parser.add_argument(
+        "--async-io-calls",
+        type=int,
+        help="Async mode: concurrent Blob and Cosmos calls (each). Default: %(default)s",
+        default=32,
+    )
+    parser.add_argument(
+        "--async-affairs",
+        type=int,
+        help="Async mode: affairs processed at the same time. Default: %(default)s",
+        default=8,
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Stream affairs through staged queues: an affair reaches GPT as soon as its DI is done.",
+        default=False,
+    )
+    parser.add_argument(
+        "--pipeline-queue",
+        type=int,
+        help="Pipeline mode: affairs waiting between two stages (back-pressure). Default: %(default)s",
+        default=2,
+    )
+    parser.add_argument(
+        "--pipeline-affairs",
+        type=int,
+        help="Pipeline mode: affairs in the GPT extraction stage at the same time. Default: %(default)s",
+        default=1,
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Process only shard i (0-based) of n of the affair list, e.g. 0/4 (stable hash of the affair).",
+        default=None,
+    )
+    parser.add_argument(
+        "--lease",
+        action="store_true",
+        help="Claim affairs one at a time through Cosmos leases shared with other workers.",
+        default=False,
+    )
+    parser.add_argument(
+        "--lease-local",
+        type=Path,
+        help="Keep the leases as files in this folder instead of Cosmos (one machine, testing).",
+        default=None,
+    )
+    parser.add_argument(
+        "--lease-run",
+        type=str,
+        help="Run id shared by the workers of one leased run. Default: the --tag value",
+        default=None,
+    )
+    parser.add_argument(
+        "--lease-ttl",
+        type=float,
+        help="Seconds before an unrenewed lease can be reclaimed by another worker. Default: %(default)s",
+        default=300.0,
+    )
+    parser.add_argument(
+        "--lease-max-attempts",
+        type=int,
+        help="Lease mode: claims of a failing affair before it is marked failed. Default: %(default)s",
+        default=3,
+    )
+    parser.add_argument(
+        "--lease-in-flight",
+        type=int,
+        help="Lease mode: affairs held by this worker at once. Default: --pipeline-affairs + 1",
+        default=None,
+    )
+    parser.add_argument(
+        "--worker-id",
+        type=str,
+        help="Worker name in the lease documents. Default: <hostname>-<pid>",
+        default=None,
+    )
+    parser.add_argument(
+        "--llm-cache-dir",
+        type=Path,
+        help="Directory of the local GPT response cache. Default: <out-dir>/llm_cache",
+        default=None,
+    )
+    parser.add_argument(
+        "--llm-cache-max-gb",
+        type=float,
+        help="Size cap of the GPT response cache (LRU eviction above it). Default: %(default)s",
+        default=1.0,
+    )
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        help="Bypass the GPT response cache (always call the model).",
+        default=False,
+    )
     parser.add_argument(
         "--tag",
         "-t",
@@ -164,6 +562,30 @@ def parse_cli_args() -> argparse.Namespace:
     )
 
     args = parser.parse_args()
+    if args.docs_batch and args.docs_lookup == "company":
+        parser.error("--docs-batch only supports --docs-lookup id")
+    if args.async_io:
+        unsupported = [
+            flag
+            for flag, value in (
+                ("--batch", args.batch),
+                ("--row-storage", args.row_storage),
+                ("--docs-batch", args.docs_batch),
+                ("--di-page-range", args.di_page_range),
+                ("--di-model tiered", args.di_model == "tiered"),
+            )
+            if value
+        ]
+        if unsupported:
+            parser.error(f"--async-io does not support {', '.join(unsupported)}")
+    if args.lease_local:
+        args.lease = True
+    if args.lease:
+        args.pipeline = True
+    if args.lease_max_attempts < 1:
+        parser.error("--lease-max-attempts must be at least 1")
+    if args.pipeline and (args.async_io or args.batch or args.docs_batch):
+        parser.error("--pipeline cannot be combined with --async-io, --batch or --docs-batch")
 
     # Normalize affairs: expand any comma-separated tokens inside nargs list
     normalized: list[str] = []
@@ -175,12 +597,49 @@ def parse_cli_args() -> argparse.Namespace:
 if __name__ == "__main__":
     # User input
     args = parse_cli_args()
+    run_t0 = time.perf_counter()
     # User input (with defaults if not passed)
     # use python main.py -a "mason,anagra"
     affair_to_treat = args.affairs                      # e.g. ["mason","anagra"]
+    if args.shard:
+        affair_to_treat = shard_affairs(affair_to_treat, *args.shard)
     performe_document_intelligence_read = args.di       # True if --di, else False
     local_save_tag = args.tag                           # e.g. "main"
     local_path = args.out_dir                           # Path(...)
+    di_workers = args.di_workers                        # e.g. 8 analyses in flight
+    di_skip_unchanged = not args.di_force               # skip blobs with same ETag/MD5
+    inventory_cache = args.inventory_cache or local_path / "blob_inventory.json"
+    if args.shared_limiter_dir:
+        oai_limiter = SharedTokenRateLimiter(
+            args.shared_limiter_dir / "openai.json", args.oai_rpm, args.oai_tpm
+        )
+    else:
+        oai_limiter = TokenRateLimiter(args.oai_rpm, args.oai_tpm)
+    di_limiter = None
+    if args.di_rpm:
+        di_limiter = (
+            SharedTokenRateLimiter(args.shared_limiter_dir / "di.json", args.di_rpm, args.di_ppm)
+            if args.shared_limiter_dir
+            else TokenRateLimiter(args.di_rpm, args.di_ppm)
+        )
+    llm_cache = None
+    if not args.no_llm_cache:
+        llm_cache = DiskCache(
+            args.llm_cache_dir or local_path / "llm_cache",
+            max_bytes=int(args.llm_cache_max_gb * 1024**3),
+        )
+    cosmos_table_rows = get_cosmos_table_rows() if args.row_storage else None
+    cg_registry = (
+        CGRegistry(args.cg_registry, threshold=args.cg_threshold) if args.cg_registry else None
+    )
+    section_filter = (
+        {"context": args.section_context, "min_keep_fraction": args.section_min_keep}
+        if args.section_filter
+        else None
+    )
+    cosmos_docs = (
+        get_cosmos_docs_by_company() if args.docs_container == "by-company" else cosmos_digitaliezd
+    )
 
     #affair_to_treat = ["S.N.F", "NORAUTO" , "SAVENCIA", "BOIRON", "AIRBUS-HELICOPTERS", "CULTURA", "suez", "carter",
     #                    "edenred", "renault", "mason" , "fr_mes", "id_log" , "invicta", "coca", "maha",
@@ -188,21 +647,92 @@ if __name__ == "__main__":
     #                    "combrone", "anagra"]
 
     # Document intelligence
-    for affair in affair_to_treat:
-        if performe_document_intelligence_read:
+    inventory = None
+    company_partitions = args.docs_container == "by-company" and args.docs_lookup == "company"
+    if performe_document_intelligence_read or company_partitions:
+        inventory = load_blob_inventory(
+            container, inventory_cache, max_age_s=args.inventory_max_age * 3600
+        )
+    # single-partition affair lookups on the company-partitioned container
+    docs_partition_keys = {}
+    if company_partitions:
+        docs_partition_keys = {
+            affair: company_partition_key(inventory, affair) for affair in affair_to_treat
+        }
+    if performe_document_intelligence_read and not args.async_io:
+        di_journal = DIJournal(args.di_journal or local_path / "di_journal.json")
+        di_cache = DiskCache(
+            args.di_cache_dir or local_path / "di_cache",
+            max_bytes=int(args.di_cache_max_gb * 1024**3),
+        )
+
+        def run_document_intelligence(affair, fingerprints):
             process_affair_document_intelligence(
-                cosmos_digitaliezd, container, client_di, affair, local_path
+                cosmos_docs, container, client_di, affair, local_path,
+                max_concurrency=di_workers,
+                skip_unchanged=di_skip_unchanged,
+                fingerprints=fingerprints,
+                page_range_size=args.di_page_range,
+                journal=di_journal,
+                di_cache=di_cache,
+                analyse_doc_model=TIERED_DI_MODEL if args.di_model == "tiered" else args.di_model,
+                rate_limiter=di_limiter,
             )
+
+        if not args.pipeline:
+            for affair in affair_to_treat:
+                run_document_intelligence(affair, affair_fingerprints(inventory, container, affair))
     # GPT agent
-    print_db_content(cosmos_digitaliezd)
-    for i, affair in enumerate(affair_to_treat, start=1):
-        print(f"\nTreating affair {i}/{len(affair_to_treat)} = ", affair)
-        docs = get_docs(affair, cosmos_digitaliezd)
+    if not args.async_io:
+        print_db_content(cosmos_docs)
+    if args.docs_batch:
+        affair_groups = iter_affair_docs(affair_to_treat, cosmos_docs)
+    else:
+        affair_groups = (
+            (
+                affair,
+                get_docs(
+                    affair, cosmos_docs, lookup=args.docs_lookup,
+                    partition_key=docs_partition_keys.get(affair),
+                ),
+            )
+            for affair in affair_to_treat
+        )
+
+    def classify_affair(affair, docs):
         content_cadre, content_sous, content_avenant = get_cpcgav(
             docs, cp_identifiers, cg_identifiers, av_identifiers
         )
         verify_cpcgav_separation(docs, content_cadre, content_sous, content_avenant)
-        #continue
+        if cg_registry is not None:
+            content_cadre = cg_registry.resolve(
+                affair, content_cadre, client_oai, mode=args.cg_mode, rate_limiter=oai_limiter
+            )
+        return content_cadre, content_sous, content_avenant
+
+    def affair_contents():
+        for i, (affair, docs) in enumerate(affair_groups, start=1):
+            print(f"\nTreating affair {i}/{len(affair_to_treat)} = ", affair)
+            yield (affair, *classify_affair(affair, docs))
+
+    def extract_affair(content_cadre, content_sous, content_avenant):
+        if args.gpt_workers > 1:
+            return run_affair_extraction(
+                content_cadre=content_cadre,
+                content_sous=content_sous,
+                content_avenant=content_avenant,
+                client_oai=client_oai,
+                cgcp_question=cgcp_question,
+                avenant_question=avenant_question,
+                financial_prompt=financial_prompt,
+                financial_tools=financial_tools,
+                col_order=col_order,
+                max_workers=args.gpt_workers,
+                rate_limiter=oai_limiter,
+                llm_cache=llm_cache,
+                prompt_token_budget=args.cgcp_token_budget,
+                section_filter=section_filter,
+            )
         cpcg_df = run_cgcp_pipeline(
             content_cadre=content_cadre,
             content_sous=content_sous,
@@ -211,6 +741,10 @@ if __name__ == "__main__":
             financial_prompt=financial_prompt,
             financial_tools=financial_tools,
             col_order=col_order,
+            rate_limiter=oai_limiter,
+            llm_cache=llm_cache,
+            prompt_token_budget=args.cgcp_token_budget,
+            section_filter=section_filter,
         )
         df_av_all = run_avenants_pipeline(
             content_avenant=content_avenant,
@@ -218,15 +752,175 @@ if __name__ == "__main__":
             avenant_question=avenant_question,
             financial_prompt=financial_prompt,
             financial_tools=financial_tools,
-            col_order=col_order
+            col_order=col_order,
+            rate_limiter=oai_limiter,
+            llm_cache=llm_cache,
+            section_filter=section_filter,
+        )
+        return cpcg_df, df_av_all
+
+    if args.async_io:
+        asyncio.run(
+            run_pipeline_async(
+                affair_to_treat,
+                cgcp_question=cgcp_question,
+                avenant_question=avenant_question,
+                financial_prompt=financial_prompt,
+                financial_tools=financial_tools,
+                col_order=col_order,
+                local_path=local_path,
+                local_save_tag=local_save_tag,
+                run_di=performe_document_intelligence_read,
+                skip_unchanged=di_skip_unchanged,
+                di_cache=DiskCache(
+                    args.di_cache_dir or local_path / "di_cache",
+                    max_bytes=int(args.di_cache_max_gb * 1024**3),
+                ),
+                analyse_doc_model=args.di_model,
+                di_limiter=di_limiter,
+                inventory=inventory,
+                blob_container=container,
+                docs_container_suffix="_by_company" if args.docs_container == "by-company" else "",
+                docs_lookup=args.docs_lookup,
+                docs_partition_keys=docs_partition_keys,
+                oai_limiter=oai_limiter,
+                llm_cache=llm_cache,
+                prompt_token_budget=args.cgcp_token_budget,
+                section_filter=section_filter,
+                cg_registry=cg_registry,
+                cg_mode=args.cg_mode,
+                cg_client_oai=client_oai,
+                concurrency={
+                    "openai": args.async_openai,
+                    "di": args.async_di,
+                    "blob": args.async_io_calls,
+                    "cosmos": args.async_io_calls,
+                    "affairs": args.async_affairs,
+                },
+            )
+        )
+    elif args.batch:
+        batch_client = LocalBatchClient(args.batch_local) if args.batch_local else client_oai
+        affair_results = run_batch_extraction(
+            affair_contents(),
+            batch_client,
+            client_oai,
+            cgcp_question=cgcp_question,
+            avenant_question=avenant_question,
+            financial_prompt=financial_prompt,
+            financial_tools=financial_tools,
+            col_order=col_order,
+            work_dir=args.batch_dir or local_path / "batch",
+            model=args.batch_model,
+            prompt_token_budget=args.cgcp_token_budget,
+            section_filter=section_filter,
+            llm_cache=llm_cache,
+            poll_s=args.batch_poll,
+            rate_limiter=oai_limiter,
         )
-        if df_av_all is not None:
-            affair_df = get_df_cpcgav_all(cpcg_df, df_av_all)
+        for affair, cpcg_df, df_av_all in affair_results:
+            store_affair_results(
+                affair, cpcg_df, df_av_all, local_save_tag, args.row_storage,
+                cosmos_table, cosmos_table_rows,
+            )
+    elif args.pipeline:
+        # One item per affair flows through the stages below (see `affair_pipeline`).
+        def list_blobs_stage(item):
+            item["fingerprints"] = affair_fingerprints(inventory, container, item["affair"])
+            return item
+
+        def di_stage(item):
+            run_document_intelligence(item["affair"], item.pop("fingerprints"))
+            return item
+
+        def fetch_docs_stage(item):
+            item["docs"] = get_docs(
+                item["affair"], cosmos_docs, lookup=args.docs_lookup,
+                partition_key=docs_partition_keys.get(item["affair"]),
+            )
+            return item
+
+        def classify_stage(item):
+            print(f"\nTreating affair {item['index']}/{len(affair_to_treat)} = ", item["affair"])
+            item["contents"] = classify_affair(item["affair"], item.pop("docs"))
+            return item
+
+        def gpt_stage(item):
+            item["cpcg_df"], item["df_av_all"] = extract_affair(*item.pop("contents"))
+            return item
+
+        def postprocess_stage(item):
+            item["affair_df"] = postprocess_affair_results(
+                item["affair"], item.pop("cpcg_df"), item.pop("df_av_all"), local_save_tag
+            )
+            return item
+
+        def persist_stage(item):
+            # the tables are dropped here: finished items only carry a summary
+            affair_df = item.pop("affair_df")
+            persist_affair_results(
+                item["affair"], affair_df, args.row_storage, cosmos_table, cosmos_table_rows,
+            )
+            return {"affair": item["affair"], "index": item["index"], "rows": len(affair_df)}
+
+        stages = [
+            Stage("fetch docs", fetch_docs_stage),
+            Stage("classify", classify_stage),
+            Stage("GPT extraction", gpt_stage, workers=args.pipeline_affairs),
+            Stage("post-process", postprocess_stage),
+            Stage("persist", persist_stage),
+        ]
+        if performe_document_intelligence_read:
+            stages = [Stage("list blobs", list_blobs_stage), Stage("DI + ingest", di_stage)] + stages
+        if args.lease:
+            lease_run = args.lease_run or local_save_tag
+            lease_store = (
+                LocalLeaseStore(args.lease_local, lease_run)
+                if args.lease_local
+                else CosmosLeaseStore(get_cosmos_leases(), lease_run)
+            )
+            worker_id = args.worker_id or default_worker_id()
+            heartbeat = LeaseHeartbeat(
+                lease_store, worker_id, ttl_s=args.lease_ttl, max_attempts=args.lease_max_attempts
+            ).start()
+            try:
+                # affairs are claimed only when the first stage can start one, and at
+                # most --lease-in-flight are held, so faster workers claim more
+                run_staged_pipeline(
+                    (
+                        {"affair": affair, "index": i}
+                        for i, affair in enumerate(
+                            claim_affairs(lease_store, affair_to_treat, worker_id, heartbeat), start=1
+                        )
+                    ),
+                    [Stage(s.name, drop_lost_leases(s.fn, heartbeat), s.workers) for s in stages],
+                    queue_size=args.pipeline_queue,
+                    on_result=lambda item: heartbeat.complete(item["affair"]),
+                    on_error=lambda item, exc: heartbeat.fail(item["affair"], exc),
+                    max_in_flight=args.lease_in_flight or args.pipeline_affairs + 1,
+                )
+            finally:
+                heartbeat.stop()
+                print_worker_throughput(lease_store, heartbeat)
         else:
-            affair_df = cpcg_df.copy()
-        affair_df = loyer2null(cpcg_df)
-        affair_df = affair_df.fillna("null")
-        save_df_local(affair, local_save_tag, cpcg_df, df_av_all, affair_df)
-        upsert_to_cosmos(affair_df, affair, cosmos_table)
-        print("END")
+            run_staged_pipeline(
+                ({"affair": affair, "index": i} for i, affair in enumerate(affair_to_treat, start=1)),
+                stages,
+                queue_size=args.pipeline_queue,
+            )
+    else:
+        for affair, content_cadre, content_sous, content_avenant in affair_contents():
+            #continue
+            cpcg_df, df_av_all = extract_affair(content_cadre, content_sous, content_avenant)
+            store_affair_results(
+                affair, cpcg_df, df_av_all, local_save_tag, args.row_storage,
+                cosmos_table, cosmos_table_rows,
+            )
+    if inventory is not None:
+        save_blob_inventory(inventory)  # incremental refreshes of this run
+    print_usage_summary()
+    print_resilience_summary()
+    if cg_registry is not None:
+        cg_registry.print_stats()
+    print(f"run wall-clock: {time.perf_counter() - run_t0:.1f}s")
 
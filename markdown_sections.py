@@ -0,0 +1,238 @@
+"""
+Markdown section helpers for Document Intelligence `content`.
+
+DI (`prebuilt-layout`, markdown output) renders contract headings as `#`
+lines, tables as HTML/pipe blocks and page breaks as `<!-- PageBreak -->`
+comments. These helpers cut that Markdown along heading boundaries and pack the
+sections into pieces that fit a token budget, without ever cutting inside a
+section unless the section alone exceeds the budget. Each piece is tokenized
+once and chunk sizes are running sums of piece counts (close to the count of
+the joined text), so packing stays linear in the document size.
+
+It also ranks sections by financial relevance so that prompts can carry only
+the parts of a contract where products and financial terms live
+(`filter_financial_sections`).
+
+Usage (minimal)
+---------------
+    sections = split_markdown_sections(content)
+    chunks = pack_sections(sections, max_tokens=40_000)
+    outline = section_outline(content, max_tokens=2_000)
+    financial_only = filter_financial_sections(content, context=1, min_keep_fraction=0.3)
+"""
+
+from __future__ import annotations
+import re
+import unicodedata
+from typing import List
+
+from rate_limiter import estimate_tokens
+
+_HEADING_RE = re.compile(r"^(?=#{1,6}\s)", re.MULTILINE)
+
+
+def split_markdown_sections(text: str) -> List[str]:
+    """
+    Split Markdown into sections, each starting at a heading line.
+
+    Text before the first heading is returned as its own (first) section.
+    Joining the sections with "" gives back the original text.
+    """
+    parts = _HEADING_RE.split(text)
+    return [p for p in parts if p]
+
+
+def split_oversized_section(section: str, max_tokens: int) -> List[str]:
+    """
+    Split one section that exceeds `max_tokens` along blank lines, then lines.
+
+    A single line over the budget (a long table row, a paragraph without line
+    breaks) is split with `split_long_line`, so every piece fits.
+    """
+    if "\n\n" in section:
+        blocks = re.split(r"(?<=\n)(?=\n)", section)
+    else:
+        blocks = section.splitlines(True)
+    pieces: List[str] = []
+    current, current_tokens = "", 0
+    for block in blocks:
+        block_tokens = estimate_tokens(block)
+        if current and current_tokens + block_tokens > max_tokens:
+            pieces.append(current)
+            current, current_tokens = "", 0
+        if block_tokens > max_tokens:
+            if "\n" in block.strip("\n"):
+                pieces.extend(split_oversized_section(block, max_tokens))
+            else:
+                pieces.extend(split_long_line(block, max_tokens))
+            continue
+        current += block
+        current_tokens += block_tokens
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_long_line(text: str, max_tokens: int) -> List[str]:
+    """Split text without line breaks into pieces of at most `max_tokens`: sentences, then characters."""
+    pieces: List[str] = []
+    current, current_tokens = "", 0
+    for sentence in re.split(r"(?<=[.!?;])(?=\s)", text):
+        sentence_tokens = estimate_tokens(sentence)
+        if current and current_tokens + sentence_tokens > max_tokens:
+            pieces.append(current)
+            current, current_tokens = "", 0
+        if sentence_tokens > max_tokens:
+            pieces.extend(_split_chars(sentence, max_tokens))
+            continue
+        current += sentence
+        current_tokens += sentence_tokens
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _split_chars(text: str, max_tokens: int) -> List[str]:
+    """Cut `text` into consecutive slices of at most `max_tokens` (last resort)."""
+    pieces: List[str] = []
+    while text:
+        size = max(1, len(text) * max_tokens // max(1, estimate_tokens(text)))
+        while size > 1 and estimate_tokens(text[:size]) > max_tokens:
+            size = size * 9 // 10
+        pieces.append(text[:size])
+        text = text[size:]
+    return pieces
+
+
+def pack_sections(sections: List[str], max_tokens: int) -> List[str]:
+    """
+    Greedily pack consecutive sections into chunks of at most `max_tokens`.
+
+    Section order is preserved. A section larger than the budget is first split
+    with `split_oversized_section`.
+    """
+    chunks: List[str] = []
+    current, current_tokens = "", 0
+    for section in sections:
+        section_tokens = estimate_tokens(section)
+        if section_tokens > max_tokens:
+            parts = [(part, estimate_tokens(part)) for part in split_oversized_section(section, max_tokens)]
+        else:
+            parts = [(section, section_tokens)]
+        for part, part_tokens in parts:
+            if current and current_tokens + part_tokens > max_tokens:
+                chunks.append(current)
+                current, current_tokens = "", 0
+            current += part
+            current_tokens += part_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def section_outline(text: str, max_tokens: int) -> str:
+    """Heading lines of `text`, in document order, cut to at most `max_tokens`."""
+    headings = [sec.partition("\n")[0] + "\n" for sec in split_markdown_sections(text)]
+    outline = "".join(h for h in headings if h.startswith("#"))
+    return pack_sections([outline], max_tokens)[0] if outline else ""
+
+
+# Weighted cues of the headings under which `financial_prompt`
+# (gpt_module_financial_agent) says products and prices are found, e.g.
+# "Abonnement ...", "Services associes/Options", "Base de calcul du montant de
+# l'Abonnement", "ANNEXE 5 : Conditions Financieres", "Prix, modalites de
+# facturation et de reglement", "ARTICLE 5.2 - ABONNEMENT", "Pricing mensuel
+# volumes", "Echeancier", the SLA and the reconduction clause. Matched on the
+# lower-cased, accent-stripped heading line only; in the body only euro
+# amounts count (`BODY_AMOUNT_WEIGHT`, priced tables under other headings).
+FINANCIAL_SECTION_KEYWORDS = {
+    "conditions financieres": 5,
+    "abonnement": 4,
+    "base de calcul": 4,
+    "prix": 4,
+    "modalites de facturation": 4,
+    "article 5.2": 4,
+    "services associes": 3,
+    "options": 2,
+    "pricing": 3,
+    "projection financiere": 3,
+    "echeancier": 3,
+    "niveau de service": 2,
+    "sla": 2,
+    "reconduction": 2,
+}
+BODY_AMOUNT_WEIGHT = 1
+OMITTED_MARKER = "[…sections omitted…]\n\n"
+
+
+def _fold(text: str) -> str:
+    return unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+
+
+_KEYWORD_RES = [
+    (re.compile(r"\b" + re.escape(kw) + r"s?\b"), weight)
+    for kw, weight in FINANCIAL_SECTION_KEYWORDS.items()
+]
+
+
+def score_section(section: str) -> float:
+    """Financial relevance score of one Markdown section (0 = no cue found)."""
+    heading, _, body = section.partition("\n")
+    heading_f = _fold(heading)
+    score = float(sum(weight for pattern, weight in _KEYWORD_RES if pattern.search(heading_f)))
+    return score + BODY_AMOUNT_WEIGHT * min(body.count("€"), 5)
+
+
+def filter_financial_sections(
+    text: str,
+    context: int = 1,
+    min_keep_fraction: float = 0.3,
+    verbose: bool = True,
+    label: str = "",
+) -> str:
+    """
+    Keep only the financially relevant sections of a contract, plus context.
+
+    1) Split the Markdown into heading sections and score each with
+       `score_section`.
+    2) Keep every section with a positive score, its `context` neighbours on
+       each side, and always the first and last sections (parties, contract
+       number, signature dates).
+    3) Recall safety margin: while the kept text is below `min_keep_fraction`
+       of the original tokens, add the best-scoring remaining sections (then
+       document order), so that a contract with unusual wording is never
+       reduced to a few paragraphs.
+
+    Sections are returned in document order, joined exactly as in the source;
+    each run of dropped sections is replaced by `OMITTED_MARKER` so the model
+    knows content was left out.
+    """
+    sections = split_markdown_sections(text)
+    if len(sections) <= 2:
+        return text
+    scores = [score_section(sec) for sec in sections]
+    keep = {0, len(sections) - 1}
+    for i, score in enumerate(scores):
+        if score > 0:
+            keep.update(range(max(0, i - context), min(len(sections), i + context + 1)))
+    tokens = [estimate_tokens(sec) for sec in sections]
+    total = sum(tokens)
+    kept = sum(tokens[i] for i in keep)
+    for i in sorted(range(len(sections)), key=lambda i: (-scores[i], i)):
+        if kept >= min_keep_fraction * total:
+            break
+        if i not in keep:
+            keep.add(i)
+            kept += tokens[i]
+    if verbose:
+        print(
+            f"section filter{' ' + label if label else ''}: kept {len(keep)}/{len(sections)} sections, "
+            f"{kept}/{total} tokens ({1 - kept / total if total else 0:.0%} dropped)"
+        )
+    parts: List[str] = []
+    for i, section in enumerate(sections):
+        if i in keep:
+            parts.append(section)
+        elif i - 1 in keep:
+            parts.append(OMITTED_MARKER)
+    return "".join(parts)
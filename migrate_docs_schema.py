@@ -0,0 +1,112 @@
+"""
+One-shot migration of the documents container to the index-friendly schema.
+
+What it does
+------------
+1) Adds the `company_name_lc` field (lower-cased `company_name`) to every item
+   that lacks it, so `get_docs(..., lookup="company")` can use an indexed
+   `STARTSWITH` filter instead of `CONTAINS` over every id.
+2) Optionally replaces the container indexing policy with
+   `clients.DOCS_INDEXING_POLICY` (Markdown `content` excluded from the index).
+3) Optionally copies every item into the company-partitioned container
+   returned by `clients.get_cosmos_docs_by_company()` (partition key
+   `/company_name_path`).
+
+Usage
+-----
+    python migrate_docs_schema.py --dry-run
+    python migrate_docs_schema.py --apply-indexing-policy --copy-to-company-container
+
+Notes
+-----
+- Items are read page by page (`read_all_items`) so memory stays bounded.
+- The migration is idempotent: items already carrying `company_name_lc` are not
+  rewritten in place, and copies are upserts.
+- Items without `company_name` (written before the structured fields existed)
+  are reported and left untouched; re-run the DI phase for them.
+"""
+
+from __future__ import annotations
+import argparse
+from typing import Any, Dict, Optional
+
+from azure.cosmos import PartitionKey
+
+SYSTEM_PROPERTIES = ("_rid", "_self", "_etag", "_attachments", "_ts")
+
+
+def migrate_item(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return the item with `company_name_lc` added and system properties removed, or None."""
+    if not item.get("company_name"):
+        return None
+    migrated = {k: v for k, v in item.items() if k not in SYSTEM_PROPERTIES}
+    migrated["company_name_lc"] = item["company_name"].lower()
+    return migrated
+
+
+def migrate_docs(
+    source: Any,
+    target: Optional[Any] = None,
+    dry_run: bool = False,
+    page_size: int = 50,
+) -> Dict[str, int]:
+    """
+    Migrate all items of `source` in place and optionally copy them to `target`.
+
+    Returns counters {seen, updated, copied, skipped}.
+    """
+    stats = {"seen": 0, "updated": 0, "copied": 0, "skipped": 0}
+    for page in source.read_all_items(max_item_count=page_size).by_page():
+        for item in page:
+            stats["seen"] += 1
+            migrated = migrate_item(item)
+            if migrated is None:
+                stats["skipped"] += 1
+                print("skipped (no company_name):", item.get("id"))
+                continue
+            if item.get("company_name_lc") != migrated["company_name_lc"]:
+                stats["updated"] += 1
+                if not dry_run:
+                    source.upsert_item(migrated)
+            if target is not None:
+                stats["copied"] += 1
+                if not dry_run:
+                    target.upsert_item(migrated)
+        print("migration progress:", stats)
+    return stats
+
+
+def apply_indexing_policy(cosms_db: Any, container: Any, indexing_policy: Dict[str, Any]) -> None:
+    """Replace the indexing policy of an existing `/id`-partitioned container."""
+    cosms_db.replace_container(
+        container.id,
+        partition_key=PartitionKey(path="/id"),
+        indexing_policy=indexing_policy,
+    )
+    print("indexing policy replaced; Cosmos re-indexes in the background")
+
+
+def parse_cli_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Migrate the documents container schema")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would change.")
+    parser.add_argument(
+        "--apply-indexing-policy",
+        action="store_true",
+        help="Replace the container indexing policy with DOCS_INDEXING_POLICY.",
+    )
+    parser.add_argument(
+        "--copy-to-company-container",
+        action="store_true",
+        help="Also copy items into the container partitioned by /company_name_path.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from clients import DOCS_INDEXING_POLICY, cosmos_digitaliezd, cosms_db, get_cosmos_docs_by_company
+
+    args = parse_cli_args()
+    if args.apply_indexing_policy and not args.dry_run:
+        apply_indexing_policy(cosms_db, cosmos_digitaliezd, DOCS_INDEXING_POLICY)
+    target = get_cosmos_docs_by_company() if args.copy_to_company_container else None
+    print("END", migrate_docs(cosmos_digitaliezd, target, dry_run=args.dry_run))
@@ -0,0 +1,211 @@
+"""
+Client-side quota scheduling for Azure OpenAI calls.
+
+Azure OpenAI deployments enforce two quotas per minute: requests (RPM) and
+tokens (TPM). For TPM, the service counts the *estimated prompt tokens plus
+`max_tokens`* of each request at admission time, so a call with
+`max_tokens=32000` reserves 32k tokens of quota whatever it really produces.
+`TokenRateLimiter` mirrors that accounting with two token buckets, so
+concurrent workers wait locally instead of collecting 429s.
+`SharedTokenRateLimiter` keeps the same buckets in a JSON file guarded by an OS
+file lock, so several `main.py` processes on one machine share one quota.
+
+Usage (minimal)
+---------------
+    limiter = TokenRateLimiter(requests_per_minute=60, tokens_per_minute=150_000)
+    limiter.acquire(estimate_request_tokens(messages, tools, max_tokens=32000))
+    resp = client_oai.chat.completions.create(...)
+
+Notes
+-----
+- Token counts use `tiktoken` (o200k_base, the gpt-4.1 encoding) when it is
+  installed, else a characters/3.5 heuristic that slightly over-estimates for
+  French contract text (safer for quota purposes).
+- Buckets start full and refill continuously at quota/60 per second.
+- The same buckets limit Document Intelligence submissions with "tokens" counted
+  as pages, once per DI request (see `di_module._begin_analyze`).
+"""
+
+from __future__ import annotations
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import tiktoken
+
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken missing or encoding unavailable offline
+    _ENCODING = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Count (or estimate) the tokens of `text`."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 3.5)
+
+
+def estimate_request_tokens(
+    messages: List[Dict[str, str]],
+    tools: Optional[Any] = None,
+    max_tokens: int = 0,
+) -> int:
+    """
+    Estimate the quota tokens of a chat completion request.
+
+    Prompt tokens of all messages (plus a small per-message overhead) and of the
+    serialized tool schema, plus `max_tokens` as Azure does for TPM admission.
+    """
+    prompt = sum(estimate_tokens(m.get("content") or "") + 4 for m in messages)
+    if tools:
+        prompt += estimate_tokens(json.dumps(tools, ensure_ascii=False))
+    return prompt + max_tokens
+
+
+class TokenRateLimiter:
+    """Thread-safe requests/minute + tokens/minute token-bucket limiter."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float) -> None:
+        self.rpm = float(requests_per_minute)
+        self.tpm = float(tokens_per_minute)
+        self._requests = self.rpm
+        self._tokens = self.tpm
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_s = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._last)
+        self._last = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _take(self, tokens: float, now: float) -> Optional[float]:
+        """Take one request and `tokens` if available (None), else return the wait needed."""
+        self._refill(now)
+        if self._requests >= 1 and self._tokens >= tokens:
+            self._requests -= 1
+            self._tokens -= tokens
+            return None
+        return max(
+            (1 - self._requests) * 60 / self.rpm,
+            (tokens - self._tokens) * 60 / self.tpm,
+            0.05,
+        )
+
+    def acquire(self, tokens: int) -> float:
+        """
+        Block until one request and `tokens` tokens are available, then take them.
+
+        Requests larger than the whole TPM quota are clamped to it (they can
+        only ever run alone). Returns the time spent waiting, in seconds.
+        """
+        tokens = min(float(tokens), self.tpm)
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait = self._take(tokens, time.monotonic())
+                if wait is None:
+                    self.waited_s += waited
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+
+@contextmanager
+def file_lock(lock_path: Path) -> Iterator[None]:
+    """
+    Hold an exclusive OS lock on `lock_path` for the duration of the block.
+
+    The lock file itself is persistent; the lock is `fcntl.flock` (POSIX) or
+    `msvcrt.locking` (Windows) on it. The OS drops the lock when the holder
+    closes the file or its process dies, so there is no stale lock to detect
+    and break, and two waiters can never both own it. Each call opens the
+    file anew, so threads of one process exclude each other as well.
+    """
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            while True:  # LK_LOCK gives up after 10 s; wait as long as needed
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.005)
+        yield
+    finally:
+        if fcntl is None:
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            except OSError:
+                pass
+        os.close(fd)  # also releases the flock
+
+
+class SharedTokenRateLimiter(TokenRateLimiter):
+    """
+    `TokenRateLimiter` whose buckets live in a JSON file shared by processes.
+
+    Each acquisition takes an exclusive OS lock on `<state>.lock` (see
+    `file_lock`; released by the OS if the holder dies), reads the bucket
+    levels and the wall-clock time of the last refill, refills, takes or
+    computes the wait, writes the state back and releases the lock. Threads of
+    one process also serialize on an in-process lock first.
+    """
+
+    def __init__(
+        self,
+        state_path: Path,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+    ) -> None:
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self.state_path = Path(state_path)
+        self.lock_path = self.state_path.with_suffix(self.state_path.suffix + ".lock")
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _load(self, now: float) -> None:
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+            self._requests = min(self.rpm, float(state["requests"]))
+            self._tokens = min(self.tpm, float(state["tokens"]))
+            self._last = float(state["last"])
+        except (OSError, ValueError, KeyError):  # first process, or unreadable state
+            self._requests, self._tokens, self._last = self.rpm, self.tpm, now
+
+    def _save(self) -> None:
+        tmp = self.state_path.with_suffix(f".{os.getpid()}.tmp")
+        state = {"requests": self._requests, "tokens": self._tokens, "last": self._last}
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+    def acquire(self, tokens: int) -> float:
+        """Same contract as `TokenRateLimiter.acquire`, across processes."""
+        tokens = min(float(tokens), self.tpm)
+        waited = 0.0
+        while True:
+            with self._lock, file_lock(self.lock_path):
+                now = time.time()
+                self._load(now)
+                wait = self._take(tokens, now)
+                self._save()
+                if wait is None:
+                    self.waited_s += waited
+                    return waited
+            time.sleep(wait)
+            waited += wait
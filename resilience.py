@@ -0,0 +1,370 @@
+"""
+Shared retry / throttling layer for the Azure OpenAI, DI, Blob and Cosmos clients.
+
+Every call made through a `ResilientClient` (see `clients.py`) is:
+1) admitted by the stage's `AIMDLimiter`, which bounds concurrent calls and
+   adapts that bound to throttling: +1/limit per success (additive increase),
+   x0.5 on a 429/503 (multiplicative decrease, at most once per cooldown);
+2) retried on throttling (429, 503) and transient errors (500, 502, 504,
+   connection errors and timeouts), waiting for `Retry-After` /
+   `retry-after-ms` / `x-ms-retry-after-ms` when the service sends it, else
+   for a full-jitter exponential backoff;
+3) counted in `stage_stats` (calls, retries, throttles, seconds waited,
+   failures), printed by `print_resilience_summary`.
+
+`acall_with_retry` is the asyncio counterpart (awaitable call, `asyncio.sleep`
+backoff, admission by an `asyncio.Semaphore`) used by `async_pipeline`.
+
+Usage (minimal)
+---------------
+    client_oai = ResilientClient(AzureOpenAI(..., max_retries=0), "openai", AIMDLimiter(8))
+    client_oai.chat.completions.create(...)   # retried, limited, counted
+    print_resilience_summary()
+
+Notes
+-----
+- The SDK clients are built with their own retries disabled (`max_retries=0`,
+  `retry_total=0`, Cosmos `RetryOptions(0)`, see `clients.py`), so attempts do
+  not multiply and every throttle reaches the `AIMDLimiter`. Lazy results are
+  covered too: `ItemPaged` results (`query_items`, `list_blobs`) fetch each page
+  through `call_with_retry` and resume from the last continuation token
+  (`ResilientPaged`), and `LROPoller.result()` is retried by resuming the
+  operation from its continuation token (`ResilientPoller`).
+- Non-retryable errors (4xx other than 429) are raised at once.
+"""
+
+from __future__ import annotations
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from collections.abc import Mapping
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+THROTTLE_STATUS = {429, 503}
+TRANSIENT_STATUS = {408, 500, 502, 504}
+TRANSIENT_ERRORS = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "ServiceRequestError",
+    "ServiceResponseError",
+    "ConnectionError",
+    "TimeoutError",
+}
+
+
+class RetryPolicy:
+    """Retry budget and backoff shape."""
+
+    def __init__(self, max_attempts: int = 8, base_s: float = 1.0, max_s: float = 60.0) -> None:
+        self.max_attempts = max_attempts
+        self.base_s = base_s
+        self.max_s = max_s
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the `attempt`-th retry (1-based)."""
+        return random.uniform(0, min(self.max_s, self.base_s * 2 ** attempt))
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    """HTTP status of an SDK error (openai `APIStatusError`, azure `HttpResponseError`)."""
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_throttle(exc: BaseException) -> bool:
+    return status_code(exc) in THROTTLE_STATUS
+
+
+def is_retryable(exc: BaseException) -> bool:
+    return (
+        status_code(exc) in THROTTLE_STATUS | TRANSIENT_STATUS
+        or any(cls.__name__ in TRANSIENT_ERRORS for cls in type(exc).__mro__)
+    )
+
+
+def retry_after_s(exc: BaseException) -> Optional[float]:
+    """Server-requested wait in seconds, from the error response headers (if any)."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 1e-3), ("x-ms-retry-after-ms", 1e-3)):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time()) if when else None
+
+
+class AIMDLimiter:
+    """Concurrency bound adapted with additive increase / multiplicative decrease."""
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease: float = 0.5,
+        cooldown_s: float = 2.0,
+    ) -> None:
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.cooldown_s = cooldown_s
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= self.cooldown_s:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+# Counters per stage ("<client label>.<method>"), see `print_resilience_summary`.
+stage_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(stage: str, **increments: float) -> None:
+    with _stats_lock:
+        stats = stage_stats.setdefault(
+            stage, {"calls": 0, "retries": 0, "throttles": 0, "waited_s": 0.0, "failures": 0}
+        )
+        for key, value in increments.items():
+            stats[key] += value
+
+
+def call_with_retry(
+    stage: str,
+    fn: Callable[..., Any],
+    *args: Any,
+    policy: Optional[RetryPolicy] = None,
+    limiter: Optional[AIMDLimiter] = None,
+    **kwargs: Any,
+) -> Any:
+    """Call `fn(*args, **kwargs)` under `limiter`, retrying throttled/transient errors."""
+    policy = policy or RetryPolicy()
+    _count(stage, calls=1)
+    for attempt in range(1, policy.max_attempts + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as exc:
+            throttled = is_throttle(exc)
+            if limiter is not None:
+                limiter.release(throttled=throttled)
+            if not is_retryable(exc) or attempt == policy.max_attempts:
+                _count(stage, failures=1)
+                raise
+            time.sleep(_retry_wait(stage, exc, attempt, policy))
+            continue
+        if limiter is not None:
+            limiter.release()
+        return result
+
+
+def _retry_wait(stage: str, exc: Exception, attempt: int, policy: RetryPolicy) -> float:
+    """Count a retry of `stage` and return how long to wait before it."""
+    throttled = is_throttle(exc)
+    wait = retry_after_s(exc)
+    wait = policy.backoff(attempt) if wait is None else wait + random.uniform(0, 0.5)
+    _count(stage, retries=1, throttles=int(throttled), waited_s=wait)
+    print(
+        f"{stage}: {'throttled' if throttled else type(exc).__name__} "
+        f"(status {status_code(exc)}), retry {attempt}/{policy.max_attempts - 1} in {wait:.1f}s"
+    )
+    return wait
+
+
+async def acall_with_retry(
+    stage: str,
+    fn: Callable[..., Awaitable[Any]],
+    *args: Any,
+    policy: Optional[RetryPolicy] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    **kwargs: Any,
+) -> Any:
+    """Await `fn(*args, **kwargs)` under `semaphore`, retrying throttled/transient errors."""
+    policy = policy or RetryPolicy()
+    _count(stage, calls=1)
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            if semaphore is not None:
+                async with semaphore:
+                    return await fn(*args, **kwargs)
+            return await fn(*args, **kwargs)
+        except Exception as exc:
+            if not is_retryable(exc) or attempt == policy.max_attempts:
+                _count(stage, failures=1)
+                raise
+            await asyncio.sleep(_retry_wait(stage, exc, attempt, policy))
+
+
+_END = object()
+
+
+class ResilientPaged:
+    """
+    Lazily paged SDK result (`ItemPaged`) fetching each page through `call_with_retry`.
+
+    A page that fails is fetched again from the continuation token of the last
+    page received, so a throttled query or listing resumes where it stopped
+    instead of restarting (or duplicating items).
+    """
+
+    def __init__(
+        self, paged: Any, stage: str, limiter: Optional[AIMDLimiter], policy: RetryPolicy
+    ) -> None:
+        self._paged = paged
+        self._stage = stage
+        self._limiter = limiter
+        self._policy = policy
+
+    def by_page(self, continuation_token: Optional[str] = None) -> Iterator[List[Any]]:
+        state: Dict[str, Any] = {"pages": None, "token": continuation_token}
+
+        def _fetch() -> Any:
+            if state["pages"] is None:
+                state["pages"] = self._paged.by_page(state["token"])
+            try:
+                return next(state["pages"], _END)
+            except Exception:
+                state["pages"] = None
+                raise
+
+        while True:
+            page = call_with_retry(self._stage, _fetch, policy=self._policy, limiter=self._limiter)
+            if page is _END:
+                return
+            page = list(page)
+            state["token"] = state["pages"].continuation_token
+            yield page
+
+    def __iter__(self) -> Iterator[Any]:
+        for page in self.by_page():
+            yield from page
+
+
+class ResilientPoller:
+    """
+    SDK `LROPoller` whose `result()` is retried through `call_with_retry`.
+
+    A failed wait is retried on a poller rebuilt with `resume(token)` from the
+    operation's continuation token, so the long-running operation is not
+    submitted again. Waiting is not admitted by the limiter (it can last minutes).
+    """
+
+    def __init__(
+        self, poller: Any, resume: Callable[[str], Any], stage: str, policy: RetryPolicy
+    ) -> None:
+        self._poller = poller
+        self._resume = resume
+        self._stage = stage
+        self._policy = policy
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._poller, name)
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        token = self._poller.continuation_token()
+
+        def _wait() -> Any:
+            try:
+                return self._poller.result(timeout)
+            except Exception:
+                self._poller = self._resume(token)
+                raise
+
+        return call_with_retry(self._stage, _wait, policy=self._policy)
+
+
+def _is_instance_of(obj: Any, class_name: str) -> bool:
+    return any(cls.__name__ == class_name for cls in type(obj).__mro__)
+
+
+class ResilientClient:
+    """
+    Proxy running every method call of an SDK client through `call_with_retry`.
+
+    Sub-clients (`client_oai.chat.completions`, `client_oai.files`, ...) are
+    proxied with the same label, limiter and policy; plain attributes (ids,
+    properties, response headers) are returned unchanged. Paged results and pollers returned by a
+    call are wrapped in `ResilientPaged` / `ResilientPoller`.
+    """
+
+    def __init__(
+        self,
+        target: Any,
+        label: str,
+        limiter: Optional[AIMDLimiter] = None,
+        policy: Optional[RetryPolicy] = None,
+    ) -> None:
+        self._target = target
+        self._label = label
+        self._limiter = limiter
+        self._policy = policy or RetryPolicy()
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._target, name)
+        if callable(attr):
+            def _call(*args: Any, **kwargs: Any) -> Any:
+                stage = f"{self._label}.{name}"
+                result = call_with_retry(
+                    stage, attr, *args, policy=self._policy, limiter=self._limiter, **kwargs
+                )
+                if _is_instance_of(result, "ItemPaged"):
+                    return ResilientPaged(result, f"{stage}.page", self._limiter, self._policy)
+                if _is_instance_of(result, "LROPoller"):
+                    return ResilientPoller(
+                        result,
+                        lambda token: attr(*args, **{**kwargs, "continuation_token": token}),
+                        f"{stage}.result",
+                        self._policy,
+                    )
+                return result
+
+            return _call
+        if type(attr).__module__.split(".")[0] in ("openai", "azure") and not isinstance(attr, Mapping):
+            return ResilientClient(attr, self._label, self._limiter, self._policy)
+        return attr
+
+
+def print_resilience_summary() -> None:
+    """Print retries, throttles and time spent backing off per stage."""
+    with _stats_lock:
+        rows = sorted(stage_stats.items())
+    if not any(stats["retries"] or stats["failures"] for _, stats in rows):
+        return
+    print("\n========== Retries / throttling ==========")
+    for stage, stats in rows:
+        print(
+            f"{stage}: {int(stats['calls'])} calls, {int(stats['retries'])} retries "
+            f"({int(stats['throttles'])} throttled), {stats['waited_s']:.1f}s waited, "
+            f"{int(stats['failures'])} failed"
+        )